@@ -3,15 +3,173 @@ import os
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                             QGridLayout, QLabel, QPushButton, QFileDialog, QComboBox, 
                             QSpinBox, QGroupBox, QScrollArea, QLineEdit, QToolTip,
-                            QRadioButton, QButtonGroup, QMessageBox, QCheckBox, QFrame)
-from PyQt5.QtGui import QPixmap, QImage, QPainter, QPen, QColor
-from PyQt5.QtCore import Qt, QPoint, QRect, QTimer, QPropertyAnimation, QEasingCurve
+                            QRadioButton, QButtonGroup, QMessageBox, QCheckBox, QFrame, QDoubleSpinBox,
+                            QGraphicsView, QGraphicsScene, QSlider, QTableWidget, QTableWidgetItem,
+                            QHeaderView, QAbstractItemView, QListWidget, QListWidgetItem, QProgressDialog)
+from PyQt5.QtGui import QPixmap, QImage, QPainter, QPen, QColor, QIcon, QPalette
+from PyQt5.QtCore import (Qt, QPoint, QRect, QRectF, QSize, QTimer, QPropertyAnimation, QEasingCurve, QThread,
+                          pyqtSignal, pyqtProperty, QFileSystemWatcher, QObject, QEvent)
+from collections import OrderedDict
 import numpy as np
 from PIL import Image, ImageDraw
 import multiprocessing as mp
 from functools import partial
-import heapq
 import math
+import hashlib
+import json
+import html
+import re
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import io
+import uuid
+import queue
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib import request as urllib_request
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# resource 只在類Unix系統提供，用於回報記憶體峰值
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# tifffile 為可選套件，安裝後可讀取超過4個波段的TIFF
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+# 相同區塊預檢所使用的區塊大小，以及每次比較的像素列數 (限制逐像素比較的暫存大小)
+IDENTICAL_BLOCK_SIZE = 16
+IDENTICAL_CHUNK_ROWS = 1024
+
+# 差距度量方式選項：簡化SSIM沿用舊版定義 (數值等同MAE)，完整SSIM以窗口平均、變異數與共變異數計算 (差距為 1 - SSIM)
+METRIC_OPTIONS = ["MSE (均方誤差)", "MAE (平均絕對誤差)", "SSIM-MAE (簡化SSIM，數值同MAE)", "SSIM (完整結構相似性)"]
+
+# 舊版的度量方式名稱，讀取舊的工作階段與結果檔時轉為目前的名稱
+LEGACY_METRIC_NAMES = {"SSIM (結構相似性)": METRIC_OPTIONS[2]}
+
+# 度量方式的簡短名稱，用於同時顯示多種度量
+METRIC_SHORT_NAMES = dict(zip(METRIC_OPTIONS, ("MSE", "MAE", "SSIM-MAE", "SSIM")))
+
+# 完整SSIM的穩定常數 (相對於圖像數值上限)
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+# 列帶並行計算的最小列帶高度
+MIN_BAND_HEIGHT = 64
+
+# 選擇執行後端的成本模型參數 (依實測粗估)
+BAND_PIXEL_COST = 8e-8          # 每個像素每個通道的向量化計算時間(秒)
+THREAD_EFFICIENCY = 0.6         # NumPy釋放GIL後多執行緒的平均並行效率
+THREAD_START_COST = 0.001       # 啟動一個工作執行緒的時間(秒)
+PROCESS_SPAWN_COST = 0.15       # 啟動一個工作進程的時間(秒)
+PROCESS_TRANSFER_COST = 2e-9    # 每個位元組序列化並傳送到工作進程的時間(秒)
+
+# 在記憶體上限內規劃搜尋時，列帶高度最低可降到的列數
+MEMORY_MIN_BAND_HEIGHT = 16
+
+# 搜尋結果的差距圖，diff1/diff2 以 [(y - y0) // stride, (x - x0) // stride] 索引
+# stats 為可選的全域統計累加量 (見 band_global_stats)；memory 為記憶體上限下採用的搜尋計畫 (見 plan_search_memory)
+# skipped 為完全相同而未計算的窗口數，zeroed 為同樣完全相同、但與需要計算的窗口一起計算後才設為0的窗口數
+ScoreMaps = namedtuple("ScoreMaps", ["diff1", "diff2", "x0", "y0", "skipped", "backend", "stride", "stats", "memory",
+                                     "zeroed"], defaults=(1, None, None, 0))
+
+# 全域統計每張圖像的累加量：像素數、平方誤差和、絕對誤差和、Σx、Σy、Σx²、Σy²、Σxy，之後接誤差直方圖
+GLOBAL_STAT_FIELDS = 8
+GLOBAL_HIST_BINS = 64
+
+# 累加全域統計時每次轉為float64的像素列數
+STATS_CHUNK_ROWS = 64
+
+# 結果縮減方式
+RESULT_REDUCERS = {"grid": "網格分區", "nms": "非極大值抑制 (NMS)", "quadtree": "自適應四叉樹"}
+
+# 結果表的結構化陣列欄位：窗口起點、分數、兩張圖像與GT的差距、所屬網格 (非網格分區的結果為 -1)
+# 與度量方式 (METRIC_OPTIONS 的索引，未知時為 -1)
+RESULT_DTYPE = np.dtype([("x", np.int32), ("y", np.int32), ("score", np.float64), ("diff1", np.float64),
+                         ("diff2", np.float64), ("cell_x", np.int32), ("cell_y", np.int32), ("metric", np.int8)])
+
+# 結果可排序的欄位與顯示名稱
+RESULT_SORT_KEYS = {"score": "分數", "diff1": "圖1差距", "diff2": "圖2差距", "x": "X", "y": "Y"}
+
+# 篩選條件中的比較運算子
+RESULT_FILTER_OPERATORS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+                           "==": np.equal, "!=": np.not_equal}
+
+# 非極大值抑制初始排序的候選數 (相對於最多結果數的倍數)
+NMS_CANDIDATE_FACTOR = 16
+
+# 客戶端在背景等待比較服務搜尋時查詢狀態的間隔 (秒)
+SERVICE_POLL_INTERVAL = 0.5
+
+# 比較服務保存的每筆搜尋結果 (五個數值的tuple與列表中的參照) 約佔用的位元組數
+SEARCH_RESULT_BYTES = 216
+
+# 熱圖圖塊大小與圖塊快取上限
+HEATMAP_TILE_SIZE = 256
+TILE_CACHE_SIZE = 512
+
+# 熱圖背景的GT預覽最大邊長
+HEATMAP_BACKGROUND_SIZE = 2048
+
+# 漸進式搜尋每一輪使用的起點步長，最後一輪為窮舉搜尋
+PROGRESSIVE_STRIDES = (8, 4, 2, 1)
+
+# 監看資料夾時視為圖像的副檔名
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# 監看資料夾的輪詢間隔(毫秒)與每個檔案保留的歷史比較次數
+WATCH_POLL_INTERVAL = 2000
+WATCH_HISTORY_SIZE = 20
+
+# 黑暗主題的調色盤顏色，亮色主題使用系統預設調色盤
+DARK_THEME_COLORS = {
+    QPalette.Window: "#2D2D30",
+    QPalette.WindowText: "#E0E0E0",
+    QPalette.Base: "#333337",
+    QPalette.AlternateBase: "#252526",
+    QPalette.Text: "#E0E0E0",
+    QPalette.Button: "#333337",
+    QPalette.ButtonText: "#E0E0E0",
+    QPalette.ToolTipBase: "#252526",
+    QPalette.ToolTipText: "#E0E0E0",
+    QPalette.Highlight: "#0E639C",
+    QPalette.HighlightedText: "#FFFFFF",
+}
+DARK_THEME_DISABLED_TEXT = "#959595"
+
+# 主題過渡動畫的時間(毫秒)
+THEME_TRANSITION_DURATION = 300
+
+# PIL可直接處理的一般圖像模式，其他模式(16位元、多頁等)以 MultiBandImage 保存
+STANDARD_IMAGE_MODES = ('1', 'L', 'P', 'LA', 'PA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr')
+
+# 逐波段差距最多顯示的波段數
+MAX_BAND_DETAILS = 16
+
+# 背景解碼圖像的執行緒數
+IMAGE_LOAD_WORKERS = 4
+
+# 縮圖大小與磁碟快取位置
+THUMBNAIL_SIZE = 160
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "image_comparison_tool", "thumbnails")
+
+# 匯出差距圖時每次寫入的列數
+EXPORT_CHUNK_ROWS = 1024
+
+# 結果報告聯絡表的排列：每列的結果數、每張的列數、區塊間距與標題列高度 (像素)
+REPORT_COLUMNS = 4
+REPORT_ROWS_PER_SHEET = 25
+REPORT_GAP = 4
+REPORT_LABEL_HEIGHT = 16
+
+# 合併分片結果時必須一致的參數
+SHARD_COMPAT_KEYS = ("window_size", "grid_size", "mode", "metric", "grayscale", "image_sizes", "band_weights")
 
 # 全局函數，用於計算區域差異
 def calculate_region_difference(region1, region2, metric="MSE"):
@@ -20,10 +178,21 @@ def calculate_region_difference(region1, region2, metric="MSE"):
         return np.mean((region1 - region2) ** 2)
     elif metric == "MAE (平均絕對誤差)":
         return np.mean(np.abs(region1 - region2))
-    elif metric == "SSIM (結構相似性)":
-        # 對於SSIM，我們返回1-SSIM，因為我們要找的是差異最大/最小的點
-        # 簡化版本的實現，實際上應該使用專門的SSIM庫
+    elif metric == METRIC_OPTIONS[2]:
+        # 簡化版SSIM，數值與MAE相同
         return np.mean(np.abs(region1 - region2))  # 簡化實現
+    elif metric == METRIC_OPTIONS[3]:
+        # 完整SSIM，整個區域視為一個窗口，各波段分別計算後平均，返回1-SSIM
+        x = region1.reshape(region1.shape[0] * region1.shape[1], -1)
+        g = region2.reshape(x.shape)
+        mean_x, mean_g = x.mean(axis=0), g.mean(axis=0)
+        variance = x.var(axis=0) + g.var(axis=0)
+        covariance = ((x - mean_x) * (g - mean_g)).mean(axis=0)
+        c1 = (SSIM_K1 * 255.0) ** 2
+        c2 = (SSIM_K2 * 255.0) ** 2
+        ssim = (((2 * mean_x * mean_g + c1) * (2 * covariance + c2))
+                / ((mean_x * mean_x + mean_g * mean_g + c1) * (variance + c2)))
+        return float(np.mean(1.0 - ssim))
     else:
         return np.mean((region1 - region2) ** 2)  # 默認使用MSE
 
@@ -36,10 +205,10 @@ def compare_regions(img1, img2, gt, start_x, start_y, window_size, mode, metric)
         region2 = img2.crop((start_x, start_y, start_x + window_size, start_y + window_size))
         region_gt = gt.crop((start_x, start_y, start_x + window_size, start_y + window_size))
         
-        # 轉換為numpy數組
-        region1_array = np.array(region1)
-        region2_array = np.array(region2)
-        region_gt_array = np.array(region_gt)
+        # 轉換為numpy數組 (使用浮點數，避免uint8相減溢位)
+        region1_array = np.array(region1, dtype=np.float64)
+        region2_array = np.array(region2, dtype=np.float64)
+        region_gt_array = np.array(region_gt, dtype=np.float64)
         
         # 計算差異
         diff1_gt = calculate_region_difference(region1_array, region_gt_array, metric)
@@ -50,9 +219,2811 @@ def compare_regions(img1, img2, gt, start_x, start_y, window_size, mode, metric)
         else:  # 圖像2最接近GT，圖像1最遠離GT
             score = diff1_gt - diff2_gt
         
-        return (start_x, start_y, score, diff1_gt, diff2_gt)
-    except Exception as e:
-        return (start_x, start_y, float('-inf'), 0, 0)
+        return (start_x, start_y, score, diff1_gt, diff2_gt)
+    except Exception as e:
+        return (start_x, start_y, float('-inf'), 0, 0)
+
+# 全局函數，用於找出三張圖像內容完全相同的區塊
+def compute_identical_blocks(img1, img2, gt, block_size=IDENTICAL_BLOCK_SIZE):
+    """將三張圖像切成固定大小區塊，回傳各區塊是否三者完全相同的布林陣列
+
+    逐像素比較後以 reshape 歸併為區塊，每次只處理 IDENTICAL_CHUNK_ROWS 列；邊緣不足一個區塊的部分補為相同
+    """
+    arrays = [np.asarray(img1), np.asarray(img2), np.asarray(gt)]
+    
+    # 只比較三張圖像共同覆蓋的範圍
+    height = min(arr.shape[0] for arr in arrays)
+    width = min(arr.shape[1] for arr in arrays)
+    blocks_y = math.ceil(height / block_size)
+    blocks_x = math.ceil(width / block_size)
+    
+    identical = np.zeros((blocks_y, blocks_x), dtype=bool)
+    # 形狀或資料型態不同時內容不可能相同
+    if len({(arr.shape[2:], arr.dtype) for arr in arrays}) != 1:
+        return identical
+    
+    chunk_blocks = max(1, IDENTICAL_CHUNK_ROWS // block_size)
+    for by0 in range(0, blocks_y, chunk_blocks):
+        by1 = min(by0 + chunk_blocks, blocks_y)
+        y0, y1 = by0 * block_size, min(by1 * block_size, height)
+        a, b, c = (arr[y0:y1, :width] for arr in arrays)
+        equal = a == b
+        equal &= b == c
+        equal = equal.reshape(y1 - y0, width, -1)
+        if y1 - y0 < (by1 - by0) * block_size or width < blocks_x * block_size:
+            padded = np.ones(((by1 - by0) * block_size, blocks_x * block_size, equal.shape[2]), dtype=bool)
+            padded[:y1 - y0, :width] = equal
+            equal = padded
+        # 先沿連續的記憶體歸併區塊內的列，再歸併區塊內的行與波段
+        rows_equal = np.logical_and.reduce(equal.reshape(by1 - by0, block_size, -1), axis=1)
+        identical[by0:by1] = rows_equal.reshape(by1 - by0, blocks_x, -1).all(axis=2)
+    
+    return identical
+
+# 全局函數，用於判斷窗口是否完全落在相同區塊內
+def identical_window_mask(identical_blocks, window_size, max_start_x, max_start_y, block_size=IDENTICAL_BLOCK_SIZE,
+                          stride=1, first_y=0, first_x=0):
+    """回傳標記完全落在相同區塊內的窗口起點的布林陣列
+
+    只計算起點Y介於 first_y 與 max_start_y、X介於 first_x 與 max_start_x 之間 (first_y、first_x 為 stride 的倍數)
+    且座標為 stride 倍數的起點，形狀為 ((max_start_y - first_y) // stride + 1, (max_start_x - first_x) // stride + 1)；
+    逐列帶呼叫時只需列帶大小的暫存
+    """
+    xs = np.arange(first_x, max_start_x + 1, stride)
+    ys = np.arange(first_y, max_start_y + 1, stride)
+    # 只對這些起點會覆蓋的區塊列建立積分圖
+    first_block = first_y // block_size
+    blocks = identical_blocks[first_block:(max_start_y + window_size - 1) // block_size + 1]
+    
+    # 以區塊遮罩的積分圖在O(1)時間內計算窗口覆蓋的「不相同」區塊數量，為0即完全落在相同區塊內；
+    # 以int32就地加減，只需兩個窗口起點大小的暫存陣列
+    prefix = np.zeros((blocks.shape[0] + 1, blocks.shape[1] + 1), dtype=np.int32)
+    prefix[1:, 1:] = np.cumsum(np.cumsum(~blocks, axis=0), axis=1)
+    
+    bx0 = xs // block_size
+    bx1 = (xs + window_size - 1) // block_size + 1
+    by0 = (ys // block_size - first_block)[:, None]
+    by1 = ((ys + window_size - 1) // block_size + 1 - first_block)[:, None]
+    
+    different = prefix[by1, bx1]
+    different -= prefix[by0, bx1]
+    different -= prefix[by1, bx0]
+    different += prefix[by0, bx0]
+    return different == 0
+
+# 全局函數，找出列帶內需要計算的區域
+def plan_band_spans(skip_mask, window_size, stride=1):
+    """依列帶的相同窗口遮罩 (見 identical_window_mask) 回傳需要計算的 [(列0, 列1, 行0, 行1), ...] (遮罩索引，半開區間)
+
+    先找出含有不相同窗口的行，間隔小於一個窗口的行段合併 (分開計算需重複讀取窗口寬度的像素，不比直接計算划算)，
+    各行段再去除頭尾完全相同的列；行段內仍落在相同區域的窗口由呼叫者計算後設為0
+    """
+    needed = ~skip_mask
+    columns = np.flatnonzero(needed.any(axis=0))
+    if not columns.size:
+        return []
+    # 相鄰需要計算的行之間，略過的起點距離達到窗口大小時才分成兩段
+    breaks = np.flatnonzero((np.diff(columns) - 1) * stride >= window_size)
+    starts = np.concatenate(([columns[0]], columns[breaks + 1]))
+    ends = np.concatenate((columns[breaks], [columns[-1]])) + 1
+    spans = []
+    for col0, col1 in zip(starts.tolist(), ends.tolist()):
+        rows = np.flatnonzero(needed[:, col0:col1].any(axis=1))
+        spans.append((int(rows[0]), int(rows[-1]) + 1, col0, col1))
+    return spans
+
+# 全局函數，用於解析度量方式名稱
+def resolve_metric(name):
+    """將度量方式簡稱(如 MSE)、完整名稱或舊版名稱轉換為完整的度量方式名稱"""
+    name = LEGACY_METRIC_NAMES.get(name, name)
+    for option in METRIC_OPTIONS:
+        if name == option or name.upper() == option.split(" ")[0]:
+            return option
+    raise ValueError(f"未知的差距度量方式: {name}")
+
+# 全局函數，用於計算搜尋範圍
+def compute_search_bounds(img1, img2, gt, window_size):
+    """計算所有圖像都能裁剪的最大起始座標，圖像小於窗口時回傳None"""
+    widths = [img.size[0] for img in (img1, img2, gt)]
+    heights = [img.size[1] for img in (img1, img2, gt)]
+    if min(widths) < window_size or min(heights) < window_size:
+        return None
+    return min(widths) - window_size, min(heights) - window_size
+
+# 全局函數，計算每個像素的誤差
+def pixel_error(region, region_gt, metric, band_weights=None, per_band=False):
+    """計算兩個區域逐像素(多通道相加)的誤差，與 calculate_region_difference 的定義一致
+
+    整數像素的誤差總和在float64下可精確表示，因此分片或分帶計算的結果與整張計算完全相同。
+    band_weights 為各波段的權重 (通道加權相加)；per_band=True 時保留波段維度不相加。
+    完整SSIM沒有逐像素的定義，以絕對誤差表示
+    """
+    diff = region.astype(np.float64) - region_gt
+    if metric == "MSE (均方誤差)" or metric not in METRIC_OPTIONS:
+        error = diff * diff
+    else:  # MAE、簡化版SSIM與完整SSIM
+        error = np.abs(diff, out=diff)
+    if error.ndim == 2:
+        return error[..., None] if per_band else error
+    if per_band:
+        return error
+    return error @ band_weights if band_weights is not None else error.sum(axis=2)
+
+# 全局函數，以積分圖計算所有窗口的平均值
+def box_mean(values, window_size, channels=1, stride=1):
+    """回傳每個窗口起點對應的 window_size x window_size 區域平均值 (再除以通道數)
+
+    stride > 1 時只計算列、行索引為 stride 倍數的起點；values 可帶有第三維 (各波段分開計算)，
+    所有波段在同一次積分圖運算中完成
+    """
+    divisor = window_size * window_size * channels
+    if stride > 1 and window_size % stride == 0:
+        # 步長整除窗口時，先把誤差加總成 stride x stride 的小區塊，只需對小區塊建立積分圖
+        block_rows, block_cols = values.shape[0] // stride, values.shape[1] // stride
+        values = values[:block_rows * stride, :block_cols * stride].reshape(
+            block_rows, stride, block_cols, stride, *values.shape[2:]).sum(axis=(1, 3))
+        window_size //= stride
+        stride = 1
+    
+    height, width = values.shape[:2]
+    integral = np.zeros((height + 1, width + 1, *values.shape[2:]), dtype=np.float64)
+    np.cumsum(values, axis=0, out=integral[1:, 1:])
+    np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+    lattice = (slice(0, height - window_size + 1, stride), slice(0, width - window_size + 1, stride))
+    sums = (integral[window_size:, window_size:][lattice] - integral[:-window_size, window_size:][lattice]
+            - integral[window_size:, :-window_size][lattice] + integral[:-window_size, :-window_size][lattice])
+    sums /= divisor
+    return sums
+
+# 全局函數，一次計算多種度量的窗口差距
+def fused_window_metrics(region1, region2, region_gt, window_size, metrics, stride=1, band_weights=None,
+                         max_value=255.0):
+    """在同一次積分圖運算中計算 metrics 中各度量的窗口差距，回傳 (diff1, diff2)，最後一維依 metrics 順序排列
+
+    完整SSIM以窗口平均、變異數與共變異數計算 (差距以 1 - SSIM 表示)，需要各波段的 Σx、Σx²、Σxg、Σg、Σg²；
+    同時計算時 MSE 直接由這些和求得 (平方誤差和 = Σx² - 2Σxg + Σg²)，MAE 與單獨的 MSE 則先依權重合併波段，
+    簡化SSIM與MAE共用同一個平面。各波段結果依權重平均
+    """
+    gt = region_gt.astype(np.float64)
+    if gt.ndim == 2:
+        gt = gt[..., None]
+    channels = gt.shape[2]
+    weights = np.full(channels, 1.0 / channels) if band_weights is None else band_weights / np.sum(band_weights)
+    with_moments = METRIC_OPTIONS[3] in metrics
+    with_absolute = METRIC_OPTIONS[1] in metrics or METRIC_OPTIONS[2] in metrics
+    merged_count = 2 * ((METRIC_OPTIONS[0] in metrics and not with_moments) + with_absolute)
+    moment_count = 8 if with_moments else 0
+    
+    # 各波段的動差 (GT共用) 在前，依權重合併波段的誤差在後，全部寫入同一個陣列，只建立一次積分圖
+    stacked = np.empty((*gt.shape[:2], moment_count * channels + merged_count), dtype=np.float64)
+    moments = stacked[:, :, :moment_count * channels].reshape(*gt.shape[:2], moment_count, channels)
+    merged = stacked[:, :, moment_count * channels:]
+    if with_moments:
+        moments[:, :, 0] = gt
+        np.multiply(gt, gt, out=moments[:, :, 1])
+    plane = 0
+    for image, region in enumerate((region1, region2)):
+        x = region.astype(np.float64).reshape(gt.shape)
+        if with_moments:
+            moments[:, :, 2 + 3 * image] = x
+            np.multiply(x, x, out=moments[:, :, 3 + 3 * image])
+            np.multiply(x, gt, out=moments[:, :, 4 + 3 * image])
+        error = np.subtract(x, gt, out=x)
+        if METRIC_OPTIONS[0] in metrics and not with_moments:
+            merged[:, :, plane] = (error * error) @ weights
+            plane += 1
+        if with_absolute:
+            merged[:, :, plane] = np.abs(error, out=error) @ weights
+            plane += 1
+    del moments, merged, x, error
+    means = box_mean(stacked, window_size, stride=stride)
+    del stacked
+    merged_means = iter(np.moveaxis(means[:, :, moment_count * channels:], 2, 0))
+    
+    diffs = []
+    for image in range(2):
+        values = {}
+        if METRIC_OPTIONS[0] in metrics and not with_moments:
+            values[METRIC_OPTIONS[0]] = next(merged_means)
+        if with_absolute:
+            values[METRIC_OPTIONS[1]] = values[METRIC_OPTIONS[2]] = next(merged_means)
+        if with_moments:
+            moment_means = means[:, :, :moment_count * channels].reshape(*means.shape[:2], moment_count, channels)
+            mean_g, mean_g2 = moment_means[:, :, 0], moment_means[:, :, 1]
+            mean_x, mean_x2, mean_xg = (moment_means[:, :, 2 + 3 * image + k] for k in range(3))
+            values[METRIC_OPTIONS[0]] = (mean_x2 - 2 * mean_xg + mean_g2) @ weights
+            c1 = (SSIM_K1 * max_value) ** 2
+            c2 = (SSIM_K2 * max_value) ** 2
+            variance = (mean_x2 - mean_x * mean_x) + (mean_g2 - mean_g * mean_g)
+            covariance = mean_xg - mean_x * mean_g
+            ssim = (((2 * mean_x * mean_g + c1) * (2 * covariance + c2))
+                    / ((mean_x * mean_x + mean_g * mean_g + c1) * (variance + c2)))
+            values[METRIC_OPTIONS[3]] = (1.0 - ssim) @ weights
+        diffs.append(np.stack([values[metric] for metric in metrics], axis=-1))
+    return diffs[0], diffs[1]
+
+# 全局函數，圖像數值的上限
+def image_max_value(dtype):
+    """整數圖像為該型別的最大值，浮點圖像視為0~1"""
+    return float(np.iinfo(dtype).max) if np.issubdtype(dtype, np.integer) else 1.0
+
+# 全局函數，PIL圖像轉為陣列後的數值上限
+def pil_max_value(image):
+    """只轉換一個像素來取得陣列型別，不需複製整張圖像"""
+    return image_max_value(np.asarray(image.crop((0, 0, 1, 1))).dtype)
+
+# 全局函數，累加一個區域的全域統計
+def band_global_stats(region1, region2, region_gt, max_value, chunk_rows=STATS_CHUNK_ROWS):
+    """回傳形狀為 (2, GLOBAL_STAT_FIELDS + GLOBAL_HIST_BINS) 的累加量，各列帶的結果相加即為整張圖像的統計
+
+    每次只轉換 chunk_rows 列為float64，暫存大小與列帶高度無關
+    """
+    # 直方圖以絕對誤差分組，整數圖像每組涵蓋相同個數的整數值
+    hist_scale = GLOBAL_HIST_BINS / (max_value + 1 if max_value > 1 else max_value)
+    stats = np.zeros((2, GLOBAL_STAT_FIELDS + GLOBAL_HIST_BINS), dtype=np.float64)
+    for start in range(0, len(region_gt), chunk_rows):
+        rows = slice(start, start + chunk_rows)
+        gt = region_gt[rows].astype(np.float64).ravel()
+        gt_sum = gt.sum()
+        gt_square_sum = np.dot(gt, gt)
+        for i, region in enumerate((region1, region2)):
+            values = region[rows].astype(np.float64).ravel()
+            diff = values - gt
+            abs_diff = np.abs(diff)
+            stats[i, :GLOBAL_STAT_FIELDS] += (values.size, np.dot(diff, diff), abs_diff.sum(), values.sum(), gt_sum,
+                                              np.dot(values, values), gt_square_sum, np.dot(values, gt))
+            bins = np.minimum((abs_diff * hist_scale).astype(np.int64), GLOBAL_HIST_BINS - 1)
+            stats[i, GLOBAL_STAT_FIELDS:] += np.bincount(bins, minlength=GLOBAL_HIST_BINS)
+    return stats
+
+# 全局函數，由累加量計算全域統計
+def summarize_global_stats(stats, max_value):
+    """回傳兩張圖像各自與GT的全域 MSE、MAE、PSNR、整張單一窗口SSIM 與誤差直方圖
+
+    whole_image_ssim 把整張圖像 (所有波段) 當作一個窗口，以平均值、變異數與共變異數計算，可由列帶累加量精確合併；
+    它不是一般SSIM工具回報的局部窗口SSIM平均值，兩者數值不可直接比較
+    """
+    c1 = (0.01 * max_value) ** 2
+    c2 = (0.03 * max_value) ** 2
+    summary = []
+    for row in np.asarray(stats, dtype=np.float64):
+        count, square_sum, abs_sum, sum_x, sum_y, sum_xx, sum_yy, sum_xy = row[:GLOBAL_STAT_FIELDS]
+        count = max(count, 1.0)
+        mse = square_sum / count
+        mean_x, mean_y = sum_x / count, sum_y / count
+        var_x = sum_xx / count - mean_x * mean_x
+        var_y = sum_yy / count - mean_y * mean_y
+        covariance = sum_xy / count - mean_x * mean_y
+        ssim = (((2 * mean_x * mean_y + c1) * (2 * covariance + c2))
+                / ((mean_x * mean_x + mean_y * mean_y + c1) * (var_x + var_y + c2)))
+        summary.append({
+            "mse": mse,
+            "mae": abs_sum / count,
+            "psnr": 10 * math.log10(max_value * max_value / mse) if mse > 0 else float('inf'),
+            "whole_image_ssim": ssim,
+            "histogram": row[GLOBAL_STAT_FIELDS:].astype(np.int64).tolist(),
+        })
+    return summary
+
+# 全局函數，將全域統計格式化為文字
+def format_global_stats(summary):
+    return "\n".join(f"圖{i+1}與GT: MSE {item['mse']:.4f}, MAE {item['mae']:.4f}, "
+                     f"PSNR {item['psnr']:.2f} dB, 整張單窗SSIM {item['whole_image_ssim']:.4f}"
+                     for i, item in enumerate(summary))
+
+# 全局函數，計算一個列帶內所有窗口的差距
+def compute_band_differences(arr1, arr2, arr_gt, band, window_size, metric, stride=1, stats_cols=None,
+                             band_weights=None, per_band=False, sample=False):
+    """計算起點Y落在列帶 band=(y0, y1) 內所有窗口與GT的差距，回傳 (y0, x0, diff1, diff2, 全域統計)
+
+    band 可附帶第三個元素 (r0, r1)，表示該列帶負責累加全域統計的列範圍 (僅取前 stats_cols 行)，
+    不需統計時全域統計為None；第四個元素 (x0, x1) 限制只計算起點X落在其中的窗口，省略或為None時計算所有行。NumPy的向量化運算會釋放GIL，因此可由多個執行緒同時處理不同列帶。
+    per_band=True 時 diff1、diff2 多一個波段維度；metric 為度量方式的元組時一次計算所有度量，多一個度量維度。
+    sample=True 且 stride > 1 時每個窗口只取列、行間隔 stride 的像素估計差距，計算量約為 1/stride²
+    """
+    y0, y1 = band[:2]
+    x0, x1 = band[3] if len(band) > 3 and band[3] is not None else (0, arr_gt.shape[1] - window_size + 1)
+    stats = None
+    if len(band) > 2 and band[2] is not None:
+        # 統計與窗口差距在同一次讀取列帶時累加，不需再掃描整張圖像
+        stat_rows = slice(*band[2])
+        stats = band_global_stats(arr1[stat_rows, :stats_cols], arr2[stat_rows, :stats_cols],
+                                  arr_gt[stat_rows, :stats_cols], image_max_value(arr_gt.dtype))
+    if y0 >= y1:
+        empty = np.zeros((0, 0))
+        return y0, x0, empty, empty, stats
+    
+    rows = slice(y0, y1 - 1 + window_size)
+    cols = slice(x0, x1 - 1 + window_size)
+    region1, region2, region_gt = arr1[rows, cols], arr2[rows, cols], arr_gt[rows, cols]
+    lattice = None
+    if sample and stride > 1:
+        # 格點上的窗口取樣到的像素，恰為每隔 stride 取一列一行後陣列中的連續窗口
+        lattice = (math.ceil((y1 - y0) / stride), math.ceil((x1 - x0) / stride))
+        region1, region2, region_gt = (region[::stride, ::stride] for region in (region1, region2, region_gt))
+        window_size = math.ceil(window_size / stride)
+        stride = 1
+    region_gt = region_gt.astype(np.float64)
+    if not isinstance(metric, str):
+        diff1, diff2 = fused_window_metrics(region1, region2, region_gt, window_size, metric, stride,
+                                            band_weights, image_max_value(arr_gt.dtype))
+    elif metric == METRIC_OPTIONS[3]:
+        # 完整SSIM需要窗口的變異數與共變異數，以單一度量的 fused_window_metrics 計算
+        diff1, diff2 = (diff[..., 0] for diff in fused_window_metrics(
+            region1, region2, region_gt, window_size, (metric,), stride, band_weights, image_max_value(arr_gt.dtype)))
+    else:
+        if per_band:
+            channels = 1
+        elif band_weights is not None:
+            channels = float(np.sum(band_weights))
+        else:
+            channels = region_gt.shape[2] if region_gt.ndim == 3 else 1
+        diff1 = box_mean(pixel_error(region1, region_gt, metric, band_weights, per_band), window_size, channels, stride)
+        diff2 = box_mean(pixel_error(region2, region_gt, metric, band_weights, per_band), window_size, channels, stride)
+    if lattice is not None:
+        diff1 = diff1[:lattice[0], :lattice[1]]
+        diff2 = diff2[:lattice[0], :lattice[1]]
+    return y0, x0, diff1, diff2, stats
+
+# 多進程工作者共享的圖像數據，由進程池初始化時傳入一次，避免每個任務重複序列化
+_band_worker_args = None
+
+def _init_band_worker(*args):
+    """進程池初始化函數，保存本進程使用的圖像數據與計算參數"""
+    global _band_worker_args
+    _band_worker_args = args
+
+def _compute_band_task(band):
+    """進程池任務，計算一個列帶"""
+    arr1, arr2, arr_gt, window_size, metric, stride, stats_cols, band_weights, per_band, sample = _band_worker_args
+    return compute_band_differences(arr1, arr2, arr_gt, band, window_size, metric, stride, stats_cols,
+                                    band_weights, per_band, sample)
+
+# 全局函數，依窗口大小與並行數切分列帶
+def default_band_height(num_rows, window_size, workers):
+    """每個列帶需額外讀取 window_size-1 列，因此列帶高度至少為窗口大小的數倍以攤銷重疊的成本"""
+    return max(MIN_BAND_HEIGHT, 4 * window_size, math.ceil(num_rows / (workers * 4)))
+
+def plan_bands(num_rows, window_size, workers, band_height=None):
+    """將窗口起點的列切成數個列帶，回傳 [(y0, y1), ...]；band_height 省略時使用預設高度"""
+    band_height = band_height or default_band_height(num_rows, window_size, workers)
+    return [(y, min(y + band_height, num_rows)) for y in range(0, num_rows, band_height)]
+
+# 全局函數，選擇執行後端
+def choose_search_backend(height, width, channels, window_size, cpu_count=None):
+    """依圖像尺寸、窗口大小與核心數估算各後端的耗時，回傳 "serial"、"thread" 或 "process" 之一"""
+    cpu_count = cpu_count or mp.cpu_count()
+    if cpu_count <= 1:
+        return "serial"
+    
+    num_rows = height - window_size + 1
+    bands = plan_bands(num_rows, window_size, cpu_count)
+    # 列帶重疊部分會被重複計算
+    overlap = 1 + (window_size - 1) * len(bands) / max(num_rows, 1)
+    compute_time = height * width * channels * BAND_PIXEL_COST * overlap
+    parallelism = min(cpu_count, len(bands))
+    
+    estimates = {
+        "serial": compute_time,
+        "thread": compute_time / (parallelism * THREAD_EFFICIENCY) + THREAD_START_COST * parallelism,
+        "process": (compute_time / parallelism + PROCESS_SPAWN_COST * parallelism
+                    + 3 * height * width * channels * PROCESS_TRANSFER_COST * parallelism),
+    }
+    return min(estimates, key=estimates.get)
+
+# 全局函數，預估搜尋的記憶體用量
+def estimate_search_memory(height, width, channels, window_size, itemsize, workers, band_height, backend,
+                           map_itemsize=8, stride=1, metrics=1, per_band=False, allocate_maps=True, moments=False,
+                           sample=False, source_bytes=0):
+    """粗估一次搜尋的記憶體峰值 (位元組)：來源圖像、輸入陣列與差距圖，加上轉換輸入、搜尋時的列帶暫存
+    或縮減結果時的暫存 (三者不同時發生，取最大者)
+
+    各項係數依 3000x3000 與 4000x4000 圖像實測的峰值訂定並略為寬鬆。多進程後端的每個工作者各有一份輸入；
+    metrics > 1 為同時計算多種度量、moments=True 為需要窗口動差的完整SSIM (見 fused_window_metrics)；
+    source_bytes 為搜尋期間保留的來源圖像 (例如灰階轉換後的副本)
+    """
+    rows = max(height - window_size + 1, 0)
+    cols = max(width - window_size + 1, 0)
+    map_rows, map_cols = math.ceil(rows / stride), math.ceil(cols / stride)
+    map_cells = map_rows * map_cols
+    inputs = 3 * height * width * channels * itemsize
+    # 轉換為陣列時，裁剪後的圖像與編碼的暫存約為單張輸入的兩倍半
+    converting = inputs // 3 * 5 // 2
+    
+    band_rows = min(band_height, rows)
+    band_pixels = (band_rows + window_size - 1) * width
+    if sample and stride > 1:
+        band_pixels //= stride * stride
+    band_cells = math.ceil(band_rows / stride) * map_cols
+    map_depth = metrics * (channels if per_band else 1)
+    if metrics > 1 or moments:
+        # 各波段動差與合併誤差的平面、疊合後的副本與積分圖，加上GT與圖像的float64副本
+        band_bytes = band_pixels * 8 * (3 * (8 * channels + 2) + 4 * channels)
+    elif per_band:
+        band_bytes = band_pixels * (32 * channels + 8)
+    else:
+        # GT與圖像的float64副本、差值、合併波段後的誤差與積分圖
+        band_bytes = band_pixels * (24 * channels + 24)
+    # 窗口平均與兩張圖像的列帶結果
+    band_bytes += band_cells * 24 * map_depth
+    # 全域統計每次轉換 STATS_CHUNK_ROWS 列，與列帶計算先後進行
+    band_bytes = max(band_bytes, min(STATS_CHUNK_ROWS, band_rows + window_size - 1) * width * channels * 48)
+    concurrent = 1 if backend == "serial" else workers
+    # 配置器會保留已釋放的列帶暫存直到縮減結果之後：各執行緒的arena實測最多約一份，單執行緒約三分之一
+    # (多度量的暫存夠大，直接向系統配置並歸還)
+    retained = 0
+    if metrics == 1 and not moments:
+        retained = concurrent * band_bytes if backend == "thread" else band_bytes // 2
+    worker_inputs = inputs * workers if backend == "process" else 0
+    maps = 2 * map_cells * map_itemsize * map_depth if allocate_maps else 0
+    # 已完成但尚未寫入差距圖的列帶結果 (執行緒最多保留並行數兩倍)
+    pending = (1 if backend == "serial" else 2 * workers + 1) * 2 * band_cells * 8 * map_depth
+    searching = concurrent * band_bytes + pending
+    # 縮減結果時的float64分數圖、排序用的索引與遮罩
+    reduction = map_cells * (16 + 3 * map_itemsize // 2)
+    return source_bytes + inputs + worker_inputs + max(converting, maps + retained + max(searching, reduction))
+
+# 全局函數，在記憶體上限內規劃搜尋
+def plan_search_memory(budget, height, width, channels, window_size, itemsize, workers, backend, stride=1,
+                       metrics=1, per_band=False, allocate_maps=True, moments=False, sample=False, source_bytes=0):
+    """選擇列帶高度、並行數、後端與差距圖精度，使預估用量不超過 budget (位元組)
+
+    依序改用執行緒 (多進程的每個工作者各有一份輸入)、降低列帶高度、差距圖改為float32、減少並行數；
+    回傳 {"backend", "workers", "band_height", "map_dtype", "estimate", "budget"}，全部調整後仍超過上限時拋出 MemoryError
+    """
+    plan = {
+        "backend": backend,
+        "workers": workers,
+        "band_height": default_band_height(max(height - window_size + 1, 1), window_size, workers),
+        "map_dtype": "float64",
+    }
+    
+    def estimate():
+        return estimate_search_memory(height, width, channels, window_size, itemsize, plan["workers"],
+                                      plan["band_height"], plan["backend"], np.dtype(plan["map_dtype"]).itemsize,
+                                      stride, metrics, per_band, allocate_maps, moments, sample, source_bytes)
+    
+    while estimate() > budget:
+        if plan["backend"] == "process":
+            plan["backend"] = "thread"
+        elif plan["band_height"] > MEMORY_MIN_BAND_HEIGHT:
+            plan["band_height"] = max(MEMORY_MIN_BAND_HEIGHT, plan["band_height"] // 2)
+        elif allocate_maps and plan["map_dtype"] == "float64":
+            plan["map_dtype"] = "float32"
+        elif plan["workers"] > 1:
+            plan["workers"] //= 2
+        else:
+            raise MemoryError(f"預估記憶體 {format_memory_size(estimate())} 超過上限 {format_memory_size(budget)}，"
+                              f"請縮小搜尋範圍、改用分片或提高上限")
+    plan["estimate"] = estimate()
+    plan["budget"] = budget
+    return plan
+
+# 全局函數，記憶體計畫的文字說明
+def format_memory_plan(plan):
+    return (f"預估記憶體 {format_memory_size(plan['estimate'])} / 上限 {format_memory_size(plan['budget'])} "
+            f"({plan['backend']} 後端 {plan['workers']} 並行，列帶高度 {plan['band_height']}，差距圖 {plan['map_dtype']})")
+
+# 全局函數，解析記憶體大小
+def parse_memory_size(text):
+    """將 "8G"、"512MB"、"1.5g" 或位元組數轉為位元組數"""
+    match = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*([kmgt]?)i?b?\s*", str(text), flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"無法解析記憶體大小: {text}")
+    exponent = " KMGT".index(match.group(2).upper() or " ")
+    return int(float(match.group(1)) * 1024 ** exponent)
+
+# 全局函數，格式化記憶體大小
+def format_memory_size(size):
+    if size >= 1 << 30:
+        return f"{size / (1 << 30):.2f} GB"
+    return f"{size / (1 << 20):.1f} MB"
+
+# 全局函數，圖像轉為陣列後的波段數與每個數值的位元組數
+def image_layout(image):
+    if isinstance(image, MultiBandImage):
+        return image.bands, image.array.dtype.itemsize
+    return len(image.getbands()), np.asarray(image.crop((0, 0, 1, 1))).dtype.itemsize
+
+# 全局函數，圖像佔用的記憶體
+def image_nbytes(image):
+    channels, itemsize = image_layout(image)
+    if channels > 1 and not isinstance(image, MultiBandImage):
+        # PIL 以每像素4位元組保存多波段的8位元圖像 (例如RGB)
+        channels = 4
+    return image.width * image.height * channels * itemsize
+
+class PeakMemoryMonitor:
+    """量測一段程式執行期間本進程的記憶體峰值 (常駐記憶體，位元組)
+
+    Linux 上先重設核心記錄的峰值 (VmHWM) 再讀取，不需取樣，並記錄相對於開始時的增加量 (increase)；
+    其他平台回報行程啟動以來的峰值。多進程後端工作者的最大峰值另外記錄於 children_peak
+    """
+    
+    def __enter__(self):
+        self.peak = None
+        self.increase = None
+        self.children_peak = None
+        self.kernel_peak = False
+        self.start = self._status_bytes("VmRSS")
+        try:
+            with open("/proc/self/clear_refs", 'w') as f:
+                f.write("5")
+            self.kernel_peak = True
+        except OSError:
+            pass
+        self.children_start = self._maxrss(getattr(resource, "RUSAGE_CHILDREN", None))
+        return self
+    
+    def __exit__(self, exc_type, exc, traceback):
+        self.peak = self._status_bytes("VmHWM") if self.kernel_peak else None
+        if self.peak is None:
+            self.peak = self._maxrss(getattr(resource, "RUSAGE_SELF", None))
+        elif self.start is not None:
+            self.increase = max(self.peak - self.start, 0)
+        children = self._maxrss(getattr(resource, "RUSAGE_CHILDREN", None))
+        if children and children != self.children_start:
+            self.children_peak = children
+        return False
+    
+    @staticmethod
+    def _status_bytes(field):
+        try:
+            with open("/proc/self/status", encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+    
+    @staticmethod
+    def _maxrss(who):
+        if resource is None or who is None:
+            return None
+        # macOS 以位元組回報，其他系統以KB回報
+        return resource.getrusage(who).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    
+    def summary(self):
+        """記憶體峰值的文字說明"""
+        if self.peak is None:
+            return "記憶體峰值: N/A"
+        increase = f"，本次增加 {format_memory_size(self.increase)}" if self.increase is not None else ""
+        children = f"，工作進程 {format_memory_size(self.children_peak)}" if self.children_peak else ""
+        return f"記憶體峰值: {format_memory_size(self.peak)}{increase}{children}"
+
+# 全局函數，在指定起點範圍內搜尋所有窗口
+def search_offsets(img1, img2, gt, window_size, metric, x_range=None, y_range=None, backend="auto",
+                   stride=1, stop_requested=None, executor=None, allocate=None, collect_stats=False,
+                   band_weights=None, per_band=False, workers=None, memory_budget=None, sample=False,
+                   identical_blocks=None, resident_bytes=0):
+    """計算起點落在 x_range、y_range (半開區間) 內所有窗口與GT的差距
+
+    回傳 ScoreMaps，其中 diff1、diff2 以 [(y - y0) // stride, (x - x0) // stride] 索引；
+    範圍省略時搜尋全部有效起點。stride > 1 時只計算座標為 stride 倍數的起點。
+    backend 可為 "serial"、"thread"、"process" 或 "auto"(依圖像大小自動選擇)。
+    stop_requested 為可選的函數，每完成一個列帶檢查一次，回傳True時中止搜尋並回傳None。
+    指定 executor (ThreadPoolExecutor) 時列帶會提交到該共用執行緒池。
+    allocate 為可選的函數 allocate(名稱, 形狀)，回傳存放 diff1、diff2 的陣列 (例如記憶體映射檔)。
+    collect_stats=True 時在同一次列帶計算中累加全域統計，存於回傳的 stats；
+    各像素只由一個列帶統計，範圍不在圖像邊緣時不含窗口延伸出去的像素，因此分片的統計可直接相加。
+    band_weights 為各波段的權重；per_band=True 時 diff1、diff2 多一個波段維度，供逐波段分析。
+    metric 為度量方式的元組時在同一次讀取中計算所有度量 (見 fused_window_metrics)，diff1、diff2 多一個度量維度，
+    可再以 split_metric_maps 分開。
+    workers 為並行的列帶數 (預設為核心數)；指定 memory_budget (位元組) 時在轉換輸入前依 plan_search_memory 調整
+    列帶高度、並行數、後端與差距圖精度，採用的計畫存於回傳的 memory。上限包含傳入的圖像，以及 resident_bytes
+    (呼叫者為這次搜尋另外保留的記憶體，例如灰階轉換前的原始圖像)。
+    sample=True 時各窗口只以間隔 stride 的像素估計差距 (見 compute_band_differences)，供漸進式搜尋的粗略輪次使用。
+    identical_blocks 為已計算的相同區塊遮罩 (對應搜尋範圍裁剪後的區域)，同一組圖像多次搜尋時可共用
+    """
+    fused = not isinstance(metric, str)
+    if fused:
+        metric = tuple(metric)
+        unknown = [name for name in metric if name not in METRIC_OPTIONS]
+        if unknown or not metric:
+            raise ValueError(f"不支援的度量方式: {', '.join(unknown)}")
+        if per_band:
+            raise ValueError("逐波段差距圖不支援同時計算多種度量")
+    elif per_band and metric == METRIC_OPTIONS[3]:
+        raise ValueError("逐波段差距圖不支援完整SSIM")
+    max_start_x, max_start_y = compute_search_bounds(img1, img2, gt, window_size)
+    x0, x1 = x_range if x_range else (0, max_start_x + 1)
+    y0, y1 = y_range if y_range else (0, max_start_y + 1)
+    x0, x1 = max(0, x0), min(max_start_x + 1, x1)
+    y0, y1 = max(0, y0), min(max_start_y + 1, y1)
+    # 起點對齊到步長的倍數
+    x0 += -x0 % stride
+    y0 += -y0 % stride
+    if x0 >= x1 or y0 >= y1:
+        empty = np.zeros((0, 0))
+        return ScoreMaps(empty, empty, x0, y0, 0, "serial", stride)
+    
+    box = (x0, y0, x1 - 1 + window_size, y1 - 1 + window_size)
+    num_bands, itemsize = image_layout(gt)
+    workers = workers or mp.cpu_count()
+    if executor is not None:
+        backend = "thread"
+    elif backend == "auto":
+        backend = choose_search_backend(box[3] - box[1], box[2] - box[0], num_bands, window_size, workers)
+    
+    # 在記憶體上限內選擇列帶高度、並行數、後端與差距圖精度；在轉換輸入前規劃，超過上限時不配置任何陣列
+    band_height = None
+    map_dtype = np.float64
+    memory = None
+    if memory_budget is not None:
+        sources = resident_bytes + sum(image_nbytes(img) for img in {id(img): img for img in (img1, img2, gt)}.values())
+        moments = METRIC_OPTIONS[3] in (metric if fused else (metric,))
+        memory = plan_search_memory(memory_budget, box[3] - box[1], box[2] - box[0], num_bands, window_size,
+                                    itemsize, workers, backend, stride, len(metric) if fused else 1,
+                                    per_band, allocate is None, moments, sample, sources)
+        if memory["workers"] < workers:
+            executor = None  # 共用執行緒池的並行數無法降低，改用自己的執行緒池
+        backend, workers, band_height = memory["backend"], memory["workers"], memory["band_height"]
+        map_dtype = np.dtype(memory["map_dtype"])
+    
+    # 只取該範圍窗口會用到的像素，分片搜尋時先裁剪再轉為陣列，不需複製整張圖像
+    arr1, arr2, arr_gt = (np.asarray(img if box == (0, 0) + tuple(img.size) else img.crop(box))
+                          for img in (img1, img2, gt))
+    if band_weights is not None:
+        band_weights = np.asarray(band_weights, dtype=np.float64)
+        if band_weights.shape != (num_bands,):
+            raise ValueError(f"波段權重數量 ({band_weights.size}) 與圖像波段數 ({num_bands}) 不一致")
+        if arr_gt.ndim == 2:
+            band_weights = None  # 單一波段時權重只是比例，不影響排序
+    
+    # 預先逐區塊比較，找出三張圖像完全相同的區域，落在其中的窗口分數必為0
+    if identical_blocks is None:
+        identical_blocks = compute_identical_blocks(arr1, arr2, arr_gt)
+    
+    def band_skip_mask(band_y0, band_y1, band_x0=0, band_x1=None):
+        # 列帶內 (起點Y介於 band_y0 與 band_y1 之間) 完全落在相同區域的窗口，逐列帶計算不需整張差距圖大小的遮罩
+        first_y = math.ceil(band_y0 / stride) * stride
+        return identical_window_mask(identical_blocks, window_size, (band_x1 or x1 - x0) - 1, band_y1 - 1,
+                                     stride=stride, first_y=first_y, first_x=band_x0)
+    
+    # 全域統計的範圍：在圖像底部或右側邊緣時包含窗口延伸出去的像素
+    stats_last_row = arr_gt.shape[0] if y1 == max_start_y + 1 else y1 - y0
+    stats_cols = arr_gt.shape[1] if x1 == max_start_x + 1 else x1 - x0
+    
+    # 完全落在相同區域內的窗口不需計算：各列帶依 plan_band_spans 分成只含需要計算的行段與列，
+    # 行段內仍落在相同區域的窗口 (計算後設為0) 與未計算的窗口分開計數
+    bands = []
+    skipped_count = 0
+    zeroed_count = 0
+    for band_y0, band_y1 in plan_bands(y1 - y0, window_size, workers, band_height):
+        stat_rows = (band_y0, stats_last_row if band_y1 == y1 - y0 else band_y1) if collect_stats else None
+        first_row = math.ceil(band_y0 / stride)
+        skip_mask = band_skip_mask(band_y0, band_y1)
+        identical_count = int(np.count_nonzero(skip_mask))
+        for row0, row1, col0, col1 in plan_band_spans(skip_mask, window_size, stride):
+            zeroed_count += int(np.count_nonzero(skip_mask[row0:row1, col0:col1]))
+            # 全域統計只由列帶的第一個行段累加一次
+            bands.append(((first_row + row0) * stride, min(band_y1, (first_row + row1 - 1) * stride + 1), stat_rows,
+                          (col0 * stride, min(x1 - x0, (col1 - 1) * stride + 1))))
+            stat_rows = None
+        if stat_rows is not None:
+            # 相同區域仍需累加全域統計
+            bands.append((band_y0, band_y0, stat_rows))
+        skipped_count += identical_count
+    
+    map_shape = ((math.ceil((y1 - y0) / stride), math.ceil((x1 - x0) / stride)) + ((num_bands,) if per_band else ())
+                 + ((len(metric),) if fused else ()))
+    if allocate is None:
+        diff1 = np.zeros(map_shape, dtype=map_dtype)
+        diff2 = np.zeros(map_shape, dtype=map_dtype)
+    else:
+        # 列帶完成後直接寫入呼叫者提供的陣列，不另外保留整張差距圖
+        diff1 = allocate("diff1", map_shape)
+        diff2 = allocate("diff2", map_shape)
+    
+    stats = np.zeros((2, GLOBAL_STAT_FIELDS + GLOBAL_HIST_BINS)) if collect_stats else None
+    
+    def store_bands(band_results):
+        for band_y0, band_x0, band_diff1, band_diff2, band_stats in band_results:
+            row = band_y0 // stride
+            col = band_x0 // stride
+            if len(band_diff1):
+                # 相同區域的窗口直接設為0 (寫入前在列帶結果上處理)
+                skip_mask = band_skip_mask(band_y0, band_y0 + (len(band_diff1) - 1) * stride + 1,
+                                           band_x0, band_x0 + (band_diff1.shape[1] - 1) * stride + 1)
+                band_diff1[skip_mask] = 0.0
+                band_diff2[skip_mask] = 0.0
+                diff1[row:row + len(band_diff1), col:col + band_diff1.shape[1]] = band_diff1
+                diff2[row:row + len(band_diff2), col:col + band_diff2.shape[1]] = band_diff2
+            if band_stats is not None:
+                stats[:] += band_stats
+            if stop_requested is not None and stop_requested():
+                return False
+        return True
+    
+    if backend == "process" and len(bands) > 1:
+        with mp.Pool(processes=min(workers, len(bands)), initializer=_init_band_worker,
+                     initargs=(arr1, arr2, arr_gt, window_size, metric, stride, stats_cols, band_weights,
+                               per_band, sample)) as pool:
+            completed = store_bands(pool.imap_unordered(_compute_band_task, bands))
+    else:
+        compute_band = partial(compute_band_differences, arr1, arr2, arr_gt,
+                               window_size=window_size, metric=metric, stride=stride, stats_cols=stats_cols,
+                               band_weights=band_weights, per_band=per_band, sample=sample)
+        if backend == "thread" and (len(bands) > 1 or executor is not None):
+            pool = executor or ThreadPoolExecutor(max_workers=min(workers, len(bands)))
+            futures = []
+            
+            def band_results():
+                # 最多只讓並行數兩倍的列帶在途，已完成但尚未寫入的列帶結果不會累積成整張差距圖
+                for band in bands:
+                    futures.append(pool.submit(compute_band, band))
+                    if len(futures) > 2 * workers:
+                        yield futures.pop(0).result()
+                while futures:
+                    yield futures.pop(0).result()
+            
+            try:
+                completed = store_bands(band_results())
+                if not completed:
+                    for future in futures:
+                        future.cancel()
+            finally:
+                if executor is None:
+                    pool.shutdown()
+        else:
+            backend = "serial"
+            completed = store_bands(map(compute_band, bands))
+    
+    if not completed:
+        return None
+    
+    return ScoreMaps(diff1, diff2, x0, y0, skipped_count - zeroed_count, backend, stride, stats, memory, zeroed_count)
+
+# 全局函數，相同窗口的計數說明
+def format_skipped_windows(maps):
+    """未計算的相同窗口與計算後才設為0的相同窗口分開說明"""
+    # 逐波段或多度量的差距圖多出的維度不是窗口
+    total = int(np.prod(maps.diff1.shape[:2]))
+    return (f"略過 {maps.skipped}/{total} 個完全相同的窗口 ({maps.skipped / max(total, 1) * 100:.1f}%)，"
+            f"另有 {maps.zeroed} 個相同窗口計算後設為0")
+
+# 全局函數，拆分同時計算多種度量的差距圖
+def split_metric_maps(maps, metrics):
+    """將最後一維為度量的 ScoreMaps 拆成 {度量方式: ScoreMaps}，各差距圖為原陣列的檢視，不複製資料"""
+    return {metric: maps._replace(diff1=maps.diff1[..., index], diff2=maps.diff2[..., index])
+            for index, metric in enumerate(metrics)}
+
+# 全局函數，查詢差距圖中指定窗口的差距
+def score_maps_value(maps, x, y):
+    """回傳起點 (x, y) 的 (差距1, 差距2)，起點不在差距圖的格點上時回傳 None"""
+    row, row_offset = divmod(y - maps.y0, maps.stride)
+    col, col_offset = divmod(x - maps.x0, maps.stride)
+    if row_offset or col_offset or not (0 <= row < maps.diff1.shape[0] and 0 <= col < maps.diff1.shape[1]):
+        return None
+    return float(maps.diff1[row, col]), float(maps.diff2[row, col])
+
+# 全局函數，寫出差距圖的參數說明檔
+def write_score_map_sidecar(directory, maps, mode, params, dtype):
+    """寫出 score_maps.json，記錄陣列檔名、形狀與座標對應方式，供下游工具讀取"""
+    sidecar = dict(params)
+    sidecar.update({
+        "files": {name: f"{name}.npy" for name in ("diff1", "diff2", "score")},
+        "shape": list(maps.diff1.shape),
+        "dtype": np.dtype(dtype).name,
+        "x0": maps.x0,
+        "y0": maps.y0,
+        "stride": maps.stride,
+        "mode": mode,
+        "skipped": maps.skipped,
+        "zeroed": maps.zeroed,
+        "backend": maps.backend,
+        "indexing": "[(y - y0) // stride, (x - x0) // stride]",
+    })
+    with open(os.path.join(directory, "score_maps.json"), 'w', encoding='utf-8') as f:
+        json.dump(sidecar, f, ensure_ascii=False, indent=2)
+
+# 全局函數，以記憶體映射檔逐帶寫出分數圖
+def write_score_map_file(directory, maps, mode, dtype):
+    """由 diff1、diff2 逐帶計算分數圖並寫入 score.npy，不建立整張的暫存陣列"""
+    score = np.lib.format.open_memmap(os.path.join(directory, "score.npy"), mode='w+', dtype=dtype,
+                                      shape=maps.diff1.shape)
+    for row in range(0, score.shape[0], EXPORT_CHUNK_ROWS):
+        rows = slice(row, row + EXPORT_CHUNK_ROWS)
+        score[rows] = score_map(ScoreMaps(maps.diff1[rows], maps.diff2[rows], maps.x0, maps.y0, 0, "", 1), mode)
+    score.flush()
+
+# 全局函數，匯出已計算的差距圖
+def save_score_maps(directory, maps, mode, params, dtype=np.float64):
+    """將記憶體中的差距圖逐帶寫成可用 np.load(mmap_mode='r') 開啟的 .npy 檔"""
+    os.makedirs(directory, exist_ok=True)
+    for name in ("diff1", "diff2"):
+        source = getattr(maps, name)
+        target = np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+', dtype=dtype,
+                                           shape=source.shape)
+        for row in range(0, source.shape[0], EXPORT_CHUNK_ROWS):
+            target[row:row + EXPORT_CHUNK_ROWS] = source[row:row + EXPORT_CHUNK_ROWS]
+        target.flush()
+    write_score_map_file(directory, maps, mode, dtype)
+    write_score_map_sidecar(directory, maps, mode, params, dtype)
+
+# 全局函數，搜尋並直接以記憶體映射檔寫出差距圖
+def export_score_maps(img1, img2, gt, window_size, metric, mode, directory, params, dtype=np.float64,
+                      backend="auto", band_weights=None, per_band=False, memory_budget=None):
+    """搜尋所有窗口，每個列帶完成後直接寫入 .npy 記憶體映射檔，完整差距圖不需載入記憶體
+
+    per_band=True 時各差距圖多一個波段維度 (形狀為 列 x 行 x 波段)；memory_budget 見 search_offsets
+    """
+    os.makedirs(directory, exist_ok=True)
+    
+    def allocate(name, shape):
+        return np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+', dtype=dtype,
+                                         shape=shape)
+    
+    maps = search_offsets(img1, img2, gt, window_size, metric, backend=backend, allocate=allocate,
+                          collect_stats=True, band_weights=band_weights, per_band=per_band,
+                          memory_budget=memory_budget)
+    params = dict(params, global_stats=summarize_global_stats(maps.stats, pil_max_value(gt)))
+    maps.diff1.flush()
+    maps.diff2.flush()
+    write_score_map_file(directory, maps, mode, dtype)
+    write_score_map_sidecar(directory, maps, mode, params, dtype)
+    return maps
+
+# 全局函數，裁剪報告用的窗口圖塊
+def report_tile(image, box, tile_size):
+    """裁剪窗口並以最近鄰縮放為 tile_size x tile_size 的8位元RGB陣列"""
+    crop = image.crop(box)
+    if isinstance(crop, MultiBandImage):
+        crop = crop.convert('RGB')
+    elif crop.mode in ("I;16", "I;16B", "I", "F"):
+        # 高位元深度圖像先依型別的最大值拉伸為8位元
+        scaled = np.asarray(crop, dtype=np.float32) * (255.0 / pil_max_value(image))
+        crop = Image.fromarray(np.clip(scaled, 0, 255).astype(np.uint8))
+    return np.asarray(crop.convert('RGB').resize((tile_size, tile_size), Image.NEAREST))
+
+# 全局函數，產生結果報告
+def write_result_report(directory, images, results, window_size, params, tile_size=128, workers=None,
+                        progress=None, stop_requested=None):
+    """將各結果 圖像1 | 圖像2 | GT 的窗口排入少數幾張聯絡表並寫出 index.html，回傳聯絡表檔名列表
+
+    各結果在執行緒池中直接繪入所屬聯絡表的陣列，每張聯絡表只編碼一次；
+    HTML以CSS背景位置引用聯絡表中的區塊，不需產生大量小檔案。
+    progress(已完成, 總數) 在每個結果繪製完與每張聯絡表編碼完時呼叫；stop_requested() 為真時中止並回傳None
+    """
+    os.makedirs(directory, exist_ok=True)
+    cell_width = 3 * tile_size + 2 * REPORT_GAP
+    cell_height = tile_size + REPORT_LABEL_HEIGHT
+    per_sheet = REPORT_COLUMNS * REPORT_ROWS_PER_SHEET
+    sheets = []
+    for start in range(0, len(results), per_sheet):
+        count = min(per_sheet, len(results) - start)
+        rows, columns = math.ceil(count / REPORT_COLUMNS), min(count, REPORT_COLUMNS)
+        sheets.append(np.full((REPORT_GAP + rows * (cell_height + REPORT_GAP),
+                               REPORT_GAP + columns * (cell_width + REPORT_GAP), 3), 255, dtype=np.uint8))
+    
+    def cell_origin(rank):
+        sheet, slot = divmod(rank, per_sheet)
+        row, column = divmod(slot, REPORT_COLUMNS)
+        return sheet, REPORT_GAP + column * (cell_width + REPORT_GAP), REPORT_GAP + row * (cell_height + REPORT_GAP)
+    
+    def render(rank):
+        if stop_requested is not None and stop_requested():
+            return
+        x, y = results[rank][:2]
+        sheet, left, top = cell_origin(rank)
+        for k, image in enumerate(images):
+            tile_left = left + k * (tile_size + REPORT_GAP)
+            sheets[sheet][top + REPORT_LABEL_HEIGHT:top + cell_height, tile_left:tile_left + tile_size] = \
+                report_tile(image, (x, y, x + window_size, y + window_size), tile_size)
+    
+    def encode(index):
+        sheet_image = Image.fromarray(sheets[index])
+        draw = ImageDraw.Draw(sheet_image)
+        for rank in range(index * per_sheet, min(len(results), (index + 1) * per_sheet)):
+            x, y, score = results[rank][:3]
+            _, left, top = cell_origin(rank)
+            draw.text((left, top + 2), f"#{rank + 1}  ({x},{y})  score {score:.4f}", fill=(0, 0, 0))
+        name = f"sheet_{index:03d}.png"
+        # 報告以速度為主，使用最低的壓縮等級
+        sheet_image.save(os.path.join(directory, name), compress_level=1)
+        return name
+    
+    total = len(results) + len(sheets)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for done, _ in enumerate(pool.map(render, range(len(results))), 1):
+            if progress is not None:
+                progress(done, total)
+        if stop_requested is not None and stop_requested():
+            return None
+        names = []
+        for name in pool.map(encode, range(len(sheets))):
+            names.append(name)
+            if progress is not None:
+                progress(len(results) + len(names), total)
+    
+    rows = []
+    for rank, (x, y, score, diff1, diff2) in enumerate(results):
+        sheet, left, top = cell_origin(rank)
+        rows.append(f'<tr><td>{rank + 1}</td><td>{x}</td><td>{y}</td><td>{score:.6f}</td>'
+                    f'<td>{diff1:.6f}</td><td>{diff2:.6f}</td>'
+                    f'<td><a href="{names[sheet]}"><div class="cell" style="background-image: url(\'{names[sheet]}\'); '
+                    f'background-position: -{left}px -{top + REPORT_LABEL_HEIGHT}px"></div></a></td></tr>')
+    settings = "".join(f"<li>{html.escape(str(key))}: {html.escape(json.dumps(value, ensure_ascii=False))}</li>"
+                       for key, value in params.items())
+    sheet_links = " ".join(f'<a href="{name}">{name}</a>' for name in names)
+    table_rows = "\n".join(rows)
+    with open(os.path.join(directory, "index.html"), 'w', encoding='utf-8') as f:
+        f.write(f"""<!DOCTYPE html>
+<html lang="zh-Hant">
+<head>
+<meta charset="utf-8">
+<title>比較結果報告</title>
+<style>
+body {{ font-family: sans-serif; }}
+table {{ border-collapse: collapse; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+.cell {{ width: {cell_width}px; height: {tile_size}px; background-repeat: no-repeat; }}
+</style>
+</head>
+<body>
+<h1>比較結果報告</h1>
+<ul>{settings}</ul>
+<p>聯絡表: {sheet_links}</p>
+<table>
+<tr><th>排名</th><th>X</th><th>Y</th><th>分數</th><th>圖1與GT差距</th><th>圖2與GT差距</th><th>圖像1 | 圖像2 | GT</th></tr>
+{table_rows}
+</table>
+</body>
+</html>
+""")
+    return names
+
+# 全局函數，由差距圖計算分數圖
+def score_map(maps, mode):
+    """mode=1: 圖像2差距減圖像1差距; mode=2: 圖像1差距減圖像2差距"""
+    return maps.diff2 - maps.diff1 if mode == 1 else maps.diff1 - maps.diff2
+
+# 全局函數，以向量化方式找出每個網格的最佳窗口
+def reduce_grid_score_maps(maps, mode, grid_size):
+    """保留每個網格中分數最高的窗口，回傳 {(grid_x, grid_y): 結果} 字典
+
+    網格以原圖座標劃分；分數相同時保留起點較前(先y後x)者
+    """
+    scores = score_map(maps, mode)
+    height, width = scores.shape
+    if scores.size == 0:
+        return {}
+    if maps.stride > 1:
+        return _reduce_grid_strided(maps, scores, grid_size)
+    
+    # 在前後補上 -inf，使範圍與網格邊界對齊後重排為 (網格列, 網格行, 網格內像素)
+    pad_top = maps.y0 % grid_size
+    pad_left = maps.x0 % grid_size
+    cells_y = math.ceil((pad_top + height) / grid_size)
+    cells_x = math.ceil((pad_left + width) / grid_size)
+    padded = np.full((cells_y * grid_size, cells_x * grid_size), -np.inf)
+    padded[pad_top:pad_top + height, pad_left:pad_left + width] = scores
+    cells = padded.reshape(cells_y, grid_size, cells_x, grid_size).transpose(0, 2, 1, 3)
+    best = cells.reshape(cells_y, cells_x, grid_size * grid_size).argmax(axis=2)
+    
+    grid_results = {}
+    first_grid_x = maps.x0 // grid_size
+    first_grid_y = maps.y0 // grid_size
+    for cell_y, cell_x in zip(*np.nonzero(np.isfinite(cells.max(axis=(2, 3))))):
+        local_y = cell_y * grid_size + best[cell_y, cell_x] // grid_size - pad_top
+        local_x = cell_x * grid_size + best[cell_y, cell_x] % grid_size - pad_left
+        grid_results[(first_grid_x + int(cell_x), first_grid_y + int(cell_y))] = (
+            maps.x0 + int(local_x), maps.y0 + int(local_y), float(scores[local_y, local_x]),
+            float(maps.diff1[local_y, local_x]), float(maps.diff2[local_y, local_x]))
+    return grid_results
+
+def _reduce_grid_strided(maps, scores, grid_size):
+    """步長大於1時起點不再與網格對齊，改以排序找出每個網格的最佳窗口"""
+    ys = maps.y0 + np.arange(scores.shape[0]) * maps.stride
+    xs = maps.x0 + np.arange(scores.shape[1]) * maps.stride
+    cell_ids = ((ys // grid_size)[:, None] * (xs[-1] // grid_size + 1) + (xs // grid_size)[None, :]).ravel()
+    flat_scores = scores.ravel()
+    
+    # 依 (網格, 分數由高到低, 起點先後) 排序後取每個網格的第一筆
+    order = np.lexsort((np.arange(flat_scores.size), -flat_scores, cell_ids))
+    order = order[np.isfinite(flat_scores[order])]
+    sorted_cells = cell_ids[order]
+    firsts = order[np.r_[True, sorted_cells[1:] != sorted_cells[:-1]]]
+    
+    grid_results = {}
+    for index in firsts:
+        local_y, local_x = divmod(int(index), scores.shape[1])
+        x, y = int(xs[local_x]), int(ys[local_y])
+        grid_results[(x // grid_size, y // grid_size)] = (
+            x, y, float(scores[local_y, local_x]),
+            float(maps.diff1[local_y, local_x]), float(maps.diff2[local_y, local_x]))
+    return grid_results
+
+# 全局函數，計算兩個相同大小窗口的重疊度
+def window_iou(dx, dy, window_size):
+    """起點相差 (dx, dy) 的兩個 window_size 窗口的交集/聯集比 (IoU)，dx、dy 可為陣列"""
+    overlap = np.maximum(0, window_size - np.abs(dx)) * np.maximum(0, window_size - np.abs(dy))
+    return overlap / (2 * window_size * window_size - overlap)
+
+# 全局函數，以非極大值抑制選出分散的最佳窗口
+def reduce_nms_score_maps(maps, mode, window_size, max_results, max_iou):
+    """從完整分數圖中依分數由高到低選出最多 max_results 個窗口，任兩個窗口的IoU不超過 max_iou
+
+    每輪以 argpartition 取出尚未處理、也未被抑制的最高分 m 個候選再排序 (O(n + m log m))；
+    選入窗口時以向量化方式在抑制遮罩上標記IoU超過上限的整個鄰域，下一輪取候選時直接排除，
+    因此候選不會重複處理，通常一輪即可選滿
+    """
+    scores = score_map(maps, mode)
+    height, width = scores.shape
+    if scores.size == 0 or max_results <= 0:
+        return []
+    
+    # 與選入窗口的IoU超過上限的起點偏移 (以差距圖的格點為單位)
+    reach = math.ceil(window_size / maps.stride) - 1
+    offsets = np.arange(-reach, reach + 1) * maps.stride
+    footprint = window_iou(offsets[None, :], offsets[:, None], window_size) > max_iou
+    
+    flat_scores = scores.ravel()
+    # 已處理或已被抑制的起點；非有限的分數 (例如 -inf) 不會被選入
+    excluded = ~np.isfinite(scores)
+    flat_excluded = excluded.ravel()
+    num_candidates = max(max_results * NMS_CANDIDATE_FACTOR, 1024)
+    accepted = []
+    while len(accepted) < max_results:
+        remaining = int(flat_excluded.size - np.count_nonzero(flat_excluded))
+        if remaining == 0:
+            break
+        ranked = np.where(flat_excluded, np.inf, -flat_scores)
+        if num_candidates < remaining:
+            candidates = np.argpartition(ranked, num_candidates - 1)[:num_candidates]
+            # 與本輪最低分同分的候選一併處理，使同分時的先後順序不受分輪影響
+            candidates = np.union1d(candidates, np.flatnonzero(ranked == ranked[candidates].max()))
+        else:
+            candidates = np.flatnonzero(~flat_excluded)
+        # 分數由高到低，分數相同時起點較前(先y後x)者優先
+        candidates = candidates[np.lexsort((candidates, -flat_scores[candidates]))]
+        
+        for index in candidates.tolist():
+            if flat_excluded[index]:
+                continue
+            local_y, local_x = divmod(index, width)
+            accepted.append((maps.x0 + local_x * maps.stride, maps.y0 + local_y * maps.stride,
+                             float(flat_scores[index]),
+                             float(maps.diff1[local_y, local_x]), float(maps.diff2[local_y, local_x])))
+            if len(accepted) >= max_results:
+                break
+            # 標記鄰域 (在差距圖邊界裁剪)
+            y0, y1 = max(local_y - reach, 0), min(local_y + reach + 1, height)
+            x0, x1 = max(local_x - reach, 0), min(local_x + reach + 1, width)
+            excluded[y0:y1, x0:x1] |= footprint[y0 - local_y + reach:y1 - local_y + reach,
+                                                x0 - local_x + reach:x1 - local_x + reach]
+        # 本輪的候選都已處理
+        flat_excluded[candidates] = True
+    return accepted
+
+# 全局函數，以自適應四叉樹劃分起點空間
+def reduce_quadtree_score_maps(maps, mode, min_cell_size, split_threshold):
+    """遞迴地將起點空間切成四塊，只在分數變異或最大值偏高的區域繼續細分，回傳每個葉節點的最佳窗口
+
+    節點的分數標準差超過 split_threshold 倍全圖標準差，或最大值超過全圖平均加上同樣倍數的標準差時才細分，
+    邊長不超過 min_cell_size 的節點不再細分；結果數量因此取決於差異的多寡而非圖像面積
+    """
+    scores = score_map(maps, mode)
+    if scores.size == 0:
+        return []
+    
+    global_std = float(scores.std())
+    max_threshold = float(scores.mean()) + split_threshold * global_std
+    std_threshold = split_threshold * global_std
+    # 最小格的邊長以差距圖的格點(步長)為單位
+    min_cells = max(1, math.ceil(min_cell_size / maps.stride))
+    
+    results = []
+    stack = [(0, 0, scores.shape[0], scores.shape[1])]
+    while stack:
+        y0, x0, y1, x1 = stack.pop()
+        node = scores[y0:y1, x0:x1]
+        splittable = y1 - y0 > min_cells or x1 - x0 > min_cells
+        if splittable and global_std > 0 and (node.max() > max_threshold or node.std() > std_threshold):
+            # 只沿著仍大於最小格的方向切分
+            mid_y = (y0 + y1 + 1) // 2 if y1 - y0 > min_cells else y1
+            mid_x = (x0 + x1 + 1) // 2 if x1 - x0 > min_cells else x1
+            for child in ((y0, x0, mid_y, mid_x), (y0, mid_x, mid_y, x1),
+                          (mid_y, x0, y1, mid_x), (mid_y, mid_x, y1, x1)):
+                if child[2] > child[0] and child[3] > child[1]:
+                    stack.append(child)
+            continue
+        
+        # 葉節點：保留分數最高的窗口 (分數相同時保留起點較前者)
+        local_y, local_x = divmod(int(node.argmax()), x1 - x0)
+        local_y += y0
+        local_x += x0
+        results.append((maps.x0 + local_x * maps.stride, maps.y0 + local_y * maps.stride,
+                        float(scores[local_y, local_x]),
+                        float(maps.diff1[local_y, local_x]), float(maps.diff2[local_y, local_x])))
+    
+    return sorted(results, key=lambda x: x[2], reverse=True)
+
+# 全局函數，依縮減設定將差距圖轉為結果列表
+def reduce_score_maps(maps, mode, window_size, reduction):
+    """reduction 為 {"reducer", "grid_size", "max_results", "max_iou", "split_threshold"}，回傳按分數排序的結果列表"""
+    if reduction.get("reducer", "grid") == "nms":
+        return reduce_nms_score_maps(maps, mode, window_size, reduction["max_results"], reduction["max_iou"])
+    if reduction.get("reducer", "grid") == "quadtree":
+        return reduce_quadtree_score_maps(maps, mode, reduction["grid_size"], reduction["split_threshold"])
+    grid_results = reduce_grid_score_maps(maps, mode, reduction["grid_size"])
+    return sorted(grid_results.values(), key=lambda x: x[2], reverse=True)
+
+# 全局函數，將結果分配到網格
+def reduce_grid_results(results, grid_size, grid_results=None):
+    """保留每個網格中分數最高的結果，回傳 {(grid_x, grid_y): 結果} 字典"""
+    if grid_results is None:
+        grid_results = {}
+    for result in results:
+        start_x, start_y, score, diff1_gt, diff2_gt = result
+        
+        # 計算該點所屬的網格
+        grid_key = (start_x // grid_size, start_y // grid_size)
+        
+        # 如果該網格還沒有結果，或者該結果比現有結果更好，則更新；
+        # 分數相同時保留起點較前(先y後x)者，使分片合併結果與單次搜尋一致
+        current = grid_results.get(grid_key)
+        if (current is None or score > current[2] or
+                (score == current[2] and (start_y, start_x) < (current[1], current[0]))):
+            grid_results[grid_key] = result
+    return grid_results
+
+# 全局函數，寫出部分結果檔
+def save_partial_results(path, grid_results, params):
+    """將每個網格的最佳結果以精簡的npz格式寫入檔案"""
+    keys = sorted(grid_results)
+    values = [grid_results[key] for key in keys]
+    with open(path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            grid_x=np.array([key[0] for key in keys], dtype=np.int32),
+            grid_y=np.array([key[1] for key in keys], dtype=np.int32),
+            x=np.array([v[0] for v in values], dtype=np.int32),
+            y=np.array([v[1] for v in values], dtype=np.int32),
+            score=np.array([v[2] for v in values], dtype=np.float64),
+            diff1=np.array([v[3] for v in values], dtype=np.float64),
+            diff2=np.array([v[4] for v in values], dtype=np.float64),
+            params=np.array(json.dumps(params, ensure_ascii=False)),
+        )
+
+# 全局函數，讀取部分結果檔
+def load_partial_results(path):
+    """讀取部分結果檔，回傳 (參數字典, 網格結果字典)"""
+    with np.load(path, allow_pickle=False) as data:
+        params = json.loads(str(data['params']))
+        grid_results = {}
+        for gx, gy, x, y, score, diff1, diff2 in zip(data['grid_x'], data['grid_y'], data['x'], data['y'],
+                                                    data['score'], data['diff1'], data['diff2']):
+            grid_results[(int(gx), int(gy))] = (int(x), int(y), float(score), float(diff1), float(diff2))
+    if "metric" in params:
+        params["metric"] = LEGACY_METRIC_NAMES.get(params["metric"], params["metric"])
+    return params, grid_results
+
+# 全局函數，合併多個分片結果
+def merge_partial_results(paths):
+    """合併任意數量的部分結果檔，回傳 (參數字典, 按分數排序的結果列表)"""
+    merged_params = None
+    grid_results = {}
+    global_stats = []
+    for path in paths:
+        params, shard_results = load_partial_results(path)
+        global_stats.append(params.get("global_stats"))
+        if merged_params is None:
+            merged_params = dict(params)
+        else:
+            for key in SHARD_COMPAT_KEYS:
+                if params.get(key) != merged_params.get(key):
+                    raise ValueError(f"分片 {path} 的參數 {key} 與其他分片不一致")
+        reduce_grid_results(shard_results.values(), merged_params["grid_size"], grid_results)
+    
+    # 各分片統計的像素互不重疊，累加量直接相加即為整張圖像的統計
+    if all(stats is not None for stats in global_stats):
+        merged_params["global_stats"] = np.sum(global_stats, axis=0).tolist()
+    else:
+        merged_params.pop("global_stats", None)
+    merged_params["shards"] = len(paths)
+    merged_params.pop("rows", None)
+    merged_params.pop("cols", None)
+    return merged_params, sorted(grid_results.values(), key=lambda x: x[2], reverse=True)
+
+# 全局函數，解析結果篩選條件
+def parse_result_filter(expression):
+    """將 "diff1 < 5 and diff2 > 50" 這類條件解析為以 or 連接、每組內以 and 連接的 (欄位, 運算子, 值) 列表
+
+    值可以是數字或另一個欄位名稱；空字串代表不篩選 (回傳空列表)
+    """
+    fields = list(RESULT_DTYPE.names)
+    clauses = []
+    if not expression.strip():
+        return clauses
+    for group in re.split(r"\s+or\s+", expression.strip(), flags=re.IGNORECASE):
+        conditions = []
+        for condition in re.split(r"\s+and\s+", group.strip(), flags=re.IGNORECASE):
+            match = re.fullmatch(r"\s*(\w+)\s*(<=|>=|==|!=|<|>)\s*(\S+)\s*", condition)
+            if match is None or match.group(1) not in fields:
+                raise ValueError(f"無法解析篩選條件: {condition} (可用欄位: {', '.join(fields)})")
+            name, operator, value = match.groups()
+            if value not in fields:
+                try:
+                    value = float(value)
+                except ValueError:
+                    raise ValueError(f"篩選條件的值必須是數字或欄位名稱: {value}")
+            conditions.append((name, operator, value))
+        clauses.append(conditions)
+    return clauses
+
+class ResultTable:
+    """以結構化陣列保存的搜尋結果，排序與篩選都只重排索引，不複製紀錄
+
+    len、索引與迭代以目前的檢視 (篩選並排序後的結果) 為準，每筆結果為 (x, y, 分數, 差距1, 差距2) 元組，
+    與原本的結果列表用法相同；只有網格分區的結果 (指定 grid_size) 才有所屬網格，其餘為 -1
+    """
+    
+    def __init__(self, results=(), grid_size=None, metric=-1):
+        self.records = np.zeros(len(results), dtype=RESULT_DTYPE)
+        self.records["cell_x"] = -1
+        self.records["cell_y"] = -1
+        if len(results):
+            columns = np.asarray(results, dtype=np.float64).reshape(len(results), 5)
+            for column, name in enumerate(("x", "y", "score", "diff1", "diff2")):
+                self.records[name] = columns[:, column]
+            if grid_size is not None:
+                self.records["cell_x"] = self.records["x"] // grid_size
+                self.records["cell_y"] = self.records["y"] // grid_size
+        self.records["metric"] = metric
+        self.order = np.arange(len(self.records))
+        self.mask = None
+        self.view = self.order
+    
+    @property
+    def total(self):
+        """未篩選前的結果數"""
+        return len(self.records)
+    
+    def sort(self, key="score", descending=True):
+        """依欄位排序 (穩定排序，同值時保持原順序)，並保留目前的篩選"""
+        values = self.records[key].astype(np.float64)
+        self.order = np.argsort(-values if descending else values, kind="stable")
+        self.update_view()
+    
+    def filter(self, expression):
+        """以向量化比較套用篩選條件，條件無法解析時拋出 ValueError 且不改變目前的檢視"""
+        clauses = parse_result_filter(expression)
+        mask = None
+        for conditions in clauses:
+            group = np.ones(len(self.records), dtype=bool)
+            for name, operator, value in conditions:
+                other = self.records[value] if isinstance(value, str) else value
+                group &= RESULT_FILTER_OPERATORS[operator](self.records[name], other)
+            mask = group if mask is None else mask | group
+        self.mask = mask
+        self.update_view()
+    
+    def update_view(self):
+        self.view = self.order if self.mask is None else self.order[self.mask[self.order]]
+    
+    def row(self, index):
+        """檢視中第 index 筆結果的完整紀錄"""
+        return self.records[self.view[index]]
+    
+    def rows(self, indices=None):
+        """回傳指定紀錄 (預設為全部，依原順序) 的結果元組列表"""
+        records = self.records if indices is None else self.records[indices]
+        return list(zip(records["x"].tolist(), records["y"].tolist(), records["score"].tolist(),
+                        records["diff1"].tolist(), records["diff2"].tolist()))
+    
+    def positions(self):
+        """檢視中所有結果的窗口起點"""
+        records = self.records[self.view]
+        return list(zip(records["x"].tolist(), records["y"].tolist()))
+    
+    def __len__(self):
+        return len(self.view)
+    
+    def __getitem__(self, index):
+        record = self.records[self.view[index]]
+        return (int(record["x"]), int(record["y"]), float(record["score"]),
+                float(record["diff1"]), float(record["diff2"]))
+    
+    def __iter__(self):
+        return iter(self.rows(self.view))
+
+# 全局函數，計算檔案內容的雜湊值
+def file_content_hash(path, chunk_size=1 << 20):
+    """以blake2b逐塊計算檔案內容的雜湊值，用於確認工作階段的圖像是否已變更"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# 全局函數，寫出工作階段檔
+def save_session(path, session, results, maps=None):
+    """將工作階段參數、結果列表與可選的差距圖寫入npz檔；差距圖未壓縮以便快速還原"""
+    arrays = {
+        "x": np.array([r[0] for r in results], dtype=np.int32),
+        "y": np.array([r[1] for r in results], dtype=np.int32),
+        "score": np.array([r[2] for r in results], dtype=np.float64),
+        "diff1": np.array([r[3] for r in results], dtype=np.float64),
+        "diff2": np.array([r[4] for r in results], dtype=np.float64),
+    }
+    session = dict(session)
+    if maps is not None:
+        arrays["map_diff1"] = maps.diff1
+        arrays["map_diff2"] = maps.diff2
+        session["score_maps"] = {"x0": maps.x0, "y0": maps.y0, "skipped": maps.skipped,
+                                 "backend": maps.backend, "stride": maps.stride, "zeroed": maps.zeroed}
+    with open(path, 'wb') as f:
+        np.savez(f, session=np.array(json.dumps(session, ensure_ascii=False)), **arrays)
+
+# 全局函數，讀取工作階段檔
+def load_session(path):
+    """讀取工作階段檔，回傳 (參數字典, 結果列表, 差距圖或None)"""
+    with np.load(path, allow_pickle=False) as data:
+        session = json.loads(str(data['session']))
+        if "metric" in session:
+            session["metric"] = LEGACY_METRIC_NAMES.get(session["metric"], session["metric"])
+        results = [(int(x), int(y), float(score), float(diff1), float(diff2))
+                   for x, y, score, diff1, diff2 in zip(data['x'].tolist(), data['y'].tolist(), data['score'].tolist(),
+                                                        data['diff1'].tolist(), data['diff2'].tolist())]
+        maps = None
+        if "score_maps" in session:
+            maps = ScoreMaps(data['map_diff1'], data['map_diff2'], **session.pop("score_maps"))
+    return session, results, maps
+
+class ComparisonService:
+    """本機比較服務的核心：在記憶體中快取已解碼的圖像與差距圖，並以共用工作池執行搜尋
+
+    指定 memory_budget (位元組) 時，搜尋前依預估用量先釋放較久未用的差距圖、已完成的搜尋與解碼圖像，
+    剩餘的空間再交給 plan_search_memory 規劃搜尋；釋放的圖像保留路徑，之後使用時重新解碼，
+    釋放的搜尋則無法再查詢結果
+    """
+    
+    def __init__(self, workers=None, memory_budget=None):
+        self.workers = workers or mp.cpu_count()
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        # 兩個快取都依最近使用的順序排列，最前面的最先釋放
+        self.images = OrderedDict()       # 圖像ID -> {"path", "mtime", "width", "height", "image", "converted"}
+        self.score_cache = OrderedDict()  # (圖像ID..., 窗口大小, 度量方式, 灰階) -> ScoreMaps
+        self.searches = OrderedDict()     # 搜尋ID -> {"params", "status", "results", "error"}，依開始的順序排列
+        # 少量執行緒負責排程搜尋請求，所有搜尋的列帶共用同一個計算執行緒池
+        self.search_executor = ThreadPoolExecutor(max_workers=2)
+        self.band_executor = ThreadPoolExecutor(max_workers=self.workers)
+    
+    def register_image(self, path):
+        """註冊並解碼圖像，相同路徑且檔案未變更時直接使用快取，回傳圖像資訊"""
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        image_id = hashlib.sha1(f"{path}|{mtime}".encode("utf-8")).hexdigest()[:16]
+        with self.lock:
+            entry = self.images.get(image_id)
+        if entry is None:
+            image = decode_image(path)
+            entry = {"path": path, "mtime": mtime, "width": image.width, "height": image.height, "image": image,
+                     "converted": {}}
+            with self.lock:
+                entry = self.images.setdefault(image_id, entry)
+        return {"image_id": image_id, "path": path, "width": entry["width"], "height": entry["height"]}
+    
+    def resolve_image_id(self, image_ref):
+        """圖像參照可以是已註冊的圖像ID或檔案路徑，回傳圖像ID"""
+        with self.lock:
+            if image_ref in self.images:
+                return image_ref
+        return self.register_image(image_ref)["image_id"]
+    
+    def get_image(self, image_id, grayscale=False):
+        """取得已解碼的圖像，灰階版本轉換一次後快取；已被釋放的圖像重新解碼"""
+        with self.lock:
+            entry = self.images[image_id]
+            self.images.move_to_end(image_id)
+            image = entry["image"]
+            converted = entry["converted"].get('L') if grayscale else image
+        if image is None:
+            image = decode_image(entry["path"])
+            with self.lock:
+                entry["image"] = image
+            converted = None if grayscale else image
+        if converted is None:
+            converted = image.convert('L')
+            with self.lock:
+                entry["converted"]['L'] = converted
+        return converted
+    
+    def cache_bytes(self):
+        """快取的解碼圖像、差距圖與保存的搜尋結果佔用的位元組數"""
+        with self.lock:
+            return self._cache_bytes()
+    
+    def _cache_bytes(self):
+        total = sum(maps.diff1.nbytes + maps.diff2.nbytes for maps in self.score_cache.values())
+        total += sum(len(search["results"]) * SEARCH_RESULT_BYTES for search in self.searches.values())
+        for entry in self.images.values():
+            cached = [entry["image"]] + list(entry["converted"].values())
+            total += sum(image_nbytes(image) for image in cached if image is not None)
+        return total
+    
+    def evict_caches(self, limit, keep=()):
+        """依最近使用的順序先釋放差距圖、再由最早開始的已完成搜尋及其結果、最後釋放解碼圖像，
+        直到快取不超過 limit 位元組；keep 中的鍵 (差距圖鍵、搜尋ID或圖像ID) 不釋放"""
+        with self.lock:
+            total = self._cache_bytes()
+            for key in list(self.score_cache):
+                if total <= limit:
+                    return
+                if key not in keep:
+                    maps = self.score_cache.pop(key)
+                    total -= maps.diff1.nbytes + maps.diff2.nbytes
+            for search_id, search in list(self.searches.items()):
+                if total <= limit:
+                    return
+                if search_id not in keep and search["status"] != "running":
+                    del self.searches[search_id]
+                    total -= len(search["results"]) * SEARCH_RESULT_BYTES
+            for image_id, entry in self.images.items():
+                if total <= limit:
+                    return
+                if image_id not in keep and entry["image"] is not None:
+                    cached = [entry["image"]] + list(entry["converted"].values())
+                    total -= sum(image_nbytes(image) for image in cached)
+                    entry["image"] = None
+                    entry["converted"] = {}
+    
+    def start_search(self, params):
+        """提交一個網格搜尋，回傳搜尋ID；參數在提交前檢查，不合法時拋出指出欄位的 ValueError"""
+        def field(name, default, convert, valid, requirement):
+            try:
+                value = convert(params.get(name, default))
+            except (TypeError, ValueError):
+                raise ValueError(f"參數 {name} 格式錯誤: {params.get(name)!r}")
+            if not valid(value):
+                raise ValueError(f"參數 {name} 必須{requirement}: {value}")
+            return value
+        
+        params = {
+            "img1": params["img1"],
+            "img2": params["img2"],
+            "gt": params["gt"],
+            "window_size": field("window_size", 32, int, lambda v: v >= 1, "為正整數"),
+            "grid_size": field("grid_size", 20, int, lambda v: v >= 1, "為正整數"),
+            "mode": field("mode", 1, int, lambda v: v in (1, 2), "為 1 或 2"),
+            "metric": resolve_metric(params.get("metric", "MSE")),
+            "grayscale": bool(params.get("grayscale", False)),
+            "reducer": params.get("reducer", "grid"),
+            "max_results": field("max_results", 100, int, lambda v: v >= 1, "為正整數"),
+            "max_iou": field("max_iou", 0.3, float, lambda v: 0.0 <= v <= 1.0, "介於 0 與 1 之間"),
+            "split_threshold": field("split_threshold", 1.0, float, lambda v: v >= 0.0, "不小於 0"),
+        }
+        if params["reducer"] not in RESULT_REDUCERS:
+            raise ValueError(f"未知的結果縮減方式: {params['reducer']}")
+        search_id = uuid.uuid4().hex[:16]
+        search = {"params": params, "status": "running", "results": [], "error": None}
+        with self.lock:
+            self.searches[search_id] = search
+        search["future"] = self.search_executor.submit(self._run_search, search_id, search)
+        return search_id
+    
+    def _run_search(self, search_id, search):
+        params = search["params"]
+        try:
+            image_ids = tuple(self.resolve_image_id(params[key]) for key in ("img1", "img2", "gt"))
+            images = [self.get_image(image_id, params["grayscale"]) for image_id in image_ids]
+            
+            # 差距圖與模式、網格大小無關，同一組圖像與窗口設定可重複使用
+            cache_key = image_ids + (params["window_size"], params["metric"], params["grayscale"])
+            with self.lock:
+                maps = self.score_cache.get(cache_key)
+                if maps is not None:
+                    self.score_cache.move_to_end(cache_key)
+            if maps is None:
+                if compute_search_bounds(*images, params["window_size"]) is None:
+                    raise ValueError(f"圖像尺寸不足，無法使用 {params['window_size']}x{params['window_size']} 的窗口進行比較")
+                memory_budget = None
+                if self.memory_budget is not None:
+                    # 先依預估用量釋放其他快取，剩餘空間再由搜尋規劃列帶高度與並行數
+                    channels, itemsize = image_layout(images[2])
+                    plan = plan_search_memory(self.memory_budget, images[2].height, images[2].width, channels,
+                                              params["window_size"], itemsize, self.workers, "thread")
+                    self.evict_caches(self.memory_budget - plan["estimate"], keep=image_ids)
+                    # 搜尋的圖像已在快取中，由 search_offsets 計入上限，這裡不重複扣除
+                    searched = {id(image): image for image in images}.values()
+                    memory_budget = self.memory_budget - self.cache_bytes() + sum(image_nbytes(image) for image in searched)
+                maps = search_offsets(*images, params["window_size"], params["metric"], executor=self.band_executor,
+                                      memory_budget=memory_budget)
+                with self.lock:
+                    self.score_cache[cache_key] = maps
+            search["results"] = reduce_score_maps(maps, params["mode"], params["window_size"], params)
+            search["status"] = "done"
+            if self.memory_budget is not None:
+                self.evict_caches(self.memory_budget, keep=image_ids + (cache_key, search_id))
+        except Exception as e:
+            search["error"] = str(e)
+            search["status"] = "failed"
+    
+    def get_search(self, search_id, top_k=None, wait=False):
+        """取得搜尋狀態與前 top_k 個結果"""
+        with self.lock:
+            search = self.searches[search_id]
+        if wait:
+            search["future"].result()
+        results = search["results"] if top_k is None else search["results"][:top_k]
+        return {
+            "search_id": search_id,
+            "status": search["status"],
+            "error": search["error"],
+            "params": search["params"],
+            "total": len(search["results"]),
+            "results": [list(result) for result in results],
+        }
+    
+    def render_crop(self, image_ref, x, y, size, preview_size=None):
+        """裁剪窗口區域並編碼為PNG，可選擇以最近鄰插值放大到預覽尺寸"""
+        crop = self.get_image(self.resolve_image_id(image_ref)).crop((x, y, x + size, y + size))
+        if isinstance(crop, MultiBandImage):
+            crop = crop.convert('RGB')
+        if preview_size:
+            crop = crop.resize((preview_size, preview_size), Image.NEAREST)
+        buffer = io.BytesIO()
+        crop.save(buffer, format="PNG")
+        return buffer.getvalue()
+    
+    def shutdown(self):
+        self.search_executor.shutdown()
+        self.band_executor.shutdown()
+
+class ComparisonRequestHandler(BaseHTTPRequestHandler):
+    """比較服務的HTTP請求處理器
+
+    POST /images   {"path"}                                  註冊圖像
+    POST /search   {"img1", "img2", "gt", "window_size", "grid_size", "mode", "metric", "grayscale", "wait"}
+    GET  /results?search_id=&top_k=&wait=                    取得前K個結果
+    GET  /crop?image=&x=&y=&size=&preview=                   取得窗口裁剪圖(PNG)
+    """
+    service = None
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == "/results":
+                top_k = int(query["top_k"]) if "top_k" in query else None
+                self.send_json(self.service.get_search(query["search_id"], top_k, query.get("wait") == "1"))
+            elif url.path == "/crop":
+                png = self.service.render_crop(query["image"], int(query["x"]), int(query["y"]), int(query["size"]),
+                                               int(query["preview"]) if "preview" in query else None)
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(png)))
+                self.end_headers()
+                self.wfile.write(png)
+            else:
+                self.send_json({"error": f"未知的路徑: {url.path}"}, 404)
+        except KeyError as e:
+            self.send_json({"error": f"找不到或缺少參數: {e}"}, 404)
+        except Exception as e:
+            self.send_json({"error": str(e)}, 400)
+    
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if url.path == "/images":
+                self.send_json(self.service.register_image(body["path"]))
+            elif url.path == "/search":
+                search_id = self.service.start_search(body)
+                self.send_json(self.service.get_search(search_id, body.get("top_k"), body.get("wait", False)))
+            else:
+                self.send_json({"error": f"未知的路徑: {url.path}"}, 404)
+        except KeyError as e:
+            self.send_json({"error": f"找不到或缺少參數: {e}"}, 404)
+        except Exception as e:
+            self.send_json({"error": str(e)}, 400)
+    
+    def send_json(self, data, status=200):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def log_message(self, format, *args):
+        # 只在錯誤時輸出日誌
+        pass
+
+class ComparisonServiceClient:
+    """比較服務的客戶端，供圖形介面遠端執行搜尋"""
+    
+    def __init__(self, base_url, timeout=3600):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+    
+    def _request(self, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib_request.Request(self.base_url + path, data=data,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib_request.urlopen(req, timeout=self.timeout) as response:
+                content = response.read()
+                if response.headers.get_content_type() == "application/json":
+                    return json.loads(content)
+                return content
+        except urllib_request.HTTPError as e:
+            raise RuntimeError(json.loads(e.read()).get("error", str(e)))
+    
+    def register_image(self, path):
+        return self._request("/images", {"path": path})
+    
+    def search(self, img1, img2, gt, window_size, mode, metric, reduction, grayscale=False, top_k=None,
+               stop_requested=None):
+        """執行搜尋並等待完成，回傳結果字典；reduction 為結果縮減設定
+
+        指定 stop_requested 時不在單一請求中等待，改為每隔 SERVICE_POLL_INTERVAL 秒查詢一次狀態，
+        函數回傳True時停止等待並回傳None (服務端的搜尋仍會完成)
+        """
+        result = self._request("/search", dict(reduction, **{
+            "img1": img1, "img2": img2, "gt": gt, "window_size": window_size,
+            "mode": mode, "metric": metric, "grayscale": grayscale, "top_k": top_k, "wait": stop_requested is None,
+        }))
+        while result["status"] == "running":
+            if stop_requested():
+                return None
+            time.sleep(SERVICE_POLL_INTERVAL)
+            query = {"search_id": result["search_id"]}
+            if top_k is not None:
+                query["top_k"] = top_k
+            result = self._request("/results?" + urlencode(query))
+        if result["status"] != "done":
+            raise RuntimeError(result["error"] or "搜尋失敗")
+        result["results"] = [(int(x), int(y), score, diff1, diff2) for x, y, score, diff1, diff2 in result["results"]]
+        return result
+    
+    def crop(self, image, x, y, size, preview_size=None):
+        query = {"image": image, "x": x, "y": y, "size": size}
+        if preview_size:
+            query["preview"] = preview_size
+        return self._request("/crop?" + urlencode(query))
+
+# 全局函數，解析命令列的起點範圍
+def parse_offset_range(text):
+    """將 "起:迄" 格式的字串轉為半開區間，省略的一端為None"""
+    if not text:
+        return None
+    start, _, stop = text.partition(":")
+    return (int(start) if start else 0, int(stop) if stop else sys.maxsize)
+
+def print_memory_usage(maps, monitor):
+    """輸出記憶體上限下採用的搜尋計畫與實際峰值"""
+    if maps.memory:
+        print(format_memory_plan(maps.memory))
+    print(monitor.summary())
+
+def run_shard_command(args):
+    """命令列分片模式：搜尋指定範圍並寫出部分結果檔"""
+    metric = resolve_metric(args.metric)
+    images = [open_image_file(path) for path in (args.img1, args.img2, args.gt)]
+    if args.grayscale:
+        images = [img.convert('L') for img in images]
+    
+    if compute_search_bounds(*images, args.window_size) is None:
+        print(f"圖像尺寸不足，無法使用 {args.window_size}x{args.window_size} 的窗口進行比較!", file=sys.stderr)
+        return 1
+    
+    rows = parse_offset_range(args.rows)
+    cols = parse_offset_range(args.cols)
+    band_weights = parse_band_weights(args.band_weights)
+    try:
+        with PeakMemoryMonitor() as monitor:
+            maps = search_offsets(*images, args.window_size, metric, x_range=cols, y_range=rows,
+                                  backend=args.backend, collect_stats=True, band_weights=band_weights,
+                                  memory_budget=args.memory_budget)
+            grid_results = reduce_grid_score_maps(maps, args.mode, args.grid_size)
+    except MemoryError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    
+    params = {
+        "window_size": args.window_size,
+        "grid_size": args.grid_size,
+        "mode": args.mode,
+        "metric": metric,
+        "grayscale": args.grayscale,
+        "image_paths": [os.path.abspath(path) for path in (args.img1, args.img2, args.gt)],
+        "image_sizes": [list(img.size) for img in images],
+        "rows": list(rows) if rows else None,
+        "cols": list(cols) if cols else None,
+        "band_weights": band_weights,
+        "max_value": pil_max_value(images[2]),
+        "global_stats": maps.stats.tolist(),
+    }
+    save_partial_results(args.output, grid_results, params)
+    print(f"已寫入部分結果: {args.output} ({len(grid_results)} 個網格，"
+          f"共 {maps.diff1.size} 個窗口，{format_skipped_windows(maps)}，使用 {maps.backend} 後端)")
+    print(format_global_stats(summarize_global_stats(maps.stats, params["max_value"])))
+    print_memory_usage(maps, monitor)
+    return 0
+
+def run_export_command(args):
+    """命令列匯出模式：搜尋所有窗口並以 .npy 記憶體映射檔寫出差距圖"""
+    metric = resolve_metric(args.metric)
+    images = [open_image_file(path) for path in (args.img1, args.img2, args.gt)]
+    if args.grayscale:
+        images = [img.convert('L') for img in images]
+    
+    if compute_search_bounds(*images, args.window_size) is None:
+        print(f"圖像尺寸不足，無法使用 {args.window_size}x{args.window_size} 的窗口進行比較!", file=sys.stderr)
+        return 1
+    
+    params = {
+        "window_size": args.window_size,
+        "metric": metric,
+        "grayscale": args.grayscale,
+        "image_paths": [os.path.abspath(path) for path in (args.img1, args.img2, args.gt)],
+        "image_sizes": [list(img.size) for img in images],
+        "band_weights": parse_band_weights(args.band_weights),
+        "per_band": args.per_band,
+    }
+    try:
+        with PeakMemoryMonitor() as monitor:
+            maps = export_score_maps(*images, args.window_size, metric, args.mode, args.output, params,
+                                     np.dtype(args.dtype), args.backend, params["band_weights"], args.per_band,
+                                     args.memory_budget)
+    except MemoryError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"已匯出差距圖至 {args.output} (形狀 {maps.diff1.shape[0]}x{maps.diff1.shape[1]}，{args.dtype}，"
+          f"{format_skipped_windows(maps)}，使用 {maps.backend} 後端)")
+    print(format_global_stats(summarize_global_stats(maps.stats, pil_max_value(images[2]))))
+    print_memory_usage(maps, monitor)
+    return 0
+
+def run_merge_command(args):
+    """命令列合併模式：合併分片結果為最終排序結果檔"""
+    try:
+        params, results = merge_partial_results(args.inputs)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    grid_results = reduce_grid_results(results, params["grid_size"])
+    save_partial_results(args.output, grid_results, params)
+    print(f"已合併 {len(args.inputs)} 個分片至 {args.output}，共 {len(results)} 個網格結果")
+    if "global_stats" in params:
+        print(format_global_stats(summarize_global_stats(params["global_stats"], params["max_value"])))
+    for x, y, score, diff1, diff2 in results[:args.top]:
+        print(f"({x},{y}) 差距分數: {score:.6f} 圖1與GT差距: {diff1:.6f} 圖2與GT差距: {diff2:.6f}")
+    return 0
+
+def run_serve_command(args):
+    """命令列服務模式：啟動本機HTTP比較服務"""
+    service = ComparisonService(args.workers, args.memory_budget)
+    handler = type("BoundComparisonRequestHandler", (ComparisonRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    budget = f"，記憶體上限 {format_memory_size(service.memory_budget)}" if service.memory_budget else ""
+    print(f"比較服務已啟動: http://{args.host}:{server.server_port} (計算執行緒 {service.workers} 個{budget})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+def build_arg_parser():
+    """建立命令列參數解析器，未指定子命令時啟動圖形介面"""
+    parser = argparse.ArgumentParser(description="圖像比較工具")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    shard_parser = subparsers.add_parser("shard", help="在指定起點範圍內搜尋並寫出部分結果檔")
+    shard_parser.add_argument("--img1", required=True, help="圖像1路徑")
+    shard_parser.add_argument("--img2", required=True, help="圖像2路徑")
+    shard_parser.add_argument("--gt", required=True, help="GT參考圖路徑")
+    shard_parser.add_argument("--window-size", type=int, default=32, help="窗口大小")
+    shard_parser.add_argument("--grid-size", type=int, default=20, help="網格大小")
+    shard_parser.add_argument("--mode", type=int, choices=(1, 2), default=1,
+                              help="1: 圖像1最接近GT; 2: 圖像2最接近GT")
+    shard_parser.add_argument("--metric", default="MSE", help="差距度量方式 (MSE/MAE/SSIM/SSIM-MAE)")
+    shard_parser.add_argument("--grayscale", action="store_true", help="使用灰階比較")
+    shard_parser.add_argument("--rows", help="窗口起點Y範圍，格式為 起:迄 (不含迄)")
+    shard_parser.add_argument("--cols", help="窗口起點X範圍，格式為 起:迄 (不含迄)")
+    shard_parser.add_argument("--backend", choices=("auto", "serial", "thread", "process"), default="auto",
+                              help="執行後端，預設依圖像大小自動選擇")
+    shard_parser.add_argument("--band-weights", help="各波段權重，以逗號分隔 (預設相等)")
+    shard_parser.add_argument("--memory-budget", type=parse_memory_size,
+                              help="記憶體上限 (例如 4G、512M)，超過時自動調整列帶高度、並行數與差距圖精度")
+    shard_parser.add_argument("--output", required=True, help="部分結果檔輸出路徑 (.npz)")
+    
+    export_parser = subparsers.add_parser("export", help="搜尋所有窗口並匯出完整差距圖 (.npy)")
+    export_parser.add_argument("--img1", required=True, help="圖像1路徑")
+    export_parser.add_argument("--img2", required=True, help="圖像2路徑")
+    export_parser.add_argument("--gt", required=True, help="GT參考圖路徑")
+    export_parser.add_argument("--window-size", type=int, default=32, help="窗口大小")
+    export_parser.add_argument("--mode", type=int, choices=(1, 2), default=1,
+                               help="分數圖方向，1: 圖像1最接近GT; 2: 圖像2最接近GT")
+    export_parser.add_argument("--metric", default="MSE", help="差距度量方式 (MSE/MAE/SSIM/SSIM-MAE)")
+    export_parser.add_argument("--grayscale", action="store_true", help="使用灰階比較")
+    export_parser.add_argument("--dtype", choices=("float64", "float32"), default="float64", help="差距圖精度")
+    export_parser.add_argument("--backend", choices=("auto", "serial", "thread", "process"), default="auto",
+                               help="執行後端，預設依圖像大小自動選擇")
+    export_parser.add_argument("--band-weights", help="各波段權重，以逗號分隔 (預設相等)")
+    export_parser.add_argument("--per-band", action="store_true", help="保留各波段的差距圖 (多一個波段維度)")
+    export_parser.add_argument("--memory-budget", type=parse_memory_size,
+                               help="記憶體上限 (例如 4G、512M)，超過時自動調整列帶高度與並行數")
+    export_parser.add_argument("--output", required=True, help="輸出資料夾")
+    
+    merge_parser = subparsers.add_parser("merge", help="合併多個部分結果檔")
+    merge_parser.add_argument("inputs", nargs="+", help="部分結果檔路徑")
+    merge_parser.add_argument("--output", required=True, help="合併結果檔輸出路徑 (.npz)")
+    merge_parser.add_argument("--top", type=int, default=10, help="輸出前幾名結果")
+    
+    serve_parser = subparsers.add_parser("serve", help="啟動本機HTTP比較服務")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="監聽位址")
+    serve_parser.add_argument("--port", type=int, default=8765, help="監聽埠號")
+    serve_parser.add_argument("--workers", type=int, default=None, help="計算執行緒數，預設為CPU核心數")
+    serve_parser.add_argument("--memory-budget", type=parse_memory_size,
+                              help="記憶體上限 (例如 8G)，包含已解碼圖像與差距圖快取，超過時先釋放較久未用的快取")
+    
+    return parser
+
+class ProgressiveSearchWorker(QThread):
+    """在背景執行漸進式搜尋：先以大步長粗略搜尋整張圖像，再逐輪縮小步長直到窮舉
+
+    粗略輪次只以間隔步長的像素估計格點上的窗口，計算量約為窮舉的 1/步長²；
+    相同區塊遮罩只計算一次供各輪共用，全域統計在最後的窮舉輪累加；
+    指定 memory_budget 時先依最耗記憶體的窮舉輪檢查上限，各輪再依 search_offsets 的計畫執行
+    """
+    pass_finished = pyqtSignal(list, int, object)  # (按分數排序的結果, 本輪步長, 本輪的差距圖)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, img1, img2, gt, window_size, mode, metric, reduction, band_weights=None,
+                 memory_budget=None, resident_bytes=0, parent=None):
+        super().__init__(parent)
+        self.images = (img1, img2, gt)
+        self.window_size = window_size
+        self.mode = mode
+        self.metric = metric
+        self.reduction = reduction
+        self.band_weights = band_weights
+        self.memory_budget = memory_budget
+        self.resident_bytes = resident_bytes
+    
+    def run(self):
+        try:
+            if self.memory_budget is not None:
+                # 在轉換輸入與計算相同區塊前檢查，上限不足以完成窮舉輪時不必執行粗略輪次
+                max_start_x, max_start_y = compute_search_bounds(*self.images, self.window_size)
+                channels, itemsize = image_layout(self.images[2])
+                sources = self.resident_bytes + sum(image_nbytes(image) for image in
+                                                    {id(image): image for image in self.images}.values())
+                plan_search_memory(self.memory_budget, max_start_y + self.window_size, max_start_x + self.window_size,
+                                   channels, self.window_size, itemsize, mp.cpu_count(), "thread",
+                                   moments=self.metric == METRIC_OPTIONS[3], source_bytes=sources)
+            identical_blocks = compute_identical_blocks(*(np.asarray(image) for image in self.images))
+            for stride in PROGRESSIVE_STRIDES:
+                # 在背景執行緒中不建立進程池，使用多執行緒後端；
+                # 粗略輪次的分數只是估計值，每輪的結果直接取代前一輪，不與之前的結果合併
+                maps = search_offsets(*self.images, self.window_size, self.metric, backend="thread",
+                                      stride=stride, stop_requested=self.isInterruptionRequested,
+                                      collect_stats=stride == 1, band_weights=self.band_weights,
+                                      sample=stride > 1, identical_blocks=identical_blocks,
+                                      memory_budget=self.memory_budget,
+                                      resident_bytes=self.resident_bytes + identical_blocks.nbytes)
+                if maps is None or self.isInterruptionRequested():
+                    return
+                results = reduce_score_maps(maps, self.mode, self.window_size, self.reduction)
+                self.pass_finished.emit(results, stride, maps)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class ReportWorker(QThread):
+    """在背景產生結果報告，以 progress 訊號回報已完成的結果與聯絡表數"""
+    progress = pyqtSignal(int, int)  # (已完成, 總數)
+    report_finished = pyqtSignal(list, float)  # (聯絡表檔名列表, 耗時秒數)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, directory, images, results, window_size, params, tile_size, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.images = images
+        self.results = results
+        self.window_size = window_size
+        self.params = params
+        self.tile_size = tile_size
+    
+    def run(self):
+        try:
+            start = time.perf_counter()
+            names = write_result_report(self.directory, self.images, self.results, self.window_size, self.params,
+                                        self.tile_size, progress=self.progress.emit,
+                                        stop_requested=self.isInterruptionRequested)
+            if names is not None:
+                self.report_finished.emit(names, time.perf_counter() - start)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class RemoteSearchWorker(QThread):
+    """在背景透過比較服務執行搜尋，等待期間介面不會停止回應，可隨時中止"""
+    search_finished = pyqtSignal(dict)  # 比較服務回傳的結果字典
+    failed = pyqtSignal(str)
+    
+    def __init__(self, service_url, image_paths, window_size, mode, metric, reduction, grayscale, parent=None):
+        super().__init__(parent)
+        self.service_url = service_url
+        self.image_paths = image_paths
+        self.window_size = window_size
+        self.mode = mode
+        self.metric = metric
+        self.reduction = reduction
+        self.grayscale = grayscale
+    
+    def run(self):
+        try:
+            result = ComparisonServiceClient(self.service_url).search(
+                *self.image_paths, self.window_size, self.mode, self.metric, self.reduction, self.grayscale,
+                stop_requested=self.isInterruptionRequested)
+            if result is not None and not self.isInterruptionRequested():
+                self.search_finished.emit(result)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+class MultiBandImage:
+    """以 (H, W, C) 陣列保存任意波段數的圖像，提供搜尋與顯示所需的類PIL介面
+
+    np.asarray() 取得原始陣列 (單一波段時為二維)，顯示時依 display_bands 指定的三個波段轉為RGB
+    """
+    mode = "MULTIBAND"
+    
+    def __init__(self, array, display_bands=None, display_max=None):
+        self.array = array if array.ndim == 3 else array[..., None]
+        self.display_bands = display_bands
+        # 顯示時以整張圖像的最大值拉伸，16位元影像實際常只用到12位元
+        self.display_max = display_max if display_max is not None else max(float(self.array.max()), 1.0)
+    
+    @property
+    def size(self):
+        return self.array.shape[1], self.array.shape[0]
+    
+    @property
+    def width(self):
+        return self.array.shape[1]
+    
+    @property
+    def height(self):
+        return self.array.shape[0]
+    
+    @property
+    def bands(self):
+        return self.array.shape[2]
+    
+    def __array__(self, dtype=None, copy=None):
+        array = self.array[..., 0] if self.bands == 1 else self.array
+        return array.astype(dtype) if dtype is not None else array
+    
+    def load(self):
+        pass
+    
+    def copy(self):
+        return MultiBandImage(self.array.copy(), self.display_bands, self.display_max)
+    
+    def crop(self, box):
+        x0, y0, x1, y1 = box
+        return MultiBandImage(self.array[y0:y1, x0:x1], self.display_bands, self.display_max)
+    
+    def thumbnail(self, size):
+        """就地以間隔取樣縮小到不超過 size"""
+        step = math.ceil(max(self.width / size[0], self.height / size[1]))
+        if step > 1:
+            self.array = self.array[::step, ::step]
+    
+    def convert(self, mode):
+        """'L' 為各波段平均的單波段圖像 (保留原始精度)，'RGB' 為依顯示波段轉換的8位元PIL圖像"""
+        if mode == 'L':
+            gray = self.array.mean(axis=2)
+            if np.issubdtype(self.array.dtype, np.integer):
+                gray = np.rint(gray).astype(self.array.dtype)
+            return MultiBandImage(gray, None, self.display_max)
+        if mode == 'RGB':
+            return Image.fromarray(self.render_rgb())
+        raise ValueError(f"多波段圖像不支援轉換為 {mode}")
+    
+    def render_rgb(self):
+        """將指定的三個波段拉伸為8位元RGB陣列，未指定時取前三個波段 (不足三個時以第一個波段顯示灰階)"""
+        bands = self.display_bands or ((0, 1, 2) if self.bands >= 3 else (0, 0, 0))
+        bands = [min(band, self.bands - 1) for band in bands]
+        rgb = self.array[..., bands].astype(np.float32) * (255.0 / self.display_max)
+        return np.clip(rgb, 0, 255).astype(np.uint8)
+
+# 全局函數，讀取TIFF的所有波段
+def read_tiff_bands(path):
+    """以 tifffile 讀取TIFF，將頁、樣本等非空間維度全部攤平成波段，回傳 (H, W, C) 陣列"""
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        array = series.asarray()
+        axes = series.axes
+    y, x = axes.index('Y'), axes.index('X')
+    others = [axis for axis in range(array.ndim) if axis not in (y, x)]
+    array = np.transpose(array, (y, x, *others))
+    return array.reshape(array.shape[0], array.shape[1], -1)
+
+# 全局函數，將多頁圖像堆疊為波段
+def stack_image_pages(image):
+    """將PIL多頁圖像的每一頁(及其通道)依序堆疊為 (H, W, C) 陣列"""
+    pages = []
+    for index in range(getattr(image, "n_frames", 1)):
+        image.seek(index)
+        page = np.asarray(image)
+        if pages and page.shape[:2] != pages[0].shape[:2]:
+            raise ValueError(f"第 {index+1} 頁的大小與第1頁不同，無法作為波段堆疊")
+        pages.append(page if page.ndim == 3 else page[..., None])
+    return np.concatenate(pages, axis=2)
+
+# 全局函數，開啟圖像檔
+def open_image_file(path):
+    """開啟圖像檔；一般8位元圖像沿用PIL，多頁、16位元或超過4個波段的TIFF以 MultiBandImage 保存所有波段"""
+    is_tiff = path.lower().endswith(('.tif', '.tiff'))
+    try:
+        image = Image.open(path)
+    except OSError:
+        # PIL無法開啟超過4個樣本的TIFF
+        if is_tiff and tifffile is not None:
+            return MultiBandImage(read_tiff_bands(path))
+        raise
+    
+    multi_page = is_tiff and getattr(image, "n_frames", 1) > 1
+    if image.mode in STANDARD_IMAGE_MODES and not multi_page:
+        return image
+    if is_tiff and tifffile is not None:
+        return MultiBandImage(read_tiff_bands(path))
+    return MultiBandImage(stack_image_pages(image))
+
+# 全局函數，解析波段權重
+def parse_band_weights(text):
+    """將以逗號分隔的權重字串轉為列表，空字串回傳None (各波段相等權重)"""
+    if not text or not text.strip():
+        return None
+    weights = [float(value) for value in text.split(",")]
+    if any(weight < 0 for weight in weights) or sum(weights) <= 0:
+        raise ValueError("波段權重不可為負，且總和必須大於0")
+    return weights
+
+# 全局函數，解析顯示波段
+def parse_display_bands(text):
+    """將 "R,G,B" 三個波段索引的字串轉為元組，空字串回傳None (使用預設波段)"""
+    if not text or not text.strip():
+        return None
+    bands = tuple(int(value) for value in text.split(","))
+    if len(bands) != 3 or min(bands) < 0:
+        raise ValueError("顯示波段需為三個非負的波段索引，例如 0,1,2")
+    return bands
+
+# 全局函數，計算單一窗口各波段的差距
+def window_error_maps(img1, img2, gt, x, y, window_size, metric, use_grayscale=False, band_weights=None):
+    """計算窗口內的誤差圖，回傳 (裁剪陣列, 各波段差距, 逐像素誤差圖)，各為圖像1、圖像2 (與GT) 的元組
+
+    逐像素誤差與窗口分數同一尺度 (波段加權後除以權重總和)，其平均值即為窗口差距；
+    灰階比較時逐像素誤差以灰階圖像計算，與搜尋一致。
+    完整SSIM的各波段差距為各波段單獨計算的 1 - SSIM，逐像素誤差則以絕對誤差表示
+    """
+    box = (x, y, x + window_size, y + window_size)
+    regions = tuple(np.asarray(img.crop(box)) for img in (img1, img2, gt))
+    region_gt = regions[2].astype(np.float64)
+    band_errors = tuple(pixel_error(region, region_gt, metric, per_band=True) for region in regions[:2])
+    if metric == METRIC_OPTIONS[3]:
+        columns = [fused_window_metrics(*(region.reshape(*region.shape[:2], -1)[..., band] for region in regions),
+                                        window_size, (metric,), max_value=image_max_value(regions[2].dtype))
+                   for band in range(band_errors[0].shape[2])]
+        band_diffs = tuple(np.array([diffs[image][0, 0, 0] for diffs in columns]) for image in range(2))
+    else:
+        band_diffs = tuple(errors.mean(axis=(0, 1)) for errors in band_errors)
+    if use_grayscale:
+        gray_gt = np.asarray(gt.crop(box).convert('L'), dtype=np.float64)
+        pixel_errors = tuple(pixel_error(np.asarray(img.crop(box).convert('L')), gray_gt, metric)
+                             for img in (img1, img2))
+    else:
+        weights = np.ones(band_errors[0].shape[2]) if band_weights is None else np.asarray(band_weights)
+        pixel_errors = tuple(errors @ weights / float(np.sum(weights)) for errors in band_errors)
+    return regions, band_diffs, pixel_errors
+
+# 全局函數，將窗口與GT的差異放大為可顯示的8位元陣列
+def amplified_difference(region, region_gt, gain, max_value, display_bands=None):
+    """|圖像 - GT| 乘上增益後拉伸到0-255，多波段時依顯示波段 (未指定時取前三個波段) 轉為RGB"""
+    diff = np.abs(region.astype(np.float32) - region_gt.astype(np.float32))
+    if diff.ndim == 3:
+        bands = list(display_bands) if display_bands else ([0, 1, 2] if diff.shape[2] >= 3 else [0])
+        diff = diff[..., [min(band, diff.shape[2] - 1) for band in bands]]
+        if diff.shape[2] == 1:
+            diff = diff[..., 0]
+    scaled = np.clip(diff * (gain * 255.0 / max_value), 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(scaled)
+
+# 全局函數，開啟並完整解碼圖像
+def decode_image(path):
+    """在背景執行緒中完整解碼圖像，之後在圖形介面執行緒裁剪時不需再讀取檔案"""
+    image = open_image_file(path)
+    image.load()
+    return image
+
+# 全局函數，取得圖像縮圖
+def load_thumbnail(path, size=THUMBNAIL_SIZE, cache_dir=THUMBNAIL_CACHE_DIR):
+    """回傳圖像的縮圖，優先使用磁碟快取；快取鍵包含路徑、大小與修改時間，檔案變更後自動重建"""
+    stat = os.stat(path)
+    key = hashlib.blake2b(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{size}".encode("utf-8"),
+                          digest_size=16).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{key}.png")
+    if os.path.exists(cache_path):
+        try:
+            return decode_image(cache_path)
+        except OSError:
+            pass
+    
+    image = Image.open(path)
+    # JPEG可直接以縮小的解析度解碼
+    image.draft('RGB', (size, size))
+    image.thumbnail((size, size))
+    if image.mode not in ('L', 'RGB', 'RGBA'):
+        image = image.convert('RGB')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        image.save(cache_path)
+    except OSError:
+        pass  # 快取寫入失敗不影響顯示
+    return image
+
+class ImageLoader(QObject):
+    """以執行緒池同時解碼多張圖像，完成後以信號通知圖形介面執行緒"""
+    image_loaded = pyqtSignal(int, str, object)  # (圖像位置, 路徑, 已解碼的圖像)
+    load_failed = pyqtSignal(int, str, str)  # (圖像位置, 路徑, 錯誤訊息)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.executor = ThreadPoolExecutor(max_workers=IMAGE_LOAD_WORKERS)
+    
+    def load(self, assignments):
+        """assignments 為 [(圖像位置, 路徑), ...]，所有圖像同時解碼"""
+        for index, path in assignments:
+            self.executor.submit(self._decode, index, path)
+    
+    def _decode(self, index, path):
+        try:
+            self.image_loaded.emit(index, path, decode_image(path))
+        except Exception as e:
+            self.load_failed.emit(index, path, str(e))
+    
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+class ThumbnailBrowser(QWidget):
+    """瀏覽資料夾中候選圖像的縮圖，點選後指定到圖像位置"""
+    assign_requested = pyqtSignal(int, str)  # (圖像位置, 路徑)
+    thumbnail_ready = pyqtSignal(str, QImage)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("縮圖瀏覽")
+        self.resize(900, 650)
+        self.items = {}
+        self.executor = ThreadPoolExecutor(max_workers=IMAGE_LOAD_WORKERS)
+        self.thumbnail_ready.connect(self.set_thumbnail)
+        
+        layout = QVBoxLayout(self)
+        folder_layout = QHBoxLayout()
+        self.folder_edit = QLineEdit()
+        self.folder_edit.setReadOnly(True)
+        folder_layout.addWidget(self.folder_edit)
+        folder_btn = QPushButton("選擇資料夾")
+        folder_btn.clicked.connect(self.choose_folder)
+        folder_layout.addWidget(folder_btn)
+        layout.addLayout(folder_layout)
+        
+        self.list_widget = QListWidget()
+        self.list_widget.setViewMode(QListWidget.IconMode)
+        self.list_widget.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.list_widget.setResizeMode(QListWidget.Adjust)
+        self.list_widget.setUniformItemSizes(True)
+        self.list_widget.setSelectionMode(QAbstractItemView.SingleSelection)
+        layout.addWidget(self.list_widget)
+        
+        assign_layout = QHBoxLayout()
+        for index, name in enumerate(("設為圖像1", "設為圖像2", "設為圖像3", "設為GT")):
+            button = QPushButton(name)
+            button.clicked.connect(lambda checked, idx=index: self.assign_selected(idx))
+            assign_layout.addWidget(button)
+        layout.addLayout(assign_layout)
+    
+    def choose_folder(self):
+        directory = QFileDialog.getExistingDirectory(self, "選擇候選圖像資料夾", self.folder_edit.text())
+        if directory:
+            self.open_folder(directory)
+    
+    def open_folder(self, directory):
+        """列出資料夾中的圖像，縮圖在背景依列表順序產生"""
+        self.folder_edit.setText(directory)
+        self.list_widget.clear()
+        self.items = {}
+        for path in sorted(scan_image_files(directory)):
+            item = QListWidgetItem(os.path.basename(path))
+            item.setData(Qt.UserRole, path)
+            item.setToolTip(path)
+            item.setSizeHint(QSize(THUMBNAIL_SIZE + 20, THUMBNAIL_SIZE + 40))
+            self.list_widget.addItem(item)
+            self.items[path] = item
+            self.executor.submit(self._load_thumbnail, path)
+    
+    def _load_thumbnail(self, path):
+        if path not in self.items:
+            return  # 已切換到其他資料夾
+        try:
+            self.thumbnail_ready.emit(path, array_to_qimage(np.asarray(load_thumbnail(path))))
+        except Exception:
+            pass  # 無法解碼的檔案維持沒有縮圖
+    
+    def set_thumbnail(self, path, image):
+        item = self.items.get(path)
+        if item is not None:
+            item.setIcon(QIcon(QPixmap.fromImage(image)))
+    
+    def assign_selected(self, index):
+        item = self.list_widget.currentItem()
+        if item is not None:
+            self.assign_requested.emit(index, item.data(Qt.UserRole))
+
+# 全局函數，列出資料夾中的圖像檔
+def scan_image_files(directory):
+    """回傳 {路徑: (檔案大小, 修改時間)}，用於偵測新增或變更的圖像"""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+class WatchComparisonWorker(QThread):
+    """在背景依序比較監看資料夾中的候選圖像與固定的基準圖(圖像1)及GT"""
+    comparison_finished = pyqtSignal(str, object, list)  # (檔案路徑, 檔案簽章, 按分數排序的結果)
+    comparison_failed = pyqtSignal(str, str)  # (檔案路徑, 錯誤訊息)
+    
+    def __init__(self, baseline, gt, settings, parent=None):
+        super().__init__(parent)
+        self.baseline = baseline
+        self.gt = gt
+        self.settings = settings
+        self.pending = queue.Queue()
+    
+    def enqueue(self, path, signature):
+        self.pending.put((path, signature))
+    
+    def run(self):
+        settings = self.settings
+        while not self.isInterruptionRequested():
+            try:
+                path, signature = self.pending.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            try:
+                candidate = decode_image(path)
+                if settings["grayscale"]:
+                    candidate = candidate.convert('L')
+                if compute_search_bounds(self.baseline, candidate, self.gt, settings["window_size"]) is None:
+                    raise ValueError("圖像尺寸不足")
+                maps = search_offsets(self.baseline, candidate, self.gt, settings["window_size"], settings["metric"],
+                                      backend="thread", stop_requested=self.isInterruptionRequested,
+                                      band_weights=settings.get("band_weights"))
+                if maps is None:
+                    return
+                results = reduce_score_maps(maps, settings["mode"], settings["window_size"], settings["reduction"])
+                self.comparison_finished.emit(path, signature, results)
+            except Exception as e:
+                self.comparison_failed.emit(path, str(e))
+
+class WatchFolderWindow(QWidget):
+    """監看資料夾，自動比較新增或變更的候選圖像並依最佳分數排名"""
+    result_selected = pyqtSignal(str, list, dict)  # (候選圖像路徑, 結果列表, 比較設定)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("監看資料夾")
+        self.resize(800, 500)
+        self.directory = None
+        self.worker = None
+        self.settings = None
+        self.observed = {}   # 上一次掃描看到的檔案簽章
+        self.compared = {}   # 已排入比較的檔案簽章
+        self.history = {}    # 每個檔案的比較歷史 [(時間, 最佳分數, 結果列表)]
+        
+        self.file_watcher = QFileSystemWatcher(self)
+        self.file_watcher.directoryChanged.connect(lambda _: self.scan_timer.start())
+        # 目錄變更時延遲掃描，合併短時間內的多次通知
+        self.scan_timer = QTimer(self)
+        self.scan_timer.setSingleShot(True)
+        self.scan_timer.setInterval(500)
+        self.scan_timer.timeout.connect(self.scan_directory)
+        # 定期輪詢，確認寫入中的檔案是否已穩定
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(WATCH_POLL_INTERVAL)
+        self.poll_timer.timeout.connect(self.scan_directory)
+        
+        layout = QVBoxLayout(self)
+        self.status_label = QLabel("尚未開始監看")
+        layout.addWidget(self.status_label)
+        self.table = QTableWidget(0, 4)
+        self.table.setHorizontalHeaderLabels(["候選圖像", "最新分數", "歷史最佳", "比較次數"])
+        self.table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.cellDoubleClicked.connect(self.select_row)
+        layout.addWidget(self.table)
+        layout.addWidget(QLabel("雙擊一列即可將該候選圖像載入為圖像2並瀏覽其結果"))
+    
+    def start(self, directory, baseline, gt, settings):
+        """開始監看資料夾；資料夾中已存在的圖像也會被比較"""
+        self.stop()
+        self.directory = directory
+        self.settings = settings
+        self.observed = {}
+        self.compared = {}
+        self.history = {}
+        self.table.setRowCount(0)
+        self.worker = WatchComparisonWorker(baseline, gt, settings, self)
+        self.worker.comparison_finished.connect(self.on_comparison_finished)
+        self.worker.comparison_failed.connect(self.on_comparison_failed)
+        self.worker.start()
+        self.file_watcher.addPath(directory)
+        self.poll_timer.start()
+        self.status_label.setText(f"監看中: {directory}")
+        self.scan_directory()
+    
+    def stop(self):
+        if self.worker is not None:
+            self.worker.requestInterruption()
+            self.worker.wait()
+            self.worker = None
+        self.poll_timer.stop()
+        self.scan_timer.stop()
+        if self.file_watcher.directories():
+            self.file_watcher.removePaths(self.file_watcher.directories())
+    
+    def scan_directory(self):
+        """比較兩次掃描之間大小與修改時間都沒有變化的新檔案，避免讀到寫入中的檔案"""
+        if self.worker is None:
+            return
+        try:
+            current = scan_image_files(self.directory)
+        except OSError as e:
+            self.status_label.setText(f"無法讀取資料夾: {str(e)}")
+            return
+        for path, signature in current.items():
+            if self.observed.get(path) == signature and self.compared.get(path) != signature:
+                self.compared[path] = signature
+                self.worker.enqueue(path, signature)
+        self.observed = current
+        self.status_label.setText(f"監看中: {self.directory} ({len(current)} 個圖像)")
+    
+    def on_comparison_finished(self, path, signature, results):
+        if self.sender() is not self.worker:
+            return
+        score = results[0][2] if results else float('-inf')
+        entries = self.history.setdefault(path, [])
+        entries.append((time.time(), score, results))
+        del entries[:-WATCH_HISTORY_SIZE]
+        self.update_table()
+    
+    def on_comparison_failed(self, path, message):
+        if self.sender() is not self.worker:
+            return
+        # 保留已比較的簽章，檔案之後再被寫入時簽章改變才會重試
+        self.status_label.setText(f"比較 {os.path.basename(path)} 失敗: {message}")
+    
+    def ranked_files(self):
+        """依最新一次比較的最佳分數由高到低排序的檔案列表"""
+        return sorted(self.history, key=lambda path: self.history[path][-1][1], reverse=True)
+    
+    def update_table(self):
+        ranked = self.ranked_files()
+        self.table.setRowCount(len(ranked))
+        for row, path in enumerate(ranked):
+            entries = self.history[path]
+            name_item = QTableWidgetItem(os.path.basename(path))
+            name_item.setData(Qt.UserRole, path)
+            name_item.setToolTip("歷史分數: " + ", ".join(f"{score:.4f}" for _, score, _ in entries))
+            self.table.setItem(row, 0, name_item)
+            self.table.setItem(row, 1, QTableWidgetItem(f"{entries[-1][1]:.4f}"))
+            self.table.setItem(row, 2, QTableWidgetItem(f"{max(score for _, score, _ in entries):.4f}"))
+            self.table.setItem(row, 3, QTableWidgetItem(str(len(entries))))
+    
+    def select_row(self, row, column):
+        path = self.table.item(row, 0).data(Qt.UserRole)
+        self.result_selected.emit(path, self.history[path][-1][2], self.settings)
+    
+    def closeEvent(self, event):
+        self.stop()
+        self.status_label.setText("已停止監看")
+        super().closeEvent(event)
+
+# 全局函數，建立熱圖使用的色彩對照表
+def build_heatmap_lut():
+    """由藍、青、黃到紅的256色對照表 (RGB)"""
+    stops = np.array([[0, 0, 255], [0, 255, 255], [255, 255, 0], [255, 0, 0]], dtype=np.float64)
+    positions = np.linspace(0, len(stops) - 1, 256)
+    lower = np.floor(positions).astype(int).clip(0, len(stops) - 2)
+    fraction = (positions - lower)[:, None]
+    return (stops[lower] * (1 - fraction) + stops[lower + 1] * fraction).astype(np.uint8)
+
+HEATMAP_LUT = build_heatmap_lut()
+
+# 全局函數，建立分數圖的多層金字塔
+def build_score_pyramid(values, tile_size=HEATMAP_TILE_SIZE):
+    """以2x2最大值池化逐層縮小分數圖，直到整層小於一個圖塊；最大值池化可保留小範圍的熱點"""
+    levels = [np.asarray(values, dtype=np.float32)]
+    while max(levels[-1].shape) > tile_size:
+        previous = levels[-1]
+        height, width = previous.shape
+        padded = np.full((height + height % 2, width + width % 2), -np.inf, dtype=np.float32)
+        padded[:height, :width] = previous
+        levels.append(padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2).max(axis=(1, 3)))
+    return levels
+
+# 全局函數，將numpy陣列轉為QImage
+def array_to_qimage(array):
+    """支援灰階、RGB與RGBA的uint8陣列，回傳持有自身數據的QImage"""
+    array = np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    if array.ndim == 2:
+        return QImage(array.data, width, height, width, QImage.Format_Grayscale8).copy()
+    channels = array.shape[2]
+    image_format = QImage.Format_RGB888 if channels == 3 else QImage.Format_RGBA8888
+    return QImage(array.data, width, height, channels * width, image_format).copy()
+
+class TileCache:
+    """以最近最少使用(LRU)策略淘汰的圖塊快取"""
+    
+    def __init__(self, capacity=TILE_CACHE_SIZE):
+        self.capacity = capacity
+        self.tiles = OrderedDict()
+    
+    def get(self, key, create):
+        """取得圖塊，不存在時呼叫 create() 產生"""
+        tile = self.tiles.get(key)
+        if tile is None:
+            tile = create()
+            self.tiles[key] = tile
+            if len(self.tiles) > self.capacity:
+                self.tiles.popitem(last=False)
+        else:
+            self.tiles.move_to_end(key)
+        return tile
+    
+    def clear(self):
+        self.tiles.clear()
+
+class TiledView(QGraphicsView):
+    """以圖塊繪製大圖的檢視器基底，支援滾輪縮放、拖曳平移、點擊定位，並標示目前窗口與結果位置"""
+    location_clicked = pyqtSignal(int, int)  # 點擊位置對應的窗口起點
+    view_changed = pyqtSignal()  # 縮放或平移後發出，供多個檢視器同步
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setScene(QGraphicsScene(self))
+        self.setDragMode(QGraphicsView.ScrollHandDrag)
+        self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
+        self.tile_cache = TileCache()
+        self.window_size = 1
+        self.current_window = None
+        self.markers = []
+        self.press_pos = None
+        self.horizontalScrollBar().valueChanged.connect(self.view_changed)
+        self.verticalScrollBar().valueChanged.connect(self.view_changed)
+    
+    def set_current_window(self, x, y, size):
+        self.current_window = QRectF(x, y, size, size)
+        self.window_size = size
+        self.viewport().update()
+    
+    def set_markers(self, positions, size):
+        """設定要標示的結果窗口起點列表"""
+        self.markers = [QRectF(x, y, size, size) for x, y in positions]
+        self.viewport().update()
+    
+    def pyramid_level(self, cell_size, num_levels):
+        """依目前縮放比例選擇金字塔層級，使每個圖塊像素約佔一個螢幕像素"""
+        screen_per_cell = self.transform().m11() * cell_size
+        level = int(math.floor(math.log2(1 / screen_per_cell))) if screen_per_cell < 1 else 0
+        return max(0, min(level, num_levels - 1))
+    
+    def draw_tiles(self, painter, rect, origin, cell, level_shape, level, render_tile):
+        """繪製與可見範圍相交的圖塊；cell 為該層一個像素在場景中的大小"""
+        tile_extent = HEATMAP_TILE_SIZE * cell
+        level_height, level_width = level_shape
+        first_x = max(0, int((rect.left() - origin[0]) // tile_extent))
+        first_y = max(0, int((rect.top() - origin[1]) // tile_extent))
+        last_x = min(math.ceil(level_width / HEATMAP_TILE_SIZE) - 1, int((rect.right() - origin[0]) // tile_extent))
+        last_y = min(math.ceil(level_height / HEATMAP_TILE_SIZE) - 1, int((rect.bottom() - origin[1]) // tile_extent))
+        for tile_y in range(first_y, last_y + 1):
+            for tile_x in range(first_x, last_x + 1):
+                pixmap = self.tile_cache.get((level, tile_x, tile_y), lambda: render_tile(level, tile_x, tile_y))
+                painter.drawPixmap(QRectF(origin[0] + tile_x * tile_extent, origin[1] + tile_y * tile_extent,
+                                          pixmap.width() * cell, pixmap.height() * cell),
+                                   pixmap, QRectF(pixmap.rect()))
+    
+    def drawForeground(self, painter, rect):
+        pen = QPen(QColor(255, 200, 0))
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        for marker in self.markers:
+            if marker.intersects(rect):
+                painter.drawRect(marker)
+        if self.current_window is not None:
+            pen = QPen(QColor(255, 255, 255))
+            pen.setCosmetic(True)
+            pen.setWidth(2)
+            painter.setPen(pen)
+            painter.drawRect(self.current_window)
+    
+    def wheelEvent(self, event):
+        factor = 1.25 if event.angleDelta().y() > 0 else 0.8
+        self.scale(factor, factor)
+        self.view_changed.emit()
+    
+    def mousePressEvent(self, event):
+        self.press_pos = event.pos()
+        super().mousePressEvent(event)
+    
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        # 沒有拖曳時視為點擊，跳到以點擊位置為中心的窗口
+        if self.press_pos is not None and (event.pos() - self.press_pos).manhattanLength() < 4:
+            point = self.mapToScene(event.pos())
+            self.location_clicked.emit(max(0, int(point.x() - self.window_size / 2)),
+                                       max(0, int(point.y() - self.window_size / 2)))
+        self.press_pos = None
+
+class HeatmapView(TiledView):
+    """在GT上疊加窗口分數熱圖的檢視器，依縮放等級只產生畫面內可見的圖塊"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.background = None
+        self.pyramid = []
+        self.origin = (0.0, 0.0)
+        self.stride = 1
+        self.value_range = (0.0, 1.0)
+        self.opacity = 0.6
+    
+    def set_background(self, image):
+        """設定底圖(GT)，縮小為預覽後只上傳一次"""
+        preview = image.copy()
+        preview.thumbnail((HEATMAP_BACKGROUND_SIZE, HEATMAP_BACKGROUND_SIZE))
+        if preview.mode not in ('L', 'RGB', 'RGBA'):
+            preview = preview.convert('RGB')
+        self.background = QPixmap.fromImage(array_to_qimage(np.asarray(preview)))
+        self.scene().setSceneRect(QRectF(0, 0, image.width, image.height))
+        self.viewport().update()
+    
+    def set_scores(self, values, x0, y0, stride, window_size):
+        """設定分數圖；分數圖的 [i, j] 對應起點 (x0 + j*stride, y0 + i*stride) 的窗口，繪製於窗口中心"""
+        self.pyramid = build_score_pyramid(values)
+        finite = self.pyramid[0][np.isfinite(self.pyramid[0])]
+        low = float(finite.min()) if finite.size else 0.0
+        high = float(finite.max()) if finite.size else 1.0
+        self.value_range = (low, high if high > low else low + 1.0)
+        self.origin = (x0 + window_size / 2, y0 + window_size / 2)
+        self.stride = stride
+        self.window_size = window_size
+        self.tile_cache.clear()
+        self.viewport().update()
+    
+    def set_opacity(self, opacity):
+        self.opacity = opacity
+        self.tile_cache.clear()
+        self.viewport().update()
+    
+    def current_level(self):
+        return self.pyramid_level(self.stride, len(self.pyramid))
+    
+    def render_tile(self, level, tile_x, tile_y):
+        """將一個圖塊的分數轉為帶透明度的彩色圖像，分數越高越不透明"""
+        values = self.pyramid[level][tile_y * HEATMAP_TILE_SIZE:(tile_y + 1) * HEATMAP_TILE_SIZE,
+                                     tile_x * HEATMAP_TILE_SIZE:(tile_x + 1) * HEATMAP_TILE_SIZE]
+        low, high = self.value_range
+        normalized = np.nan_to_num((values - low) / (high - low), nan=0.0, neginf=0.0, posinf=1.0).clip(0, 1)
+        rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+        rgba[..., :3] = HEATMAP_LUT[(normalized * 255).astype(np.uint8)]
+        rgba[..., 3] = (normalized * 255 * self.opacity).astype(np.uint8)
+        return QPixmap.fromImage(array_to_qimage(rgba))
+    
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        if self.background is not None:
+            painter.drawPixmap(self.sceneRect(), self.background, QRectF(self.background.rect()))
+        if self.pyramid:
+            level = self.current_level()
+            self.draw_tiles(painter, rect, self.origin, self.stride * (2 ** level), self.pyramid[level].shape,
+                            level, self.render_tile)
+
+class ImagePyramid:
+    """圖像的多解析度金字塔，各層在第一次使用時才以2倍縮小產生"""
+    
+    def __init__(self, image):
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        self.levels = [image]
+        self.num_levels = 1
+        size = max(image.size)
+        while size > HEATMAP_TILE_SIZE:
+            size = (size + 1) // 2
+            self.num_levels += 1
+    
+    def level(self, index):
+        while len(self.levels) <= index:
+            self.levels.append(self.levels[-1].reduce(2))
+        return self.levels[index]
+    
+    def level_shape(self, index):
+        width, height = self.levels[0].size
+        scale = 2 ** index
+        return (math.ceil(height / scale), math.ceil(width / scale))
+    
+    def tile(self, index, tile_x, tile_y):
+        """裁出指定層級的一個圖塊"""
+        image = self.level(index)
+        box = (tile_x * HEATMAP_TILE_SIZE, tile_y * HEATMAP_TILE_SIZE,
+               min((tile_x + 1) * HEATMAP_TILE_SIZE, image.width), min((tile_y + 1) * HEATMAP_TILE_SIZE, image.height))
+        return array_to_qimage(np.asarray(image.crop(box)))
+
+class ImageTileView(TiledView):
+    """以圖像金字塔顯示整張圖像的檢視器，只解碼與上傳目前層級可見的圖塊"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pyramid = None
+    
+    def set_image(self, image):
+        self.pyramid = ImagePyramid(image) if image is not None else None
+        self.tile_cache.clear()
+        if image is not None:
+            self.scene().setSceneRect(QRectF(0, 0, image.width, image.height))
+        self.viewport().update()
+    
+    def render_tile(self, level, tile_x, tile_y):
+        return QPixmap.fromImage(self.pyramid.tile(level, tile_x, tile_y))
+    
+    def drawBackground(self, painter, rect):
+        super().drawBackground(painter, rect)
+        if self.pyramid is not None:
+            level = self.pyramid_level(1, self.pyramid.num_levels)
+            self.draw_tiles(painter, rect, (0, 0), 2 ** level, self.pyramid.level_shape(level), level,
+                            self.render_tile)
+
+class HeatmapWindow(QWidget):
+    """顯示整張圖像差異熱圖的獨立視窗"""
+    
+    # 熱圖來源選項：(名稱, 由差距圖計算數值的函數)
+    SOURCES = [
+        ("差距分數 (模式1)", lambda maps: score_map(maps, 1)),
+        ("差距分數 (模式2)", lambda maps: score_map(maps, 2)),
+        ("圖1與GT差距", lambda maps: maps.diff1),
+        ("圖2與GT差距", lambda maps: maps.diff2),
+    ]
+    
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("差異熱圖")
+        self.resize(1000, 800)
+        self.maps = None
+        self.window_size = 1
+        
+        layout = QVBoxLayout(self)
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("熱圖來源:"))
+        self.source_combo = QComboBox()
+        self.source_combo.addItems([name for name, _ in self.SOURCES])
+        self.source_combo.currentIndexChanged.connect(self.update_scores)
+        controls.addWidget(self.source_combo)
+        controls.addWidget(QLabel("透明度:"))
+        self.opacity_slider = QSlider(Qt.Horizontal)
+        self.opacity_slider.setRange(0, 100)
+        self.opacity_slider.setValue(60)
+        self.opacity_slider.valueChanged.connect(lambda value: self.view.set_opacity(value / 100))
+        controls.addWidget(self.opacity_slider)
+        controls.addWidget(QLabel("滾輪縮放、拖曳平移、點擊跳到該位置"))
+        layout.addLayout(controls)
+        
+        self.view = HeatmapView()
+        layout.addWidget(self.view)
+    
+    def set_data(self, gt, maps, mode, window_size):
+        """設定GT底圖與搜尋的差距圖，並預設顯示該次搜尋模式的分數"""
+        self.view.set_background(gt)
+        self.maps = maps
+        self.window_size = window_size
+        self.source_combo.blockSignals(True)
+        self.source_combo.setCurrentIndex(mode - 1)
+        self.source_combo.blockSignals(False)
+        self.update_scores()
+    
+    def update_scores(self):
+        if self.maps is None:
+            return
+        values = self.SOURCES[self.source_combo.currentIndex()][1](self.maps)
+        self.view.set_scores(values, self.maps.x0, self.maps.y0, self.maps.stride, self.window_size)
+
+class ImageViewerWindow(QWidget):
+    """同步縮放與平移四張圖像的全圖檢視視窗"""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("全圖檢視")
+        self.resize(1200, 900)
+        self.syncing = False
+        self.images = [None] * 4
+        
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel("滾輪縮放、拖曳平移 (四張圖同步)，點擊跳到該位置；黃框為搜尋結果，白框為目前窗口"))
+        grid = QGridLayout()
+        self.views = []
+        for i in range(4):
+            group = QGroupBox("GT參考圖" if i == 3 else f"圖像 {i+1}")
+            group_layout = QVBoxLayout(group)
+            view = ImageTileView()
+            view.view_changed.connect(lambda view=view: self.sync_views(view))
+            group_layout.addWidget(view)
+            grid.addWidget(group, i // 2, i % 2)
+            self.views.append(view)
+        layout.addLayout(grid)
+    
+    def set_images(self, images):
+        """更新有變動的圖像，未變動的圖像保留已產生的圖塊"""
+        for i, image in enumerate(images):
+            if image is not self.images[i]:
+                self.images[i] = image
+                self.views[i].set_image(image)
+    
+    def set_current_window(self, x, y, size):
+        for view in self.views:
+            view.set_current_window(x, y, size)
+    
+    def set_markers(self, positions, size):
+        for view in self.views:
+            view.set_markers(positions, size)
+    
+    def sync_views(self, source):
+        """以來源檢視器的縮放比例與中心點更新其他檢視器"""
+        if self.syncing:
+            return
+        self.syncing = True
+        center = source.mapToScene(source.viewport().rect().center())
+        for view in self.views:
+            if view is not source:
+                view.setTransform(source.transform())
+                view.centerOn(center)
+        self.syncing = False
+
+# 全局函數，建立黑暗主題調色盤
+def build_dark_palette(base):
+    """以 base 為基礎覆寫黑暗主題的顏色"""
+    palette = QPalette(base)
+    for role, color in DARK_THEME_COLORS.items():
+        palette.setColor(role, QColor(color))
+    for role in (QPalette.WindowText, QPalette.Text, QPalette.ButtonText):
+        palette.setColor(QPalette.Disabled, role, QColor(DARK_THEME_DISABLED_TEXT))
+    return palette
+
+# 全局函數，混合兩個調色盤
+def blend_palettes(start, end, progress):
+    """依 progress (0~1) 線性混合主題用到的各個顏色"""
+    palette = QPalette(end)
+    for group in (QPalette.Active, QPalette.Inactive, QPalette.Disabled):
+        for role in DARK_THEME_COLORS:
+            a, b = start.color(group, role), end.color(group, role)
+            palette.setColor(group, role, QColor(
+                int(a.red() + (b.red() - a.red()) * progress),
+                int(a.green() + (b.green() - a.green()) * progress),
+                int(a.blue() + (b.blue() - a.blue()) * progress)))
+    return palette
 
 class ImageComparisonTool(QMainWindow):
     def __init__(self):
@@ -90,8 +3061,49 @@ class ImageComparisonTool(QMainWindow):
         self.grid_size = 20  # 預設改為20
         
         # 存儲最佳結果
-        self.top_results = []
+        self.top_results = ResultTable()
         self.current_result_index = 0
+        self.result_reducer = "grid"
+        
+        # 最近一次本機搜尋的差距圖，供熱圖使用
+        self.last_score_maps = None
+        self.fused_score_maps = None  # 同時計算多種度量時的 {度量方式: ScoreMaps}
+        self.last_search_mode = 1
+        self.last_search_window = self.current_size
+        self.heatmap_window = None
+        # 產生目前結果與差距圖的搜尋參數 (見 record_search_params)，介面設定之後可能已改變
+        self.last_search_params = None
+        self.score_map_params = None
+        
+        # 主題過渡動畫，以屬性動畫驅動調色盤插值
+        self.light_palette = QPalette(self.palette())
+        self.theme_start_palette = self.light_palette
+        self.theme_end_palette = self.light_palette
+        self.transition_to_dark = False
+        self._theme_progress = 0.0
+        self.theme_animation = QPropertyAnimation(self, b"theme_progress", self)
+        self.theme_animation.setDuration(THEME_TRANSITION_DURATION)
+        self.theme_animation.setStartValue(0.0)
+        self.theme_animation.setEndValue(1.0)
+        self.theme_animation.setEasingCurve(QEasingCurve.InOutQuad)
+        self.theme_animation.finished.connect(self.finish_theme_transition)
+        self.viewer_window = None
+        self.watch_window = None
+        self.thumbnail_browser = None
+        
+        # 背景解碼圖像，pending_loads 記錄每個位置最新要求的路徑
+        self.image_loader = ImageLoader(self)
+        self.image_loader.image_loaded.connect(self.on_image_loaded)
+        self.image_loader.load_failed.connect(self.on_image_load_failed)
+        self.pending_loads = {}
+        
+        # 背景執行中的漸進式搜尋與比較服務搜尋
+        self.progressive_worker = None
+        self.remote_worker = None
+        
+        # 背景產生報告的執行緒與進度對話框
+        self.report_worker = None
+        self.report_progress = None
         
         # 設定預設放大尺寸
         self.preview_size = 128
@@ -153,6 +3165,17 @@ class ImageComparisonTool(QMainWindow):
             
             image_selection_layout.addWidget(image_frame)
         
+        # 一次選擇多張圖像並同時解碼，或從縮圖瀏覽中挑選候選圖像
+        batch_layout = QHBoxLayout()
+        self.load_multiple_btn = QPushButton("載入多張圖像")
+        self.load_multiple_btn.setToolTip("依檔名順序指定為圖像1、圖像2、圖像3、GT")
+        self.load_multiple_btn.clicked.connect(self.load_multiple_images)
+        batch_layout.addWidget(self.load_multiple_btn)
+        self.thumbnail_btn = QPushButton("縮圖瀏覽")
+        self.thumbnail_btn.clicked.connect(self.show_thumbnail_browser)
+        batch_layout.addWidget(self.thumbnail_btn)
+        image_selection_layout.addLayout(batch_layout)
+        
         # 將第一直列添加到控制面板佈局
         control_layout.addWidget(image_selection, 1)  # 圖像選擇區佔1/3寬度
         
@@ -196,6 +3219,34 @@ class ImageComparisonTool(QMainWindow):
         self.update_button.setStyleSheet("QPushButton { min-height: 30px; background-color: #4CAF50; color: white; }")
         settings_layout.addWidget(self.update_button, 3, 0, 1, 2)
         
+        # 多波段圖像顯示為RGB時使用的波段
+        settings_layout.addWidget(QLabel("顯示波段 (R,G,B):"), 4, 0)
+        self.display_bands_edit = QLineEdit()
+        self.display_bands_edit.setPlaceholderText("例如 0,1,2")
+        self.display_bands_edit.editingFinished.connect(self.apply_display_bands)
+        settings_layout.addWidget(self.display_bands_edit, 4, 1)
+        
+        # 像素檢視：滑鼠懸停在展示區時顯示該像素的誤差
+        self.pixel_inspect_cb = QCheckBox("像素檢視 (懸停顯示逐像素誤差)")
+        self.pixel_inspect_cb.toggled.connect(lambda checked: self.pixel_info_label.setText("像素誤差: N/A"))
+        settings_layout.addWidget(self.pixel_inspect_cb, 5, 0, 1, 2)
+        
+        # 以放大後的 |圖像 - GT| 取代圖像1、圖像2的顯示
+        self.amplify_diff_cb = QCheckBox("放大差異顯示")
+        self.amplify_diff_cb.toggled.connect(lambda checked: self.update_display())
+        settings_layout.addWidget(self.amplify_diff_cb, 6, 0)
+        self.amplify_gain_spin = QSpinBox()
+        self.amplify_gain_spin.setRange(1, 64)
+        self.amplify_gain_spin.setValue(8)
+        self.amplify_gain_spin.setPrefix("x")
+        self.amplify_gain_spin.valueChanged.connect(
+            lambda value: self.update_display() if self.amplify_diff_cb.isChecked() else None)
+        settings_layout.addWidget(self.amplify_gain_spin, 6, 1)
+        
+        self.pixel_info_label = QLabel("像素誤差: N/A")
+        self.pixel_info_label.setWordWrap(True)
+        settings_layout.addWidget(self.pixel_info_label, 7, 0, 1, 2)
+        
         second_column_layout.addWidget(settings)
         
         # --- 保存功能區域 ---
@@ -242,6 +3293,17 @@ class ImageComparisonTool(QMainWindow):
         self.save_button.setStyleSheet("QPushButton { min-height: 30px; background-color: #FF9800; color: white; }")
         save_layout.addWidget(self.save_button, 4, 0, 1, 2)
         
+        # 將前幾個結果輸出為聯絡表與HTML報告
+        save_layout.addWidget(QLabel("報告結果數:"), 5, 0)
+        self.report_count_spin = QSpinBox()
+        self.report_count_spin.setRange(1, 100000)
+        self.report_count_spin.setValue(100)
+        save_layout.addWidget(self.report_count_spin, 5, 1)
+        self.report_button = QPushButton("產生結果報告 (HTML)")
+        self.report_button.clicked.connect(self.generate_result_report)
+        self.report_button.setStyleSheet("QPushButton { min-height: 30px; }")
+        save_layout.addWidget(self.report_button, 6, 0, 1, 2)
+        
         second_column_layout.addWidget(save_group)
         
         # 將第二直列添加到控制面板佈局
@@ -278,7 +3340,9 @@ class ImageComparisonTool(QMainWindow):
         # 添加差距度量選擇
         find_layout.addWidget(QLabel("差距度量方式:"), 3, 0)
         self.metric_combo = QComboBox()
-        self.metric_combo.addItems(["MSE (均方誤差)", "MAE (平均絕對誤差)", "SSIM (結構相似性)"])
+        self.metric_combo.addItems(METRIC_OPTIONS)
+        self.metric_combo.currentIndexChanged.connect(lambda index: self.update_window_errors())
+        self.metric_combo.currentIndexChanged.connect(lambda index: self.switch_ranking_metric())
         self.metric_combo.setStyleSheet("QComboBox { min-height: 25px; }")
         find_layout.addWidget(self.metric_combo, 3, 1)
         
@@ -293,9 +3357,76 @@ class ImageComparisonTool(QMainWindow):
         
         # 添加灰階比較選項
         self.use_grayscale_cb = QCheckBox("使用灰階比較(捕捉結構細節)")
+        self.use_grayscale_cb.toggled.connect(lambda checked: self.update_window_errors())
         self.use_grayscale_cb.setStyleSheet("QCheckBox { min-height: 25px; }")
         find_layout.addWidget(self.use_grayscale_cb, 5, 0, 1, 2)
         
+        # 漸進式搜尋選項
+        self.progressive_cb = QCheckBox("漸進式搜尋(先粗略顯示再逐步精細)")
+        self.progressive_cb.setStyleSheet("QCheckBox { min-height: 25px; }")
+        find_layout.addWidget(self.progressive_cb, 6, 0, 1, 2)
+        
+        # 比較服務位址，留空則在本機計算
+        find_layout.addWidget(QLabel("比較服務:"), 7, 0)
+        self.service_url_edit = QLineEdit()
+        self.service_url_edit.setPlaceholderText("留空則在本機計算 (例: http://127.0.0.1:8765)")
+        find_layout.addWidget(self.service_url_edit, 7, 1)
+        
+        # 結果縮減方式：每個網格保留一個結果，或以非極大值抑制選出彼此分散的前K個窗口
+        find_layout.addWidget(QLabel("結果縮減方式:"), 8, 0)
+        self.reducer_combo = QComboBox()
+        for key, name in RESULT_REDUCERS.items():
+            self.reducer_combo.addItem(name, key)
+        self.reducer_combo.setStyleSheet("QComboBox { min-height: 25px; }")
+        find_layout.addWidget(self.reducer_combo, 8, 1)
+        
+        find_layout.addWidget(QLabel("NMS 最多結果/IoU上限:"), 9, 0)
+        nms_widget = QWidget()
+        nms_layout = QHBoxLayout(nms_widget)
+        nms_layout.setContentsMargins(0, 0, 0, 0)
+        self.nms_max_results_spin = QSpinBox()
+        self.nms_max_results_spin.setRange(1, 100000)
+        self.nms_max_results_spin.setValue(100)
+        nms_layout.addWidget(self.nms_max_results_spin)
+        self.nms_iou_spin = QDoubleSpinBox()
+        self.nms_iou_spin.setRange(0.0, 1.0)
+        self.nms_iou_spin.setSingleStep(0.05)
+        self.nms_iou_spin.setValue(0.3)
+        nms_layout.addWidget(self.nms_iou_spin)
+        find_layout.addWidget(nms_widget, 9, 1)
+        
+        # 四叉樹以網格大小作為最小格，分數變異或最大值超過門檻的區域才繼續細分
+        find_layout.addWidget(QLabel("四叉樹分裂門檻(σ):"), 10, 0)
+        self.split_threshold_spin = QDoubleSpinBox()
+        self.split_threshold_spin.setRange(0.0, 10.0)
+        self.split_threshold_spin.setSingleStep(0.1)
+        self.split_threshold_spin.setValue(1.0)
+        self.split_threshold_spin.setToolTip("節點分數標準差或最大值超過全圖平均加上此倍數標準差時細分，最小格為網格大小")
+        find_layout.addWidget(self.split_threshold_spin, 10, 1)
+        
+        # 多波段圖像的各波段權重
+        find_layout.addWidget(QLabel("波段權重:"), 11, 0)
+        self.band_weights_edit = QLineEdit()
+        self.band_weights_edit.setPlaceholderText("以逗號分隔，空白為相等權重")
+        self.band_weights_edit.editingFinished.connect(self.update_window_errors)
+        find_layout.addWidget(self.band_weights_edit, 11, 1)
+        
+        # 一次計算所有度量，之後切換度量方式只需重新排序
+        self.fused_metrics_cb = QCheckBox("同時計算所有度量 (可即時切換排序度量)")
+        self.fused_metrics_cb.setToolTip("在同一次讀取中計算 MSE、MAE 與完整SSIM (以窗口平均、變異數與共變異數計算)，"
+                                         "簡化SSIM與MAE共用同一個結果；只用於本機的完整搜尋")
+        find_layout.addWidget(self.fused_metrics_cb, 12, 0, 1, 2)
+        
+        # 本機搜尋的記憶體上限，超過時自動降低列帶高度、並行數與差距圖精度
+        find_layout.addWidget(QLabel("記憶體上限 (GB):"), 13, 0)
+        self.memory_budget_spin = QDoubleSpinBox()
+        self.memory_budget_spin.setRange(0.0, 1024.0)
+        self.memory_budget_spin.setDecimals(1)
+        self.memory_budget_spin.setSingleStep(0.5)
+        self.memory_budget_spin.setSpecialValueText("不限")
+        self.memory_budget_spin.setToolTip("上限包含搜尋的圖像 (含灰階轉換的副本)；預估用量超過上限時依序改用多執行緒、降低列帶高度、差距圖改為float32、減少並行數")
+        find_layout.addWidget(self.memory_budget_spin, 13, 1)
+        
         third_column_layout.addWidget(find_settings)
         
         # --- 結果導航區域 ---
@@ -346,6 +3477,87 @@ class ImageComparisonTool(QMainWindow):
         self.current_region_label = QLabel("當前區域: N/A")
         result_nav_layout.addWidget(self.current_region_label, 5, 0, 1, 2)
         
+        # 搜尋精細度標籤
+        self.refinement_label = QLabel("精細度: N/A")
+        result_nav_layout.addWidget(self.refinement_label, 6, 0, 1, 2)
+        
+        # 結果篩選與排序，只重排結果表的索引，不需重新搜尋
+        self.result_filter_edit = QLineEdit()
+        self.result_filter_edit.setPlaceholderText("篩選，例如 diff1 < 5 and diff2 > 50")
+        self.result_filter_edit.setToolTip("欄位: x, y, score, diff1, diff2, cell_x, cell_y (網格分區才有，其餘為 -1), "
+                                          "metric (度量方式的選項索引)；以 and / or 連接條件")
+        self.result_filter_edit.returnPressed.connect(self.apply_result_view)
+        result_nav_layout.addWidget(self.result_filter_edit, 7, 0, 1, 2)
+        self.result_sort_combo = QComboBox()
+        for key, name in RESULT_SORT_KEYS.items():
+            self.result_sort_combo.addItem(f"依{name}排序", key)
+        self.result_sort_combo.currentIndexChanged.connect(lambda index: self.apply_result_view())
+        result_nav_layout.addWidget(self.result_sort_combo, 8, 0)
+        self.result_descending_cb = QCheckBox("遞減")
+        self.result_descending_cb.setChecked(True)
+        self.result_descending_cb.toggled.connect(lambda checked: self.apply_result_view())
+        result_nav_layout.addWidget(self.result_descending_cb, 8, 1)
+        
+        # 整張圖像的全域統計，與窗口搜尋在同一次計算中取得
+        self.global_stats_label = QLabel("全域統計: N/A")
+        self.global_stats_label.setWordWrap(True)
+        self.global_stats_label.setToolTip("整張單窗SSIM 把整張圖像當作一個窗口計算，"
+                                           "不是一般SSIM工具回報的局部窗口SSIM平均值")
+        result_nav_layout.addWidget(self.global_stats_label, 16, 0, 1, 2)
+        
+        # 目前窗口各波段的差距
+        self.band_detail_label = QLabel("各波段差距: N/A")
+        self.band_detail_label.setWordWrap(True)
+        result_nav_layout.addWidget(self.band_detail_label, 17, 0, 1, 2)
+        
+        # 同時計算多種度量時，目前結果在各度量的數值
+        self.metric_values_label = QLabel("各度量數值: N/A")
+        self.metric_values_label.setWordWrap(True)
+        result_nav_layout.addWidget(self.metric_values_label, 18, 0, 1, 2)
+        
+        # 開啟分片合併後的結果檔
+        self.open_result_btn = QPushButton("開啟結果檔")
+        self.open_result_btn.clicked.connect(self.open_result_file)
+        self.open_result_btn.setStyleSheet("QPushButton { min-height: 28px; }")
+        result_nav_layout.addWidget(self.open_result_btn, 9, 0, 1, 2)
+        
+        # 顯示整張圖像的差異熱圖
+        self.heatmap_btn = QPushButton("顯示差異熱圖")
+        self.heatmap_btn.clicked.connect(self.show_heatmap)
+        self.heatmap_btn.setStyleSheet("QPushButton { min-height: 28px; }")
+        result_nav_layout.addWidget(self.heatmap_btn, 10, 0, 1, 2)
+        
+        # 可縮放平移的全圖檢視
+        self.viewer_btn = QPushButton("全圖檢視")
+        self.viewer_btn.clicked.connect(self.show_image_viewer)
+        self.viewer_btn.setStyleSheet("QPushButton { min-height: 28px; }")
+        result_nav_layout.addWidget(self.viewer_btn, 11, 0, 1, 2)
+        
+        # 工作階段保存與還原
+        self.save_session_btn = QPushButton("保存工作階段")
+        self.save_session_btn.clicked.connect(self.save_session_file)
+        self.save_session_btn.setStyleSheet("QPushButton { min-height: 28px; }")
+        result_nav_layout.addWidget(self.save_session_btn, 12, 0)
+        self.open_session_btn = QPushButton("開啟工作階段")
+        self.open_session_btn.clicked.connect(self.open_session_file)
+        self.open_session_btn.setStyleSheet("QPushButton { min-height: 28px; }")
+        result_nav_layout.addWidget(self.open_session_btn, 12, 1)
+        self.session_maps_cb = QCheckBox("工作階段包含差距圖")
+        self.session_maps_cb.setToolTip("保存完整的差距圖，還原後可直接顯示熱圖，但檔案較大")
+        result_nav_layout.addWidget(self.session_maps_cb, 13, 0, 1, 2)
+        
+        # 監看資料夾，自動比較新產生的候選圖像
+        self.watch_btn = QPushButton("監看資料夾")
+        self.watch_btn.clicked.connect(self.start_watch_folder)
+        self.watch_btn.setStyleSheet("QPushButton { min-height: 28px; }")
+        result_nav_layout.addWidget(self.watch_btn, 14, 0, 1, 2)
+        
+        # 匯出完整差距圖供下游分析
+        self.export_maps_btn = QPushButton("匯出差距圖 (.npy)")
+        self.export_maps_btn.clicked.connect(self.export_score_map_files)
+        self.export_maps_btn.setStyleSheet("QPushButton { min-height: 28px; }")
+        result_nav_layout.addWidget(self.export_maps_btn, 15, 0, 1, 2)
+        
         # 右側：主題設置
         theme_settings = QGroupBox("主題設置")
         theme_settings.setStyleSheet("QGroupBox { font-weight: bold; font-size: 13pt; }")
@@ -400,6 +3612,7 @@ class ImageComparisonTool(QMainWindow):
         self.display_labels = []
         self.info_labels = []
         self.pixmaps = [None, None, None, None]  # 存儲原始pixmap
+        self.window_errors = None  # 目前窗口的裁剪陣列與誤差圖，懸停時直接查表
         
         for i in range(4):
             row = i // 2
@@ -418,6 +3631,8 @@ class ImageComparisonTool(QMainWindow):
             self.display_labels[i].setAlignment(Qt.AlignCenter)
             self.display_labels[i].setMinimumSize(250, 250)
             self.display_labels[i].setStyleSheet("background-color: #f0f0f0; border: 1px solid #ddd;")
+            self.display_labels[i].setMouseTracking(True)
+            self.display_labels[i].installEventFilter(self)
             group_layout.addWidget(self.display_labels[i])
             
             self.display_layout.addWidget(group, row, col)
@@ -435,6 +3650,52 @@ class ImageComparisonTool(QMainWindow):
             self, f"選擇圖像 {index+1}", initial_dir, "圖像文件 (*.png *.jpg *.jpeg *.bmp *.tif *.tiff)"
         )
         
+        if file_path:
+            self.load_images_async([(index, file_path)])
+    
+    def load_multiple_images(self):
+        """選擇多張圖像，依檔名順序指定到圖像1、圖像2、圖像3、GT並同時解碼"""
+        initial_dir = next((os.path.dirname(path) for path in self.image_paths if path), "")
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "選擇多張圖像", initial_dir, "圖像文件 (*.png *.jpg *.jpeg *.bmp *.tif *.tiff)"
+        )
+        if file_paths:
+            self.load_images_async(list(enumerate(sorted(file_paths)[:4])))
+    
+    def load_images_async(self, assignments):
+        """在背景同時解碼圖像，解碼期間介面保持可操作"""
+        for index, path in assignments:
+            self.pending_loads[index] = path
+            self.image_path_edits[index].setText(f"載入中: {path}")
+        self.image_loader.load(assignments)
+    
+    def on_image_loaded(self, index, path, image):
+        # 同一位置已改選其他圖像時忽略較舊的結果
+        if self.pending_loads.get(index) != path:
+            return
+        del self.pending_loads[index]
+        self.open_image_path(index, path, image)
+    
+    def on_image_load_failed(self, index, path, message):
+        if self.pending_loads.get(index) != path:
+            return
+        del self.pending_loads[index]
+        self.image_path_edits[index].setText(f"載入失敗: {message}")
+        self.image_path_edits[index].setStyleSheet("color: red; padding: 5px;")
+    
+    def show_thumbnail_browser(self):
+        """開啟候選圖像的縮圖瀏覽視窗"""
+        if self.thumbnail_browser is None:
+            self.thumbnail_browser = ThumbnailBrowser(self)
+            self.thumbnail_browser.assign_requested.connect(lambda index, path: self.load_images_async([(index, path)]))
+            directory = next((os.path.dirname(path) for path in self.image_paths if path), "")
+            if directory:
+                self.thumbnail_browser.open_folder(directory)
+        self.thumbnail_browser.show()
+        self.thumbnail_browser.raise_()
+    
+    def open_image_path(self, index, file_path, image=None):
+        """載入指定路徑的圖像到第index個位置，image 為已在背景解碼的圖像"""
         if file_path:
             try:
                 # 保存圖像路徑
@@ -455,15 +3716,13 @@ class ImageComparisonTool(QMainWindow):
                 self.image_labels[index].setText(os.path.basename(file_path))
                 
                 # 載入圖像
-                self.images[index] = Image.open(file_path)
+                self.images[index] = image if image is not None else open_image_file(file_path)
                 
                 # 更新顯示
                 self.update_display()
                 
                 # 清除結果
-                self.top_results = []
-                self.current_result_index = 0
-                self.update_result_navigation()
+                self.clear_results()
             except Exception as e:
                 error_msg = f"載入失敗: {str(e)}"
                 self.image_path_edits[index].setText(error_msg)
@@ -477,9 +3736,20 @@ class ImageComparisonTool(QMainWindow):
         size_text = self.size_combo.currentText()
         self.current_size = int(size_text.split('x')[0])
         self.update_display()
-        # 清除結果
-        self.top_results = []
+        # 清除結果 (差距圖與搜尋參數屬於舊的窗口大小)
+        self.clear_results()
+    
+    def clear_results(self):
+        """清除目前的結果與產生它的差距圖、搜尋參數與全域統計，已開啟的熱圖視窗隨之關閉"""
+        self.stop_progressive_search()
+        self.top_results = ResultTable()
         self.current_result_index = 0
+        self.last_score_maps = None
+        self.fused_score_maps = None
+        self.last_search_params = None
+        self.global_stats_label.setText("全域統計: N/A")
+        if self.heatmap_window is not None:
+            self.heatmap_window.hide()
         self.update_result_navigation()
     
     def update_start_x(self):
@@ -491,6 +3761,8 @@ class ImageComparisonTool(QMainWindow):
         self.update_display()
     
     def update_display(self, refresh_only=False):
+        if not refresh_only:
+            self.update_window_errors()
         for i in range(4):
             if self.images[i] is not None:
                 try:
@@ -511,9 +3783,20 @@ class ImageComparisonTool(QMainWindow):
                             crop = self.images[i].crop((self.start_x, self.start_y, 
                                                       self.start_x + self.current_size, 
                                                       self.start_y + self.current_size))
-                            
-                            # 轉換為QPixmap並顯示
-                            crop_array = np.array(crop)
+                            if i < 2 and self.amplify_diff_cb.isChecked() and self.window_errors is not None:
+                                # 以放大的差異取代原圖，與誤差圖使用同一份裁剪陣列
+                                image = self.images[i]
+                                crop_array = amplified_difference(
+                                    self.window_errors["regions"][i], self.window_errors["regions"][2],
+                                    self.amplify_gain_spin.value(),
+                                    image.display_max if isinstance(image, MultiBandImage) else pil_max_value(image),
+                                    getattr(image, "display_bands", None))
+                            else:
+                                if isinstance(crop, MultiBandImage):
+                                    crop = crop.convert('RGB')
+                                
+                                # 轉換為QPixmap並顯示
+                                crop_array = np.array(crop)
                             height, width, channels = crop_array.shape if len(crop_array.shape) == 3 else (*crop_array.shape, 1)
                             
                             if channels == 1:
@@ -540,14 +3823,24 @@ class ImageComparisonTool(QMainWindow):
                 self.display_labels[i].setText("未載入圖像")
                 self.info_labels[i].setText("未加載圖像")
                 self.pixmaps[i] = None
+        
+        # 熱圖與全圖檢視上標示目前的窗口
+        if self.heatmap_window is not None:
+            self.heatmap_window.view.set_current_window(self.start_x, self.start_y, self.current_size)
+        if self.viewer_window is not None:
+            self.viewer_window.set_images(self.images)
+            self.viewer_window.set_current_window(self.start_x, self.start_y, self.current_size)
     
     def update_result_navigation(self):
         """更新結果導航控件的狀態"""
         num_results = len(self.top_results)
+        self.update_viewer_markers()
+        self.update_metric_values()
         
-        # 更新結果計數器
+        # 更新結果計數器 (篩選後另外顯示總數)
+        filtered = f" (篩選自 {self.top_results.total})" if num_results != self.top_results.total else ""
         if num_results > 0:
-            self.result_counter_label.setText(f"結果: {self.current_result_index+1}/{num_results}")
+            self.result_counter_label.setText(f"結果: {self.current_result_index+1}/{num_results}{filtered}")
             
             # 更新差距標籤
             best_x, best_y, _, diff1_gt, diff2_gt = self.top_results[self.current_result_index]
@@ -556,11 +3849,16 @@ class ImageComparisonTool(QMainWindow):
             self.diff_ratio_label.setText(f"差距分數: {diff2_gt-diff1_gt:.6f}" if diff2_gt > diff1_gt else f"差距分數: {diff1_gt-diff2_gt:.6f}")
             
             # 更新當前區域標籤
-            grid_x = best_x // self.grid_size
-            grid_y = best_y // self.grid_size
-            self.current_region_label.setText(f"區域: ({grid_x*self.grid_size},{grid_y*self.grid_size}) - ({(grid_x+1)*self.grid_size-1},{(grid_y+1)*self.grid_size-1})")
+            record = self.top_results.row(self.current_result_index)
+            if record["cell_x"] >= 0:
+                grid_x = int(record["cell_x"])
+                grid_y = int(record["cell_y"])
+                grid_size = self.search_params()["grid_size"]
+                self.current_region_label.setText(f"區域: ({grid_x*grid_size},{grid_y*grid_size}) - ({(grid_x+1)*grid_size-1},{(grid_y+1)*grid_size-1})")
+            else:
+                self.current_region_label.setText(f"窗口: ({best_x},{best_y}) - ({best_x+self.current_size-1},{best_y+self.current_size-1})")
         else:
-            self.result_counter_label.setText("結果: 0/0")
+            self.result_counter_label.setText(f"結果: 0/0{filtered}")
             self.img1_diff_label.setText("圖1與GT差距: N/A")
             self.img2_diff_label.setText("圖2與GT差距: N/A")
             self.diff_ratio_label.setText("差距分數: N/A")
@@ -570,6 +3868,33 @@ class ImageComparisonTool(QMainWindow):
         self.prev_result_btn.setEnabled(num_results > 0 and self.current_result_index > 0)
         self.next_result_btn.setEnabled(num_results > 0 and self.current_result_index < num_results - 1)
     
+    def set_results(self, results, reducer):
+        """以結果列表建立結果表，並套用目前的排序與篩選；所屬網格與度量方式取自產生結果的搜尋參數"""
+        params = self.search_params()
+        self.result_reducer = reducer
+        metric = METRIC_OPTIONS.index(params["metric"]) if params["metric"] in METRIC_OPTIONS else -1
+        self.top_results = ResultTable(results, params["grid_size"] if reducer == "grid" else None, metric)
+        self.top_results.sort(self.result_sort_combo.currentData(), self.result_descending_cb.isChecked())
+        try:
+            self.top_results.filter(self.result_filter_edit.text())
+        except ValueError:
+            # 條件無效時顯示全部結果，套用篩選時才提示錯誤
+            pass
+    
+    def apply_result_view(self):
+        """依介面設定重新排序與篩選結果，並從檢視中的第一個結果開始瀏覽"""
+        try:
+            self.top_results.filter(self.result_filter_edit.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", str(e))
+            return
+        self.top_results.sort(self.result_sort_combo.currentData(), self.result_descending_cb.isChecked())
+        self.current_result_index = 0
+        if self.top_results:
+            self.show_current_result()
+        else:
+            self.update_result_navigation()
+    
     def show_prev_result(self):
         """顯示上一個結果"""
         if self.current_result_index > 0 and self.top_results:
@@ -634,23 +3959,32 @@ class ImageComparisonTool(QMainWindow):
             # 是否使用灰階比較
             use_grayscale = self.use_grayscale_cb.isChecked()
             
-            # 如果使用灰階比較，先轉換圖像
+            # 指定比較服務時由服務端搜尋，共用服務端已解碼的圖像與差距圖快取
+            service_url = self.service_url_edit.text().strip()
+            if service_url:
+                # 服務端依檔案路徑讀取圖像，從工作階段或剪貼簿載入、沒有路徑的圖像無法傳送
+                if not all(self.image_paths[i] for i in (0, 1, 3)):
+                    QMessageBox.warning(self, "警告", "使用比較服務時，圖像1、圖像2和GT都必須是從檔案載入的圖像!")
+                    return
+                self.run_remote_search(service_url, window_size, mode, metric, use_grayscale)
+                return
+            
+            # 如果使用灰階比較，先轉換圖像；原圖仍保留在記憶體中，計入記憶體上限
+            resident_bytes = 0
             if use_grayscale:
+                resident_bytes = sum(image_nbytes(image) for image in {id(image): image for image in (img1, img2, gt)}.values())
                 img1 = img1.convert('L')
                 img2 = img2.convert('L')
                 gt = gt.convert('L')
+            band_weights = self.band_weight_settings()
             
-            # 計算最大有效起始點
-            max_start_x1 = img1_width - window_size
-            max_start_y1 = img1_height - window_size
-            max_start_x2 = img2_width - window_size
-            max_start_y2 = img2_height - window_size
-            max_start_x_gt = gt_width - window_size
-            max_start_y_gt = gt_height - window_size
+            # 漸進式搜尋在背景執行，結果會隨每一輪精細化逐步更新
+            if self.progressive_cb.isChecked():
+                self.start_progressive_search(img1, img2, gt, window_size, mode, metric, band_weights, resident_bytes)
+                return
             
-            # 取最小值確保所有圖像都能裁剪
-            max_start_x = min(max_start_x1, max_start_x2, max_start_x_gt)
-            max_start_y = min(max_start_y1, max_start_y2, max_start_y_gt)
+            # 計算最大有效起始點，取最小值確保所有圖像都能裁剪
+            max_start_x, max_start_y = compute_search_bounds(img1, img2, gt, window_size)
             
             # 計算網格數量
             grid_width = math.ceil((max_start_x + 1) / self.grid_size)
@@ -659,58 +3993,55 @@ class ImageComparisonTool(QMainWindow):
             # 創建一個進度對話框
             QMessageBox.information(self, "開始處理", f"將使用 {window_size}x{window_size} 的窗口在圖像範圍內搜尋，並將每 {self.grid_size}x{self.grid_size} 區域最佳結果保留，共 {grid_width*grid_height} 個區域...")
             
-            # 創建字典存儲每個網格的最佳結果
-            grid_results = {}
-            
-            # 創建一個並行任務列表
-            tasks = []
-            for start_y in range(0, max_start_y + 1):
-                for start_x in range(0, max_start_x + 1):
-                    tasks.append((start_x, start_y))
-            
-            # 根據任務數量決定處理方式
-            results = []
-            if len(tasks) > 1000:  # 任務數量大，使用多進程
-                with mp.Pool(processes=mp.cpu_count()) as pool:
-                    # 使用starmap和部分應用
-                    partial_compare = partial(compare_regions, img1, img2, gt, 
-                                             window_size=window_size, mode=mode, metric=metric)
-                    # 只傳入x, y坐標
-                    all_results = pool.starmap(partial_compare, tasks)
-                    # 過濾可能的無效結果
-                    results = [r for r in all_results if r[2] != float('-inf')]
-            else:  # 任務數量小，直接循環
-                for start_x, start_y in tasks:
-                    result = compare_regions(img1, img2, gt, start_x, start_y, window_size, mode, metric)
-                    if result[2] != float('-inf'):
-                        results.append(result)
+            # 搜尋所有窗口 (依圖像大小自動選擇單執行緒、多執行緒或多進程)
+            self.stop_progressive_search()
+            memory_budget = self.memory_budget_setting()
+            fused_maps = None
+            try:
+                with PeakMemoryMonitor() as monitor:
+                    if self.fused_metrics_cb.isChecked():
+                        # 所有度量在同一次讀取中計算，排序使用目前選擇的度量
+                        maps = search_offsets(img1, img2, gt, window_size, METRIC_OPTIONS, collect_stats=True,
+                                              band_weights=band_weights, memory_budget=memory_budget,
+                                              resident_bytes=resident_bytes)
+                        fused_maps = split_metric_maps(maps, METRIC_OPTIONS)
+                        maps = fused_maps[metric]
+                    else:
+                        maps = search_offsets(img1, img2, gt, window_size, metric, collect_stats=True,
+                                              band_weights=band_weights, memory_budget=memory_budget,
+                                              resident_bytes=resident_bytes)
+                    
+                    # 將結果分配到各個網格並保留每個網格的最佳結果，或以非極大值抑制選出分散的窗口
+                    reduction = self.reduction_settings()
+                    results = reduce_score_maps(maps, mode, window_size, reduction)
+            except MemoryError as e:
+                QMessageBox.warning(self, "記憶體不足", str(e))
+                return
+            global_stats = summarize_global_stats(maps.stats, pil_max_value(gt))
+            self.global_stats_label.setText(format_global_stats(global_stats))
             
             if not results:
                 QMessageBox.warning(self, "警告", "沒有找到有效的比較結果!")
                 return
             
-            # 將結果分配到各個網格，並保留每個網格的最佳結果
-            for result in results:
-                start_x, start_y, score, diff1_gt, diff2_gt = result
-                
-                # 計算該點所屬的網格
-                grid_x = start_x // self.grid_size
-                grid_y = start_y // self.grid_size
-                grid_key = (grid_x, grid_y)
-                
-                # 如果該網格還沒有結果，或者該結果比現有結果更好，則更新
-                if grid_key not in grid_results or score > grid_results[grid_key][2]:
-                    grid_results[grid_key] = result
-            
-            # 將網格結果轉換為列表，並按分數排序
-            self.top_results = sorted(grid_results.values(), key=lambda x: x[2], reverse=True)
+            # 結果列表已按分數排序
+            self.record_search_params(window_size, mode, metric, use_grayscale, reduction, band_weights)
+            self.store_score_maps(maps, mode, window_size, fused_maps)
+            self.set_results(results, reduction["reducer"])
             self.current_result_index = 0
+            self.refinement_label.setText("精細度: 完整 (窮舉搜尋)")
             
             # 顯示第一個(最佳)結果
             self.show_current_result()
             
-            # 顯示找到的結果數量
-            QMessageBox.information(self, "完成", f"找到 {len(self.top_results)} 個網格結果，已顯示最佳結果。\n"
+            # 顯示找到的結果數量與記憶體用量
+            memory_text = monitor.summary()
+            if maps.memory:
+                memory_text = f"{format_memory_plan(maps.memory)}\n{memory_text}"
+            QMessageBox.information(self, "完成", f"找到 {len(self.top_results)} 個{RESULT_REDUCERS[self.result_reducer]}結果，已顯示最佳結果。\n"
+                                                 f"{format_skipped_windows(maps)}，使用 {maps.backend} 後端。\n"
+                                                 f"{format_global_stats(global_stats)}\n"
+                                                 f"{memory_text}\n"
                                                  f"使用「上一個結果」和「下一個結果」按鈕瀏覽所有結果。")
             
         except Exception as e:
@@ -718,6 +4049,633 @@ class ImageComparisonTool(QMainWindow):
             import traceback
             traceback.print_exc()
     
+    def record_search_params(self, window_size, mode, metric, grayscale, reduction, band_weights=None):
+        """記錄產生目前結果的搜尋參數，保存工作階段、匯出差距圖與產生報告時以此為準"""
+        self.last_search_params = {
+            "window_size": window_size,
+            "grid_size": reduction["grid_size"],
+            "metric": metric,
+            "grayscale": grayscale,
+            "mode": mode,
+            "reduction": dict(reduction),
+            "band_weights": None if band_weights is None else [float(weight) for weight in band_weights],
+        }
+    
+    def search_params(self):
+        """目前結果的搜尋參數；尚未搜尋時使用介面上的設定"""
+        if self.last_search_params is not None:
+            return dict(self.last_search_params)
+        return {
+            "window_size": self.current_size,
+            "grid_size": self.grid_size,
+            "metric": self.metric_combo.currentText(),
+            "grayscale": self.use_grayscale_cb.isChecked(),
+            "mode": self.last_search_mode,
+            "reduction": self.reduction_settings(),
+            "band_weights": self.band_weight_settings(),
+        }
+    
+    def memory_budget_setting(self):
+        """記憶體上限 (位元組)，0 表示不限制"""
+        budget = self.memory_budget_spin.value()
+        return int(budget * (1 << 30)) if budget > 0 else None
+    
+    def store_score_maps(self, maps, mode, window_size, fused_maps=None):
+        """保存搜尋的差距圖，已開啟的熱圖視窗隨之更新；fused_maps 為同時計算的各度量差距圖"""
+        self.last_score_maps = maps
+        self.fused_score_maps = fused_maps
+        # 結果之後可能被其他來源 (結果檔、比較服務) 取代，差距圖另外記錄產生它的搜尋參數
+        self.score_map_params = self.search_params()
+        self.last_search_mode = mode
+        self.last_search_window = window_size
+        if self.heatmap_window is not None and self.heatmap_window.isVisible():
+            self.heatmap_window.set_data(self.images[3], maps, mode, window_size)
+    
+    def switch_ranking_metric(self):
+        """同時計算過所有度量時，以新選擇的度量重新縮減與排序結果，不需重新搜尋"""
+        if self.fused_score_maps is None:
+            return
+        metric = self.metric_combo.currentText()
+        maps = self.fused_score_maps.get(metric)
+        if maps is None:
+            return
+        reduction = self.reduction_settings()
+        self.last_search_params = dict(self.search_params(), metric=metric, reduction=reduction,
+                                       grid_size=reduction["grid_size"])
+        self.store_score_maps(maps, self.last_search_mode, self.last_search_window, self.fused_score_maps)
+        self.set_results(reduce_score_maps(maps, self.last_search_mode, self.last_search_window, reduction),
+                         reduction["reducer"])
+        self.current_result_index = 0
+        if self.top_results:
+            self.show_current_result()
+        else:
+            self.update_result_navigation()
+    
+    def update_metric_values(self):
+        """顯示目前結果在各度量的數值 (SSIM 顯示相似度)，直接查詢已計算的差距圖"""
+        if self.fused_score_maps is None or not self.top_results:
+            self.metric_values_label.setText("各度量數值: N/A")
+            return
+        x, y = self.top_results[self.current_result_index][:2]
+        parts = []
+        for metric, maps in self.fused_score_maps.items():
+            values = score_maps_value(maps, x, y)
+            if values is None:
+                continue
+            if metric == METRIC_OPTIONS[2]:
+                continue  # 數值與MAE相同
+            if metric == METRIC_OPTIONS[3]:
+                values = tuple(1.0 - value for value in values)
+            parts.append(f"{METRIC_SHORT_NAMES[metric]}: {values[0]:.4f}/{values[1]:.4f}")
+        self.metric_values_label.setText(f"各度量數值 (圖1/圖2): {' | '.join(parts)}" if parts else "各度量數值: N/A")
+    
+    def show_heatmap(self):
+        """開啟差異熱圖視窗，熱圖由最近一次搜尋的差距圖建立"""
+        if self.last_score_maps is None or self.images[3] is None:
+            QMessageBox.warning(self, "警告", "請先在本機執行一次特徵點搜尋!")
+            return
+        if self.heatmap_window is None:
+            self.heatmap_window = HeatmapWindow(self)
+            self.heatmap_window.view.location_clicked.connect(self.jump_to_location)
+        self.heatmap_window.set_data(self.images[3], self.last_score_maps, self.last_search_mode,
+                                     self.last_search_window)
+        self.heatmap_window.view.set_current_window(self.start_x, self.start_y, self.current_size)
+        self.heatmap_window.show()
+        self.heatmap_window.raise_()
+    
+    def show_image_viewer(self):
+        """開啟四張圖像同步的全圖檢視視窗"""
+        if all(image is None for image in self.images):
+            QMessageBox.warning(self, "警告", "請先載入圖像!")
+            return
+        if self.viewer_window is None:
+            self.viewer_window = ImageViewerWindow(self)
+            for view in self.viewer_window.views:
+                view.location_clicked.connect(self.jump_to_location)
+        self.viewer_window.set_images(self.images)
+        self.viewer_window.set_current_window(self.start_x, self.start_y, self.current_size)
+        self.update_viewer_markers()
+        self.viewer_window.show()
+        self.viewer_window.raise_()
+    
+    def update_viewer_markers(self):
+        """在全圖檢視上標示所有搜尋結果的窗口"""
+        if self.viewer_window is not None:
+            self.viewer_window.set_markers(self.top_results.positions(), self.current_size)
+    
+    def jump_to_location(self, x, y):
+        """跳到指定的窗口起點"""
+        self.start_x_spin.setValue(x)
+        self.start_y_spin.setValue(y)
+    
+    def band_weight_settings(self):
+        """目前設定的波段權重，灰階比較時只有一個波段因此不使用權重"""
+        if self.use_grayscale_cb.isChecked():
+            return None
+        return parse_band_weights(self.band_weights_edit.text())
+    
+    def apply_display_bands(self):
+        """更新多波段圖像顯示時對應到RGB的波段"""
+        try:
+            bands = parse_display_bands(self.display_bands_edit.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", str(e))
+            return
+        for index, image in enumerate(self.images):
+            if isinstance(image, MultiBandImage):
+                # 建立新的圖像物件，讓全圖檢視重新產生圖塊
+                self.images[index] = MultiBandImage(image.array, bands, image.display_max)
+        self.update_display()
+    
+    def update_window_errors(self):
+        """計算目前窗口的誤差圖並快取，供各波段差距、像素檢視與放大差異顯示使用"""
+        self.window_errors = None
+        self.pixel_info_label.setText("像素誤差: N/A")
+        img1, img2, gt = self.images[0], self.images[1], self.images[3]
+        if img1 is None or img2 is None or gt is None:
+            self.band_detail_label.setText("各波段差距: N/A")
+            return
+        if compute_search_bounds(img1, img2, gt, self.current_size) is None:
+            return
+        # 與顯示相同的窗口；超出範圍時 update_display 不顯示，因此這裡截到圖像內即可
+        x = min(self.start_x, min(img.width for img in (img1, img2, gt)) - self.current_size)
+        y = min(self.start_y, min(img.height for img in (img1, img2, gt)) - self.current_size)
+        try:
+            regions, band_diffs, pixel_errors = window_error_maps(
+                img1, img2, gt, x, y, self.current_size, self.metric_combo.currentText(),
+                self.use_grayscale_cb.isChecked(), self.band_weight_settings())
+        except ValueError:
+            self.band_detail_label.setText("各波段差距: 圖像波段數不一致")
+            return
+        self.window_errors = {"x": x, "y": y, "regions": regions, "pixel_errors": pixel_errors}
+        diff1, diff2 = band_diffs
+        if len(diff1) < 2:
+            self.band_detail_label.setText("各波段差距: 單一波段")
+            return
+        details = ", ".join(f"B{band}: {d1:.2f}/{d2:.2f}"
+                            for band, (d1, d2) in enumerate(zip(diff1[:MAX_BAND_DETAILS], diff2[:MAX_BAND_DETAILS])))
+        more = f" ...(共 {len(diff1)} 個波段)" if len(diff1) > MAX_BAND_DETAILS else ""
+        self.band_detail_label.setText(f"各波段差距 (圖1/圖2): {details}{more}")
+    
+    def window_pixel_at(self, index, pos):
+        """將展示標籤上的位置換算為窗口內的像素座標，不在圖像上時回傳 None"""
+        pixmap = self.pixmaps[index]
+        if pixmap is None or pixmap.width() == 0 or pixmap.height() == 0:
+            return None
+        # 展示標籤置中顯示縮放後的圖像
+        rect = self.display_labels[index].contentsRect()
+        left = rect.x() + (rect.width() - pixmap.width()) // 2
+        top = rect.y() + (rect.height() - pixmap.height()) // 2
+        px = (pos.x() - left) * self.current_size // pixmap.width()
+        py = (pos.y() - top) * self.current_size // pixmap.height()
+        if 0 <= px < self.current_size and 0 <= py < self.current_size:
+            return px, py
+        return None
+    
+    def inspect_pixel(self, index, pos, global_pos):
+        """顯示滑鼠所在像素的誤差，只讀取快取的誤差圖"""
+        errors = self.window_errors
+        pixel = self.window_pixel_at(index, pos) if errors is not None else None
+        if pixel is None:
+            QToolTip.hideText()
+            return
+        px, py = pixel
+        error1, error2 = (pixel_errors[py, px] for pixel_errors in errors["pixel_errors"])
+        values = [" / ".join(str(v) for v in np.atleast_1d(region[py, px])[:MAX_BAND_DETAILS])
+                  for region in errors["regions"]]
+        # 完整SSIM沒有逐像素的定義，顯示絕對誤差
+        kind = "絕對誤差" if self.metric_combo.currentText() == METRIC_OPTIONS[3] else "誤差"
+        text = (f"像素 ({errors['x'] + px},{errors['y'] + py})\n"
+                f"圖1{kind}: {error1:.4f}  圖2{kind}: {error2:.4f}\n"
+                f"圖1: {values[0]}  圖2: {values[1]}  GT: {values[2]}")
+        self.pixel_info_label.setText(text)
+        QToolTip.showText(global_pos, text, self.display_labels[index])
+    
+    def eventFilter(self, obj, event):
+        """像素檢視開啟時，追蹤展示標籤上的滑鼠移動"""
+        if (event.type() == QEvent.MouseMove and self.pixel_inspect_cb.isChecked()
+                and obj in self.display_labels):
+            self.inspect_pixel(self.display_labels.index(obj), event.pos(), event.globalPos())
+        return super().eventFilter(obj, event)
+    
+    def reduction_settings(self):
+        """目前選擇的結果縮減設定"""
+        return {
+            "reducer": self.reducer_combo.currentData(),
+            "grid_size": self.grid_size,
+            "max_results": self.nms_max_results_spin.value(),
+            "max_iou": self.nms_iou_spin.value(),
+            "split_threshold": self.split_threshold_spin.value(),
+        }
+    
+    def run_remote_search(self, service_url, window_size, mode, metric, use_grayscale):
+        """在背景透過比較服務執行搜尋，完成後由 on_remote_search_finished 顯示結果"""
+        self.stop_progressive_search()
+        self.refinement_label.setText("精細度: 比較服務搜尋中...")
+        self.remote_worker = RemoteSearchWorker(service_url, [self.image_paths[i] for i in (0, 1, 3)], window_size,
+                                                mode, metric, self.reduction_settings(), use_grayscale, self)
+        self.remote_worker.search_finished.connect(self.on_remote_search_finished)
+        self.remote_worker.failed.connect(self.on_remote_search_failed)
+        self.remote_worker.start()
+    
+    def on_remote_search_finished(self, result):
+        """比較服務搜尋完成，顯示結果"""
+        if self.sender() is not self.remote_worker:
+            return
+        worker = self.remote_worker
+        self.remote_worker = None
+        window_size, mode, metric, reduction = worker.window_size, worker.mode, worker.metric, worker.reduction
+        self.record_search_params(window_size, mode, metric, worker.grayscale, reduction)
+        self.fused_score_maps = None
+        self.set_results(result["results"], reduction["reducer"])
+        self.last_search_mode = mode
+        self.global_stats_label.setText("全域統計: N/A (比較服務)")
+        self.current_result_index = 0
+        self.refinement_label.setText("精細度: 完整 (窮舉搜尋)")
+        if not self.top_results:
+            self.update_result_navigation()
+            QMessageBox.warning(self, "警告", "沒有找到有效的比較結果!")
+            return
+        
+        self.show_current_result()
+        QMessageBox.information(self, "完成", f"比較服務找到 {len(self.top_results)} 個{RESULT_REDUCERS[self.result_reducer]}結果，已顯示最佳結果。\n"
+                                             f"使用「上一個結果」和「下一個結果」按鈕瀏覽所有結果。")
+    
+    def start_progressive_search(self, img1, img2, gt, window_size, mode, metric, band_weights=None, resident_bytes=0):
+        """啟動背景漸進式搜尋，取代仍在執行中的搜尋；resident_bytes 見 search_offsets"""
+        self.stop_progressive_search()
+        self.top_results = ResultTable()
+        self.current_result_index = 0
+        self.update_result_navigation()
+        self.refinement_label.setText("精細度: 搜尋中...")
+        
+        reduction = self.reduction_settings()
+        self.result_reducer = reduction["reducer"]
+        self.record_search_params(window_size, mode, metric, self.use_grayscale_cb.isChecked(), reduction, band_weights)
+        self.progressive_worker = ProgressiveSearchWorker(img1, img2, gt, window_size, mode, metric,
+                                                          reduction, band_weights, self.memory_budget_setting(),
+                                                          resident_bytes, self)
+        self.progressive_worker.pass_finished.connect(self.on_progressive_pass_finished)
+        self.progressive_worker.failed.connect(self.on_progressive_search_failed)
+        self.progressive_worker.start()
+    
+    def stop_progressive_search(self):
+        """中止背景漸進式搜尋與等待中的比較服務搜尋"""
+        for worker in (self.progressive_worker, self.remote_worker):
+            if worker is not None:
+                worker.requestInterruption()
+                worker.wait()
+                self.refinement_label.setText("精細度: N/A")
+        self.progressive_worker = None
+        self.remote_worker = None
+    
+    def on_progressive_pass_finished(self, results, stride, maps):
+        """漸進式搜尋完成一輪，就地更新結果列表"""
+        if self.sender() is not self.progressive_worker:
+            return
+        
+        worker = self.progressive_worker
+        self.store_score_maps(maps, worker.mode, worker.window_size)
+        if maps.stats is not None:
+            self.global_stats_label.setText(format_global_stats(summarize_global_stats(maps.stats,
+                                                                                       pil_max_value(worker.images[2]))))
+        
+        first_pass = not self.top_results
+        self.set_results(results, self.result_reducer)
+        if first_pass:
+            # 第一輪完成時立即顯示最佳結果
+            self.current_result_index = 0
+            self.show_current_result()
+        else:
+            # 之後各輪只更新列表內容，不打斷目前的瀏覽
+            self.current_result_index = max(0, min(self.current_result_index, len(self.top_results) - 1))
+            self.update_result_navigation()
+        
+        if stride > 1:
+            self.refinement_label.setText(f"精細度: 步長 {stride} (已搜尋約 {100 / stride ** 2:.1f}% 起點，"
+                                          f"以每 {stride} 個像素取樣估計，精細化中...)")
+        else:
+            self.refinement_label.setText("精細度: 完整 (窮舉搜尋)")
+    
+    def on_progressive_search_failed(self, message):
+        """漸進式搜尋出錯"""
+        if self.sender() is not self.progressive_worker:
+            return
+        self.progressive_worker = None
+        self.refinement_label.setText("精細度: N/A")
+        QMessageBox.critical(self, "錯誤", f"計算過程中出錯: {message}")
+    
+    def on_remote_search_failed(self, message):
+        """比較服務搜尋出錯"""
+        if self.sender() is not self.remote_worker:
+            return
+        self.remote_worker = None
+        self.refinement_label.setText("精細度: N/A")
+        QMessageBox.critical(self, "錯誤", f"比較服務搜尋出錯: {message}")
+    
+    def closeEvent(self, event):
+        """關閉視窗前中止背景搜尋與產生中的報告"""
+        self.stop_progressive_search()
+        self.stop_report()
+        self.image_loader.shutdown()
+        if self.watch_window is not None:
+            self.watch_window.stop()
+        super().closeEvent(event)
+    
+    def open_result_file(self):
+        """開啟分片搜尋合併後的結果檔(.npz)並瀏覽其結果"""
+        file_path, _ = QFileDialog.getOpenFileName(self, "開啟結果檔", "", "結果檔 (*.npz)")
+        if not file_path:
+            return
+        
+        try:
+            params, grid_results = load_partial_results(file_path)
+            self.stop_progressive_search()
+        except Exception as e:
+            QMessageBox.critical(self, "錯誤", f"讀取結果檔失敗: {str(e)}")
+            return
+        
+        # 尚未載入的圖像依結果檔記錄的路徑載入
+        for index, path in zip((0, 1, 3), params.get("image_paths", [])):
+            if self.images[index] is None and path and os.path.exists(path):
+                self.open_image_path(index, path)
+        
+        self.apply_search_params(params)
+        self.last_search_mode = params["mode"]
+        self.record_search_params(params["window_size"], params["mode"], params["metric"], params["grayscale"],
+                                  dict(self.reduction_settings(), reducer="grid", grid_size=params["grid_size"]),
+                                  params.get("band_weights"))
+        self.fused_score_maps = None
+        
+        self.set_results(sorted(grid_results.values(), key=lambda x: x[2], reverse=True), "grid")
+        self.current_result_index = 0
+        if self.top_results:
+            self.show_current_result()
+        else:
+            self.update_result_navigation()
+        
+        QMessageBox.information(self, "完成", f"已從結果檔載入 {len(self.top_results)} 個網格結果。")
+    
+    def export_score_map_files(self):
+        """將最近一次搜尋的差距圖匯出為 .npy 檔與 score_maps.json 說明檔"""
+        if self.last_score_maps is None:
+            QMessageBox.warning(self, "警告", "請先在本機執行一次特徵點搜尋!")
+            return
+        directory = QFileDialog.getExistingDirectory(self, "選擇匯出資料夾")
+        if not directory:
+            return
+        
+        try:
+            search = self.score_map_params
+            params = {
+                "window_size": search["window_size"],
+                "metric": search["metric"],
+                "grayscale": search["grayscale"],
+                "band_weights": search["band_weights"],
+                "image_paths": [self.image_paths[0], self.image_paths[1], self.image_paths[3]],
+            }
+            save_score_maps(directory, self.last_score_maps, self.last_search_mode, params)
+            QMessageBox.information(self, "完成", f"已匯出差距圖至: {directory}")
+        except Exception as e:
+            QMessageBox.critical(self, "錯誤", f"匯出差距圖失敗: {str(e)}")
+    
+    def generate_result_report(self):
+        """將目前檢視中的前幾個結果輸出為聯絡表與 index.html，圖塊大小使用放大預覽尺寸"""
+        if not self.top_results:
+            QMessageBox.warning(self, "警告", "沒有可輸出的結果!")
+            return
+        if self.images[0] is None or self.images[1] is None or self.images[3] is None:
+            QMessageBox.warning(self, "警告", "請先載入圖像1、圖像2和GT(圖像4)!")
+            return
+        directory = QFileDialog.getExistingDirectory(self, "選擇報告資料夾")
+        if not directory:
+            return
+        
+        # 窗口大小與設定以產生目前結果的搜尋為準，之後修改介面上的設定不影響報告
+        search = self.search_params()
+        count = min(self.report_count_spin.value(), len(self.top_results))
+        results = self.top_results.rows(self.top_results.view[:count])
+        params = dict(search, **{
+            "result_reducer": self.result_reducer,
+            "result_filter": self.result_filter_edit.text(),
+            "result_sort": self.result_sort_combo.currentData(),
+            "result_descending": self.result_descending_cb.isChecked(),
+            "image_paths": [self.image_paths[0], self.image_paths[1], self.image_paths[3]],
+        })
+        
+        self.stop_report()
+        self.report_button.setEnabled(False)
+        self.report_progress = QProgressDialog("正在產生結果報告...", "取消", 0, count + 1, self)
+        self.report_progress.setWindowTitle("產生結果報告")
+        self.report_progress.setWindowModality(Qt.WindowModal)
+        self.report_progress.setMinimumDuration(0)
+        self.report_progress.setValue(0)
+        self.report_worker = ReportWorker(directory, (self.images[0], self.images[1], self.images[3]), results,
+                                          search["window_size"], params, self.preview_size, self)
+        self.report_worker.progress.connect(self.on_report_progress)
+        self.report_worker.report_finished.connect(self.on_report_finished)
+        self.report_worker.failed.connect(self.on_report_failed)
+        self.report_progress.canceled.connect(self.stop_report)
+        self.report_worker.start()
+    
+    def stop_report(self):
+        """中止產生中的報告並關閉進度對話框"""
+        if self.report_worker is not None:
+            self.report_worker.requestInterruption()
+            self.report_worker.wait()
+            self.report_worker = None
+        if self.report_progress is not None:
+            self.report_progress.canceled.disconnect(self.stop_report)
+            self.report_progress.close()
+            self.report_progress = None
+        self.report_button.setEnabled(True)
+    
+    def on_report_progress(self, done, total):
+        if self.sender() is not self.report_worker or self.report_progress is None:
+            return
+        self.report_progress.setMaximum(total)
+        self.report_progress.setValue(done)
+    
+    def on_report_finished(self, names, elapsed):
+        if self.sender() is not self.report_worker:
+            return
+        directory, count = self.report_worker.directory, len(self.report_worker.results)
+        self.stop_report()
+        QMessageBox.information(self, "完成", f"已輸出 {count} 個結果的報告 ({len(names)} 張聯絡表，"
+                                             f"{elapsed:.1f} 秒): {os.path.join(directory, 'index.html')}")
+    
+    def on_report_failed(self, message):
+        if self.sender() is not self.report_worker:
+            return
+        self.stop_report()
+        QMessageBox.critical(self, "錯誤", f"產生報告失敗: {message}")
+    
+    def start_watch_folder(self):
+        """選擇資料夾後開始監看，以圖像1為基準、圖像4為GT比較資料夾中的候選圖像"""
+        if self.images[0] is None or self.images[3] is None:
+            QMessageBox.warning(self, "警告", "請先載入作為基準的圖像1和GT(圖像4)!")
+            return
+        directory = QFileDialog.getExistingDirectory(self, "選擇要監看的資料夾")
+        if not directory:
+            return
+        
+        try:
+            band_weights = self.band_weight_settings()
+        except ValueError as e:
+            QMessageBox.warning(self, "警告", f"波段權重格式錯誤: {str(e)}")
+            return
+        use_grayscale = self.use_grayscale_cb.isChecked()
+        baseline = self.images[0].convert('L') if use_grayscale else self.images[0]
+        gt = self.images[3].convert('L') if use_grayscale else self.images[3]
+        baseline.load()
+        gt.load()
+        settings = {
+            "window_size": self.current_size,
+            "grid_size": self.grid_size,
+            "metric": self.metric_combo.currentText(),
+            "grayscale": use_grayscale,
+            "mode": self.last_search_mode,
+            "reduction": self.reduction_settings(),
+            "band_weights": band_weights,
+        }
+        if self.watch_window is None:
+            self.watch_window = WatchFolderWindow(self)
+            self.watch_window.result_selected.connect(self.show_watch_result)
+        self.watch_window.start(directory, baseline, gt, settings)
+        self.watch_window.show()
+        self.watch_window.raise_()
+    
+    def show_watch_result(self, path, results, settings):
+        """載入監看資料夾中的候選圖像為圖像2，並顯示背景比較的結果"""
+        self.open_image_path(1, path)
+        self.apply_search_params(settings)
+        self.last_search_mode = settings["mode"]
+        self.record_search_params(settings["window_size"], settings["mode"], settings["metric"], settings["grayscale"],
+                                  settings["reduction"], settings["band_weights"])
+        self.fused_score_maps = None
+        self.set_results(results, settings["reduction"]["reducer"])
+        self.current_result_index = 0
+        if results:
+            self.show_current_result()
+        else:
+            self.update_result_navigation()
+    
+    def apply_search_params(self, params):
+        """同步窗口、網格與度量方式設定，避免觸發清除結果的信號"""
+        self.current_size = params["window_size"]
+        self.grid_size = params["grid_size"]
+        for combo, text in ((self.size_combo, f"{self.current_size}x{self.current_size}"),
+                            (self.grid_size_combo, f"{self.grid_size}x{self.grid_size}"),
+                            (self.metric_combo, LEGACY_METRIC_NAMES.get(params["metric"], params["metric"]))):
+            combo.blockSignals(True)
+            if combo.findText(text) >= 0:
+                combo.setCurrentIndex(combo.findText(text))
+            combo.blockSignals(False)
+        self.use_grayscale_cb.setChecked(params.get("grayscale", False))
+        if "band_weights" in params:
+            weights = params["band_weights"]
+            self.band_weights_edit.setText(", ".join(f"{weight:g}" for weight in weights) if weights else "")
+        # 結果的排序與篩選 (只有工作階段會保存)
+        if "result_sort" in params:
+            widgets = (self.result_sort_combo, self.result_descending_cb)
+            for widget in widgets:
+                widget.blockSignals(True)
+            self.result_filter_edit.setText(params.get("result_filter", ""))
+            self.result_sort_combo.setCurrentIndex(max(self.result_sort_combo.findData(params["result_sort"]), 0))
+            self.result_descending_cb.setChecked(params.get("result_descending", True))
+            for widget in widgets:
+                widget.blockSignals(False)
+    
+    def save_session_file(self):
+        """保存目前的圖像、參數與結果為工作階段檔"""
+        if all(path is None for path in self.image_paths):
+            QMessageBox.warning(self, "警告", "沒有載入任何圖像!")
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "保存工作階段", "", "工作階段 (*.npz)")
+        if not file_path:
+            return
+        
+        try:
+            # 參數以產生目前結果的搜尋為準，而非之後才改變的介面設定
+            session = dict(self.search_params(), **{
+                "image_paths": self.image_paths,
+                "image_hashes": [file_content_hash(path) if path else None for path in self.image_paths],
+                "result_reducer": self.result_reducer,
+                "current_result_index": self.current_result_index,
+                "result_filter": self.result_filter_edit.text(),
+                "result_sort": self.result_sort_combo.currentData(),
+                "result_descending": self.result_descending_cb.isChecked(),
+                "start_x": self.start_x,
+                "start_y": self.start_y,
+            })
+            maps = self.last_score_maps if self.session_maps_cb.isChecked() else None
+            # 保存所有結果，還原時再套用相同的排序與篩選
+            save_session(file_path, session, self.top_results.rows(), maps)
+            QMessageBox.information(self, "完成", f"已保存工作階段: {file_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "錯誤", f"保存工作階段失敗: {str(e)}")
+    
+    def open_session_file(self):
+        """還原工作階段；圖像內容與保存時不同時重新搜尋"""
+        file_path, _ = QFileDialog.getOpenFileName(self, "開啟工作階段", "", "工作階段 (*.npz)")
+        if not file_path:
+            return
+        
+        try:
+            session, results, maps = load_session(file_path)
+        except Exception as e:
+            QMessageBox.critical(self, "錯誤", f"讀取工作階段失敗: {str(e)}")
+            return
+        
+        # 先清除目前的結果，避免還原失敗時留下與工作階段圖像不符的結果
+        self.clear_results()
+        changed = []
+        missing = []
+        for index, (path, digest) in enumerate(zip(session["image_paths"], session["image_hashes"])):
+            if not path:
+                continue
+            if not os.path.exists(path):
+                missing.append(path)
+                continue
+            if file_content_hash(path) != digest:
+                changed.append(path)
+            self.open_image_path(index, path)
+        
+        # 還原參數設定
+        self.apply_search_params(session)
+        reduction = session["reduction"]
+        index = self.reducer_combo.findData(reduction["reducer"])
+        self.reducer_combo.blockSignals(True)
+        self.reducer_combo.setCurrentIndex(max(index, 0))
+        self.reducer_combo.blockSignals(False)
+        self.nms_max_results_spin.setValue(reduction["max_results"])
+        self.nms_iou_spin.setValue(reduction["max_iou"])
+        self.split_threshold_spin.setValue(reduction["split_threshold"])
+        self.last_search_mode = session["mode"]
+        
+        if missing:
+            # 圖像欄位中可能仍是其他圖像，不能用來重新搜尋
+            QMessageBox.warning(self, "警告", "以下圖像不存在，無法還原或重新搜尋結果:\n" + "\n".join(missing))
+            return
+        if changed:
+            QMessageBox.warning(self, "警告", "以下圖像已變更，將重新搜尋:\n" + "\n".join(changed))
+            if results:
+                self.find_special_points(session["mode"])
+            return
+        
+        # 圖像未變更，直接還原結果與檢視位置
+        self.last_search_params = {key: session[key] for key in
+                                   ("window_size", "grid_size", "metric", "grayscale", "mode", "reduction")}
+        self.last_search_params["band_weights"] = session.get("band_weights")
+        self.set_results(results, session["result_reducer"])
+        self.current_result_index = session["current_result_index"]
+        if maps is not None:
+            self.store_score_maps(maps, session["mode"], session["window_size"])
+        self.update_result_navigation()
+        self.start_x_spin.setValue(session["start_x"])
+        self.start_y_spin.setValue(session["start_y"])
+        self.update_display()
+    
     def update_preview_size(self):
         """更新預覽尺寸"""
         size_text = self.preview_size_combo.currentText()
@@ -751,7 +4709,11 @@ class ImageComparisonTool(QMainWindow):
             saved_files = []
             for i in to_process:
                 # 獲取原圖和窗口區域
-                original_image = self.images[i].copy()
+                # 多波段圖像依顯示波段轉為RGB後保存
+                if isinstance(self.images[i], MultiBandImage):
+                    original_image = self.images[i].convert('RGB')
+                else:
+                    original_image = self.images[i].copy()
                 if self.start_x + window_size > original_image.width or self.start_y + window_size > original_image.height:
                     QMessageBox.warning(self, "警告", f"圖像 {i+1} 窗口範圍超出圖像尺寸!")
                     continue
@@ -850,10 +4812,8 @@ class ImageComparisonTool(QMainWindow):
         """更新網格大小"""
         size_text = self.grid_size_combo.currentText()
         self.grid_size = int(size_text.split('x')[0])
-        # 清除結果
-        self.top_results = []
-        self.current_result_index = 0
-        self.update_result_navigation()
+        # 清除結果 (差距圖與搜尋參數屬於舊的網格設定)
+        self.clear_results()
         QMessageBox.information(self, "網格大小已更新", f"網格大小已設為 {self.grid_size}x{self.grid_size}，請重新執行特徵點尋找。")
 
     def toggle_theme_mode(self):
@@ -864,10 +4824,7 @@ class ImageComparisonTool(QMainWindow):
         self.start_theme_transition(is_dark)
         
     def start_theme_transition(self, to_dark_mode):
-        """開始主題過渡動畫"""
-        # 設置過渡步數和持續時間
-        self.transition_steps = 10
-        self.transition_current_step = 0
+        """開始主題過渡動畫：以調色盤插值漸變顏色，結束時才套用一次最終樣式表"""
         self.transition_to_dark = to_dark_mode
         
         # 更新按鈕文字
@@ -876,125 +4833,37 @@ class ImageComparisonTool(QMainWindow):
         else:
             self.theme_button.setText("切換黑暗模式")
         
-        # 定義亮色模式和暗色模式的主要顏色
-        self.light_colors = {
-            "background": QColor("#FFFFFF"),
-            "foreground": QColor("#000000"),
-            "button": QColor("#2196F3"),
-            "frame": QColor("#F9F9F9"),
-            "border": QColor("#DDDDDD")
-        }
-        
-        self.dark_colors = {
-            "background": QColor("#2D2D30"),
-            "foreground": QColor("#E0E0E0"),
-            "button": QColor("#0E639C"),
-            "frame": QColor("#252526"),
-            "border": QColor("#3F3F46")
-        }
-        
-        # 創建並啟動計時器
-        self.transition_timer = QTimer(self)
-        self.transition_timer.timeout.connect(self.update_theme_transition)
-        self.transition_timer.start(30)  # 每30毫秒更新一次
-    
-    def update_theme_transition(self):
-        """更新主題過渡動畫的一個步驟"""
-        self.transition_current_step += 1
-        progress = self.transition_current_step / self.transition_steps
-        
-        # 計算過渡中的顏色
-        transition_colors = {}
-        for key in self.light_colors.keys():
-            if self.transition_to_dark:
-                start_color = self.light_colors[key]
-                end_color = self.dark_colors[key]
-            else:
-                start_color = self.dark_colors[key]
-                end_color = self.light_colors[key]
-            
-            # 計算當前步驟的混合顏色
-            r = int(start_color.red() + (end_color.red() - start_color.red()) * progress)
-            g = int(start_color.green() + (end_color.green() - start_color.green()) * progress)
-            b = int(start_color.blue() + (end_color.blue() - start_color.blue()) * progress)
-            
-            transition_colors[key] = QColor(r, g, b)
-        
-        # 應用過渡顏色
-        self.apply_transition_colors(transition_colors)
-        
-        # 檢查是否完成過渡
-        if self.transition_current_step >= self.transition_steps:
-            self.transition_timer.stop()
-            # 完成過渡，應用最終樣式
-            if self.transition_to_dark:
-                self.apply_dark_theme()
-            else:
-                self.apply_light_theme()
-    
-    def apply_transition_colors(self, colors):
-        """應用過渡中的顏色"""
-        # 創建過渡樣式表
-        bg_color = colors["background"].name()
-        fg_color = colors["foreground"].name()
-        button_color = colors["button"].name()
-        frame_color = colors["frame"].name()
-        border_color = colors["border"].name()
-        
-        transition_stylesheet = f"""
-            QWidget {{ 
-                background-color: {bg_color}; 
-                color: {fg_color}; 
-            }}
-            QGroupBox {{ 
-                border: 1px solid {border_color}; 
-                border-radius: 5px; 
-                margin-top: 10px; 
-                font-weight: bold; 
-                font-size: 13pt;
-                color: {fg_color};
-            }}
-            QFrame {{ 
-                background-color: {frame_color};
-                border: 1px solid {border_color};
-            }}
-        """
-        
-        self.setStyleSheet(transition_stylesheet)
-        
-        # 更新圖像顯示區域
-        for i in range(4):
-            if hasattr(self, 'display_labels') and i < len(self.display_labels):
-                r = int(245 + (30 - 245) * (self.transition_current_step / self.transition_steps) if self.transition_to_dark else 30 + (245 - 30) * (self.transition_current_step / self.transition_steps))
-                self.display_labels[i].setStyleSheet(f"background-color: rgb({r},{r},{r}); border: 1px solid {border_color};")
-        
-        # 更新主題按鈕樣式
+        # 從目前的顏色開始過渡，動畫途中再次切換也不會跳色
+        self.theme_animation.stop()
+        self.theme_start_palette = QPalette(self.palette())
+        self.theme_end_palette = build_dark_palette(self.light_palette) if to_dark_mode else self.light_palette
+        self.theme_animation.start()
+    
+    def get_theme_progress(self):
+        return self._theme_progress
+    
+    def set_theme_progress(self, progress):
+        """過渡動畫的進度，只更新調色盤，不重新套用樣式表"""
+        self._theme_progress = progress
+        self.setPalette(blend_palettes(self.theme_start_palette, self.theme_end_palette, progress))
+    
+    theme_progress = pyqtProperty(float, get_theme_progress, set_theme_progress)
+    
+    def finish_theme_transition(self):
+        """完成過渡，應用最終樣式；套用樣式表會重設調色盤，因此之後再設定一次"""
         if self.transition_to_dark:
-            from_color = "#2C3E50"
-            to_color = "#4A148C"
+            self.apply_dark_theme()
         else:
-            from_color = "#4A148C"
-            to_color = "#2C3E50"
-            
-        # 計算漸變中間色
-        self.theme_button.setStyleSheet(f"""
-            QPushButton {{
-                font-size: 16pt;
-                font-weight: bold;
-                background-color: qlineargradient(x1:0, y1:0, x2:1, y2:1, stop:0 {from_color}, stop:1 {to_color});
-                color: white;
-                border-radius: 10px;
-                padding: 15px;
-            }}
-        """)
+            self.apply_light_theme()
+        self.setPalette(self.theme_end_palette)
     
     def apply_dark_theme(self):
         """完成過渡後應用完整的黑暗主題"""
         # 應用完整的黑暗模式樣式
+        # 背景與文字顏色由調色盤提供，樣式表只保留邊框與強調色
         dark_stylesheet = """
-            QWidget { 
-                background-color: #2D2D30; 
-                color: #E0E0E0; 
+            QLabel, QPushButton, QCheckBox, QComboBox, QSpinBox, QLineEdit { 
+                font-size: 12pt; 
             }
             QGroupBox { 
                 border: 1px solid #3F3F46; 
@@ -1024,22 +4893,9 @@ class ImageComparisonTool(QMainWindow):
                 color: #959595; 
             }
             QComboBox, QSpinBox, QLineEdit { 
-                background-color: #333337; 
-                color: #E0E0E0; 
                 border: 1px solid #3F3F46; 
                 border-radius: 3px; 
             }
-            QScrollArea, QLabel { 
-                background-color: #2D2D30; 
-                color: #E0E0E0; 
-            }
-            QCheckBox { 
-                color: #E0E0E0; 
-            }
-            QFrame { 
-                background-color: #252526;
-                border: 1px solid #3F3F46;
-            }
         """
         self.setStyleSheet(dark_stylesheet)
         
@@ -1160,6 +5016,17 @@ if __name__ == "__main__":
     # 檢查是否支援多進程
     mp.freeze_support()
     
+    # 命令列子命令(分片搜尋/匯出差距圖/合併/比較服務)不需要圖形介面
+    args, _ = build_arg_parser().parse_known_args()
+    if args.command == "shard":
+        sys.exit(run_shard_command(args))
+    elif args.command == "export":
+        sys.exit(run_export_command(args))
+    elif args.command == "merge":
+        sys.exit(run_merge_command(args))
+    elif args.command == "serve":
+        sys.exit(run_serve_command(args))
+    
     app = QApplication(sys.argv)
     
     # 設定應用程式全局字體
@@ -0,0 +1,58 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from image_comparison_tool import plan_search_memory
+
+SIZE = 1200
+WINDOW = 32
+WORKERS = 4
+
+# 峰值增加量取決於配置器與同一進程先前的配置，在新的進程中量測
+MEASURE_SCRIPT = """
+import json, sys
+import numpy as np
+from PIL import Image
+from image_comparison_tool import METRIC_OPTIONS, PeakMemoryMonitor, reduce_score_maps, search_offsets
+
+size, window, workers, backend, budget = json.loads(sys.argv[1])
+rng = np.random.default_rng(0)
+images = [Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)) for _ in range(3)]
+with PeakMemoryMonitor() as monitor:
+    maps = search_offsets(*images, window, METRIC_OPTIONS[0], backend=backend, workers=workers,
+                          memory_budget=budget)
+    reduce_score_maps(maps, 1, window, {"grid_size": 64})
+print(json.dumps({"increase": monitor.increase, "plan": maps.memory}))
+"""
+
+
+def measure_search(backend, budget):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    arguments = json.dumps([SIZE, WINDOW, WORKERS, backend, budget])
+    output = subprocess.run([sys.executable, "-c", MEASURE_SCRIPT, arguments], cwd=root, check=True,
+                            capture_output=True, text=True, timeout=300).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread"])
+def test_search_stays_within_budget(backend):
+    # RGB的PIL圖像以每像素4位元組保存
+    sources = 3 * SIZE * SIZE * 4
+    unconstrained = plan_search_memory(float("inf"), SIZE, SIZE, 3, WINDOW, 1, WORKERS, backend,
+                                       source_bytes=sources)
+    # 上限低於不受限制的預估，計畫必須調整列帶高度或差距圖精度
+    budget = unconstrained["estimate"] - 1
+    plan = plan_search_memory(budget, SIZE, SIZE, 3, WINDOW, 1, WORKERS, backend, source_bytes=sources)
+    assert plan["estimate"] <= budget
+    assert plan["band_height"] < unconstrained["band_height"] or plan["map_dtype"] == "float32"
+
+    measured = measure_search(backend, budget)
+    assert measured["plan"] == plan
+    if measured["increase"] is None:
+        pytest.skip("需要 Linux 的 VmHWM 才能量測峰值增加量")
+    assert measured["increase"] <= budget
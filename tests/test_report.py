@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from PIL import Image
+
+from image_comparison_tool import write_result_report
+
+
+def make_images():
+    rng = np.random.default_rng(0)
+    return tuple(Image.fromarray(rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)) for _ in range(3))
+
+
+def test_report_progress_reaches_total(tmp_path):
+    results = [(x, 0, float(x), 1.0, 2.0) for x in range(0, 40, 8)]
+    calls = []
+    names = write_result_report(tmp_path, make_images(), results, 16, {"window_size": 16}, tile_size=16,
+                                progress=lambda done, total: calls.append((done, total)))
+    assert names == ["sheet_000.png"]
+    assert calls == [(done, len(results) + 1) for done in range(1, len(results) + 2)]
+    assert (tmp_path / "index.html").exists()
+
+
+def test_report_stop_requested(tmp_path):
+    results = [(0, 0, 1.0, 1.0, 2.0)]
+    assert write_result_report(tmp_path, make_images(), results, 16, {}, tile_size=16,
+                               stop_requested=lambda: True) is None
+    assert not (tmp_path / "index.html").exists()
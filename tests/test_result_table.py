@@ -0,0 +1,100 @@
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from image_comparison_tool import ResultTable, load_session, parse_result_filter, save_session
+
+
+RESULTS = [
+    (0, 0, 5.0, 1.0, 6.0),
+    (16, 0, 3.0, 4.0, 1.0),
+    (0, 16, 5.0, 2.0, 7.0),
+    (16, 16, 1.0, 8.0, 9.0),
+    (32, 0, 5.0, 3.0, 8.0),
+]
+
+
+def test_parse_and_or_groups():
+    clauses = parse_result_filter("diff1 < 5 AND diff2 > 50 or score >= 1.5")
+    assert clauses == [[("diff1", "<", 5.0), ("diff2", ">", 50.0)], [("score", ">=", 1.5)]]
+
+
+def test_parse_empty_expression():
+    assert parse_result_filter("  ") == []
+
+
+def test_parse_field_to_field_comparison():
+    assert parse_result_filter("diff1 < diff2") == [[("diff1", "<", "diff2")]]
+
+
+def test_parse_metric_field():
+    assert parse_result_filter("metric == 2") == [[("metric", "==", 2.0)]]
+
+
+@pytest.mark.parametrize("expression", ["diff3 < 5", "diff1 <", "diff1 ~ 5", "diff1 < abc", "x < 1 and"])
+def test_parse_invalid_expression(expression):
+    with pytest.raises(ValueError):
+        parse_result_filter(expression)
+
+
+def test_invalid_filter_keeps_view():
+    table = ResultTable(RESULTS)
+    table.filter("score > 2")
+    with pytest.raises(ValueError):
+        table.filter("score >")
+    assert len(table) == 4
+
+
+def test_field_to_field_filter():
+    table = ResultTable(RESULTS)
+    table.filter("diff1 > diff2")
+    assert list(table) == [RESULTS[1]]
+
+
+def test_stable_sort_with_filter():
+    table = ResultTable(RESULTS)
+    table.sort("score", descending=True)
+    table.filter("diff2 > 6 or x == 16")
+    # 同分的結果保持原順序，篩選後的檢視仍依排序
+    expected = [RESULTS[2], RESULTS[4], RESULTS[1], RESULTS[3]]
+    assert list(table) == expected
+    assert len(table) == 4
+    assert table.total == 5
+    assert [table[i] for i in range(len(table))] == expected
+    assert table.rows(table.view) == expected
+    assert table.positions() == [(x, y) for x, y, *_ in expected]
+    assert [tuple(table.row(i))[:2] for i in range(len(table))] == [(x, y) for x, y, *_ in expected]
+
+    # 改變排序時保留篩選
+    table.sort("diff1", descending=False)
+    assert list(table) == [RESULTS[2], RESULTS[4], RESULTS[1], RESULTS[3]]
+    table.filter("")
+    assert list(table) == [RESULTS[0], RESULTS[2], RESULTS[4], RESULTS[1], RESULTS[3]]
+
+
+def test_grid_cells_only_for_grid_results():
+    grid = ResultTable(RESULTS, grid_size=16, metric=1)
+    assert grid.records["cell_x"].tolist() == [0, 1, 0, 1, 2]
+    assert grid.records["cell_y"].tolist() == [0, 0, 1, 1, 0]
+    grid.filter("metric == 1 and cell_x == 1")
+    assert grid.positions() == [(16, 0), (16, 16)]
+
+    windows = ResultTable(RESULTS, metric=0)
+    assert (windows.records["cell_x"] == -1).all()
+    assert (windows.records["cell_y"] == -1).all()
+
+
+def test_session_round_trip_keeps_filter_and_sort(tmp_path):
+    path = tmp_path / "session.npz"
+    session = {"result_filter": "diff1 < diff2 and score >= 3", "result_sort": "diff2",
+               "result_descending": False}
+    save_session(path, session, RESULTS)
+    loaded, results, maps = load_session(path)
+    assert maps is None
+    assert results == RESULTS
+    assert {key: loaded[key] for key in session} == session
+
+    table = ResultTable(results)
+    table.sort(loaded["result_sort"], loaded["result_descending"])
+    table.filter(loaded["result_filter"])
+    assert list(table) == [RESULTS[0], RESULTS[2], RESULTS[4]]
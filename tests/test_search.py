@@ -0,0 +1,149 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from PIL import Image
+
+import image_comparison_tool as tool
+from image_comparison_tool import (METRIC_OPTIONS, compare_regions, load_partial_results, reduce_grid_score_maps,
+                                   reduce_nms_score_maps, search_offsets, split_metric_maps, summarize_global_stats,
+                                   window_iou)
+
+WINDOW = 8
+HEIGHT = 150
+WIDTH = 56
+
+
+def make_arrays(seed=0):
+    rng = np.random.default_rng(seed)
+    arrays = [rng.integers(0, 256, (HEIGHT, WIDTH, 3), dtype=np.uint8) for _ in range(3)]
+    # 左側一段與下方數列三者相同，涵蓋略過相同區域的行段與列
+    for region in ((slice(None), slice(0, 20)), (slice(120, None), slice(None))):
+        arrays[1][region] = arrays[0][region]
+        arrays[2][region] = arrays[0][region]
+    return arrays
+
+
+def make_images(seed=0):
+    return tuple(Image.fromarray(array) for array in make_arrays(seed))
+
+
+def brute_force_maps(images, window_size, metric, stride=1):
+    """以 compare_regions 逐一計算每個窗口，回傳 (diff1, diff2)"""
+    max_x = min(image.size[0] for image in images) - window_size
+    max_y = min(image.size[1] for image in images) - window_size
+    ys, xs = range(0, max_y + 1, stride), range(0, max_x + 1, stride)
+    diff1 = np.empty((len(ys), len(xs)))
+    diff2 = np.empty((len(ys), len(xs)))
+    for row, y in enumerate(ys):
+        for col, x in enumerate(xs):
+            _, _, _, diff1[row, col], diff2[row, col] = compare_regions(*images, x, y, window_size, 1, metric)
+    return diff1, diff2
+
+
+@pytest.fixture(scope="module")
+def images():
+    return make_images()
+
+
+@pytest.fixture(scope="module")
+def reference(images):
+    return {metric: brute_force_maps(images, WINDOW, metric) for metric in METRIC_OPTIONS}
+
+
+@pytest.mark.parametrize("backend", ["serial", "thread", "process"])
+@pytest.mark.parametrize("metric", METRIC_OPTIONS)
+def test_backends_match_brute_force(images, reference, backend, metric):
+    maps = search_offsets(*images, WINDOW, metric, backend=backend, workers=2)
+    assert maps.backend == backend
+    assert maps.skipped > 0
+    np.testing.assert_allclose(maps.diff1, reference[metric][0], atol=1e-9)
+    np.testing.assert_allclose(maps.diff2, reference[metric][1], atol=1e-9)
+
+
+@pytest.mark.parametrize("stride", [2, 3, 8])
+def test_strided_search_matches_brute_force(images, reference, stride):
+    metric = METRIC_OPTIONS[0]
+    maps = search_offsets(*images, WINDOW, metric, backend="thread", stride=stride, workers=2)
+    np.testing.assert_allclose(maps.diff1, reference[metric][0][::stride, ::stride], atol=1e-9)
+    np.testing.assert_allclose(maps.diff2, reference[metric][1][::stride, ::stride], atol=1e-9)
+
+
+def test_sampled_search_uses_lattice_pixels(images):
+    stride = 2
+    metric = METRIC_OPTIONS[1]
+    maps = search_offsets(*images, WINDOW, metric, backend="serial", stride=stride, sample=True)
+    # 取樣的窗口等於每隔 stride 取一列一行後的圖像中的連續窗口
+    subsampled = tuple(Image.fromarray(array[::stride, ::stride]) for array in make_arrays())
+    diff1, diff2 = brute_force_maps(subsampled, WINDOW // stride, metric)
+    np.testing.assert_allclose(maps.diff1, diff1[:maps.diff1.shape[0], :maps.diff1.shape[1]], atol=1e-9)
+    np.testing.assert_allclose(maps.diff2, diff2[:maps.diff2.shape[0], :maps.diff2.shape[1]], atol=1e-9)
+
+
+@pytest.mark.parametrize("stride", [1, 2])
+def test_fused_metrics_match_single_metric(images, stride):
+    fused = split_metric_maps(search_offsets(*images, WINDOW, METRIC_OPTIONS, stride=stride, backend="thread",
+                                             workers=2, collect_stats=True), METRIC_OPTIONS)
+    for metric in METRIC_OPTIONS:
+        single = search_offsets(*images, WINDOW, metric, stride=stride, backend="serial", collect_stats=True)
+        np.testing.assert_allclose(fused[metric].diff1, single.diff1, atol=1e-9)
+        np.testing.assert_allclose(fused[metric].diff2, single.diff2, atol=1e-9)
+        np.testing.assert_allclose(fused[metric].stats, single.stats)
+
+
+def test_shard_merge_matches_full_search(tmp_path, images):
+    paths = []
+    for name, image in zip(("img1", "img2", "gt"), images):
+        paths.append(str(tmp_path / f"{name}.png"))
+        image.save(paths[-1])
+    common = ["--img1", paths[0], "--img2", paths[1], "--gt", paths[2], "--window-size", str(WINDOW),
+              "--grid-size", "20", "--mode", "2", "--metric", "MAE"]
+    # 分片範圍刻意不與網格邊界對齊，各分片在獨立的進程中執行
+    shards = [("0:55", "0:30"), ("0:55", "30:"), ("55:", "0:30"), ("55:", "30:")]
+    outputs = [str(tmp_path / f"shard{i}.npz") for i in range(len(shards))]
+    processes = [subprocess.Popen([sys.executable, tool.__file__, "shard", *common, "--rows", rows, "--cols", cols,
+                                   "--output", output], stdout=subprocess.DEVNULL)
+                 for (rows, cols), output in zip(shards, outputs)]
+    assert all(process.wait(timeout=120) == 0 for process in processes)
+    merged = str(tmp_path / "merged.npz")
+    subprocess.run([sys.executable, tool.__file__, "merge", *outputs, "--output", merged],
+                   check=True, stdout=subprocess.DEVNULL, timeout=120)
+    params, grid_results = load_partial_results(merged)
+
+    maps = search_offsets(*images, WINDOW, METRIC_OPTIONS[1], collect_stats=True)
+    expected = reduce_grid_score_maps(maps, 2, 20)
+    assert sorted(grid_results) == sorted(expected)
+    for key, result in expected.items():
+        assert grid_results[key][:2] == result[:2]
+        np.testing.assert_allclose(grid_results[key][2:], result[2:], atol=1e-9)
+    assert params["shards"] == len(shards)
+    merged_stats = summarize_global_stats(params["global_stats"], params["max_value"])
+    for merged_item, item in zip(merged_stats, summarize_global_stats(maps.stats, 255.0)):
+        assert merged_item["histogram"] == item["histogram"]
+        assert merged_item["mse"] == pytest.approx(item["mse"])
+
+
+def greedy_nms(maps, mode, window_size, max_results, max_iou):
+    """逐一檢查所有窗口的參考實作：分數由高到低 (同分時起點先y後x)，與已選窗口的IoU都不超過上限才選入"""
+    scores = maps.diff2 - maps.diff1 if mode == 1 else maps.diff1 - maps.diff2
+    rows, cols = np.indices(scores.shape)
+    order = sorted(zip((-scores).ravel().tolist(), rows.ravel().tolist(), cols.ravel().tolist()))
+    accepted = []
+    for negative_score, row, col in order:
+        x, y = maps.x0 + col * maps.stride, maps.y0 + row * maps.stride
+        if all(window_iou(x - ax, y - ay, window_size) <= max_iou for ax, ay in accepted):
+            accepted.append((x, y))
+            if len(accepted) == max_results:
+                break
+    return accepted
+
+
+@pytest.mark.parametrize("stride, max_results, max_iou", [(1, 15, 0.0), (1, 40, 0.3), (2, 25, 0.1)])
+def test_nms_matches_greedy_reference(images, stride, max_results, max_iou):
+    maps = search_offsets(*images, WINDOW, METRIC_OPTIONS[0], stride=stride, backend="serial")
+    results = reduce_nms_score_maps(maps, 1, WINDOW, max_results, max_iou)
+    assert [result[:2] for result in results] == greedy_nms(maps, 1, WINDOW, max_results, max_iou)
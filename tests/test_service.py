@@ -0,0 +1,84 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+pytest.importorskip("PyQt5")
+
+from PIL import Image
+
+from image_comparison_tool import ComparisonRequestHandler, ComparisonService, ComparisonServiceClient
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for name in ("img1", "img2", "gt"):
+        paths.append(str(tmp_path / f"{name}.png"))
+        Image.fromarray(rng.integers(0, 256, (96, 96, 3), dtype=np.uint8)).save(paths[-1])
+    return paths
+
+
+def search_params(paths, **params):
+    return dict(params, img1=paths[0], img2=paths[1], gt=paths[2])
+
+
+@pytest.fixture
+def server():
+    service = ComparisonService(workers=2)
+    handler = type("TestRequestHandler", (ComparisonRequestHandler,), {"service": service})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+    service.shutdown()
+
+
+def test_completed_searches_are_evicted_to_fit_budget(image_paths):
+    budget = 1_500_000
+    service = ComparisonService(workers=2, memory_budget=budget)
+    try:
+        search_ids = []
+        for window_size in (8, 9, 10, 11):
+            search_ids.append(service.start_search(search_params(image_paths, window_size=window_size, grid_size=2)))
+            assert service.get_search(search_ids[-1], wait=True)["status"] == "done"
+            assert service.cache_bytes() <= budget
+        # 最早完成的搜尋及其結果被釋放，最新的搜尋仍可查詢
+        assert search_ids[0] not in service.searches
+        assert search_ids[-1] in service.searches
+    finally:
+        service.shutdown()
+
+
+@pytest.mark.parametrize("field, value", [("window_size", 0), ("grid_size", 0), ("max_results", 0),
+                                          ("max_iou", 1.5), ("split_threshold", -1), ("mode", 3),
+                                          ("window_size", "abc")])
+def test_invalid_search_params_are_rejected(image_paths, server, field, value):
+    service = ComparisonService(workers=1)
+    try:
+        with pytest.raises(ValueError, match=field):
+            service.start_search(search_params(image_paths, **{field: value}))
+        assert not service.searches
+    finally:
+        service.shutdown()
+    # 比較服務以 400 回應並指出欄位
+    client = ComparisonServiceClient(server)
+    search = {"window_size": 8, "mode": 1}
+    reduction = {"grid_size": 4}
+    (search if field in search else reduction)[field] = value
+    with pytest.raises(RuntimeError, match=field):
+        client.search(*image_paths, search["window_size"], search["mode"], "MSE", reduction)
+
+
+def test_client_polls_until_done_and_can_stop(image_paths, server):
+    client = ComparisonServiceClient(server)
+    reduction = {"reducer": "grid", "grid_size": 4}
+    waited = client.search(*image_paths, 8, 1, "MSE", reduction)
+    polled = client.search(*image_paths, 8, 1, "MSE", reduction, stop_requested=lambda: False)
+    assert polled["status"] == "done"
+    assert polled["results"] == waited["results"]
+    assert client.search(*image_paths, 9, 1, "MSE", reduction, stop_requested=lambda: True) is None